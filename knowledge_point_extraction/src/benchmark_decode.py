@@ -0,0 +1,96 @@
+"""
+# CRF 解码 + BMES 知识点抽取基准测试(CPU)
+    fastNLP viterbi_decode + 逐条 get_answers  vs  batched_viterbi_decode + get_answers_batch
+    两种方式结果逐条校验一致.
+    python -m src.benchmark_decode --batch_sizes=1,4,16,64 --max_len=256
+"""
+import time
+import random
+import logging
+import argparse
+import torch
+import torch.nn.functional as F
+from fastNLP.modules import ConditionalRandomField, allowed_transitions
+
+from src.models.knowledge_point_extraction import crf_transitions, batched_viterbi_decode
+from src.inference import ID2LABEL, get_answers, get_answers_batch
+
+logger = logging.getLogger(__name__)
+
+
+def set_parameters():
+    parse = argparse.ArgumentParser(description="CRF 解码基准测试")
+    parse.add_argument("--batch_sizes", type=str, default="1,2,4,8,16,32,64", help="batch 大小, 逗号分隔.")
+    parse.add_argument("--max_len", type=int, default=256, help="最大序列长度.")
+    parse.add_argument("--repeat", type=int, default=20, help="重复次数.")
+    parse.add_argument("--num_threads", type=int, default=None, help="torch CPU 线程数.")
+    parse.add_argument("--seed", type=int, default=1234, help="随机种子.")
+    return parse.parse_args()
+
+
+def create_crf():
+    trans = allowed_transitions(tag_vocab=ID2LABEL, include_start_end=True)
+    crf = ConditionalRandomField(num_tags=len(ID2LABEL), include_start_end_trans=True, allowed_transitions=trans)
+    # 训练后的 CRF 转移分数不再是标准正态, 放大使解码路径中出现较多 B/M/E
+    with torch.no_grad():
+        crf.trans_m.mul_(3.0)
+    return crf
+
+
+def create_batch(batch_size, max_len, rng):
+    lengths = torch.tensor([rng.randint(1, max_len) for _ in range(batch_size)])
+    lengths[0] = max_len
+    logits = F.log_softmax(torch.randn(batch_size, max_len, len(ID2LABEL)) * 3, dim=-1)
+    mask = torch.arange(max_len).unsqueeze(0) < lengths.unsqueeze(1)
+    contexts = ["".join(chr(0x4e00 + rng.randint(0, 3000)) for _ in range(length)) for length in lengths.tolist()]
+    return logits, mask, lengths, contexts
+
+
+def baseline_decode(crf, logits, mask, lengths, contexts):
+    # fastNLP viterbi_decode 会原地修改 logits[:, 0]
+    paths, _ = crf.viterbi_decode(logits.clone(), mask=mask)
+    return [get_answers(paths[i, :lengths[i]].tolist(), context) for i, context in enumerate(contexts)]
+
+
+def batched_decode(crf, logits, mask, lengths, contexts):
+    paths, _ = batched_viterbi_decode(logits, mask, *crf_transitions(crf))
+    return get_answers_batch(paths, lengths, contexts)
+
+
+def timeit(fn, repeat, *args):
+    fn(*args)  # warmup
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(*args)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    args = set_parameters()
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+    torch.manual_seed(args.seed)
+    rng = random.Random(args.seed)
+    crf = create_crf()
+
+    logger.info("{:>6} {:>14} {:>14} {:>8}".format("batch", "fastNLP ms", "batched ms", "speedup"))
+    with torch.no_grad():
+        for batch_size in [int(x) for x in args.batch_sizes.split(",")]:
+            batch = create_batch(batch_size, args.max_len, rng)
+            baseline_paths, _ = crf.viterbi_decode(batch[0].clone(), mask=batch[1])
+            paths, _ = batched_viterbi_decode(batch[0], batch[1], *crf_transitions(crf))
+            assert torch.equal(baseline_paths.masked_fill(~batch[1], 0), paths), "viterbi paths mismatch"
+            assert baseline_decode(crf, *batch) == batched_decode(crf, *batch), "answers mismatch"
+
+            baseline_ms = timeit(baseline_decode, args.repeat, crf, *batch)
+            batched_ms = timeit(batched_decode, args.repeat, crf, *batch)
+            logger.info("{:>6} {:>14.2f} {:>14.2f} {:>7.2f}x".format(
+                batch_size, baseline_ms, batched_ms, baseline_ms / batched_ms))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='[%(asctime)s %(filename)s:%(lineno)s] %(message)s',
+                        level=logging.INFO,
+                        filename=None,
+                        filemode='a')
+    main()
@@ -0,0 +1,84 @@
+"""
+# 滑动窗口模式下, 每个窗口的标签序列都必须满足 CRF 的转移约束(allowed_transitions)
+    cd knowledge_point_extraction/src && python -m pytest -q datasets/test_window_labels.py
+"""
+import json
+import random
+
+import numpy as np
+import pytest
+from transformers import BertTokenizerFast
+
+try:
+    from fastNLP.modules import allowed_transitions
+except ImportError:  # fastNLP >= 1.0
+    from fastNLP.modules.torch import allowed_transitions
+
+from datasets.tianchi_zhongyi_answer_extraction_datasets import ChineseMedicalAnswerExtractionDataset
+
+ID2LABEL = {0: "<pad>", 1: "S", 2: "B", 3: "M", 4: "E"}
+LABEL2ID = {value: key for key, value in ID2LABEL.items()}
+CHARS = [chr(code) for code in range(0x4e00, 0x4e00 + 400)]
+
+
+@pytest.fixture
+def tokenizer(tmp_path):
+    vocab_file = tmp_path / "vocab.txt"
+    vocab_file.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + CHARS), encoding="utf-8")
+    return BertTokenizerFast(vocab_file=str(vocab_file))
+
+
+def make_dataset(tmp_path, tokenizer, data, window, stride):
+    data_path = tmp_path / "data.json"
+    data_path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    return ChineseMedicalAnswerExtractionDataset(str(data_path), tokenizer, label2id=LABEL2ID, max_enc_len=window,
+                                                 cache_dir=str(tmp_path / "cache"), stride=stride)
+
+
+def make_doc(text, spans):
+    """spans: [(start, end)] token(字) 位置, 左闭右开"""
+    return {"text": text, "annotations": [{"Q": "", "A": text[start:end]} for start, end in spans]}
+
+
+def assert_allowed(dataset):
+    allowed = set(allowed_transitions(ID2LABEL, include_start_end=True))
+    start_tag, end_tag = len(ID2LABEL), len(ID2LABEL) + 1
+    for index in range(len(dataset)):
+        tags = [start_tag] + dataset[index]["labels"].tolist() + [end_tag]
+        for transition in zip(tags[:-1], tags[1:]):
+            assert transition in allowed, (index, dataset.windows[index], [ID2LABEL.get(t) for t in tags[1:-1]])
+
+
+def test_window_cuts_through_answers(tmp_path, tokenizer):
+    # 20 个 token 的文档, 窗口 8 步长 6, 知识点位于 token 4-6 与 7-9; 之后紧跟一个以知识点开头的文档
+    first = "".join(CHARS[:20])
+    second = "".join(CHARS[20:30])
+    dataset = make_dataset(tmp_path, tokenizer, [make_doc(first, [(4, 7), (7, 10)]), make_doc(second, [(0, 4)])],
+                           window=8, stride=6)
+    labels = [[ID2LABEL[t] for t in dataset[i]["labels"].tolist()] for i in range(len(dataset))]
+    assert labels[0] == list("SSSSBMES")
+    assert labels[1] == list("SBMESSSS")
+    assert_allowed(dataset)
+
+
+def test_random_windows(tmp_path, tokenizer):
+    rng = random.Random(0)
+    data = []
+    for _ in range(50):
+        length = rng.randint(2, 60)
+        text = "".join(rng.sample(CHARS, length))  # 字不重复, 答案位置唯一
+        spans, position = [], 0
+        while position < length - 1:
+            position += rng.randint(0, 5)
+            end = position + rng.randint(2, 6)
+            if end > length:
+                break
+            spans.append((position, end))
+            position = end
+        if spans:
+            data.append(make_doc(text, spans))
+    for window, stride in ((8, 6), (5, 2), (16, 16), (3, 1)):
+        dataset = make_dataset(tmp_path, tokenizer, data, window=window, stride=stride)
+        assert len(dataset) == len(dataset.get_windows())
+        assert_allowed(dataset)
+        assert np.all(np.diff(dataset.windows, axis=1) <= window)
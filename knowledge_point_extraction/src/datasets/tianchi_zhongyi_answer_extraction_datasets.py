@@ -1,107 +1,226 @@
 """
 # 使用天池中医问题生成数据制作答案抽(知识点)取数据集, 参考序列标注
+# 首次加载时分词一次, token ids / labels / 字符偏移以扁平数组保存到磁盘缓存, 之后按样本以 memmap 懒加载,
+# batch 内动态 padding 由 ChineseMedicalAnswerExtractionCollator 完成
+# 设置 stride 时为长文档滑动窗口模式: 文档不截断, 以 max_enc_len 为窗口、stride 为步长切分为多个样本
 """
+import os
 import json
+import hashlib
 import logging
 from tqdm import tqdm
+import numpy as np
 import torch
 from torch.utils.data import Dataset
-from transformers import BertTokenizer
+from transformers import BertTokenizer, BertTokenizerFast
 
 logger = logging.getLogger(__name__)
+CACHE_FILES = ("input_ids", "labels", "token_offsets", "sample_offsets")
+
+
+def sliding_windows(length, window_size=512, stride=384):
+    """长度为 length 的序列按窗口切分, 返回 [(start, end), ...], 最后一个窗口与序列末尾对齐"""
+    if length <= window_size:
+        return [(0, length)]
+    starts = list(range(0, length - window_size, stride)) + [length - window_size]
+    return [(start, start + window_size) for start in starts]
 
 
 class ChineseMedicalAnswerExtractionDataset(Dataset):
     def __init__(self, data_path: str,
                  tokenizer: BertTokenizer,
                  label2id: dict = {"<pad>": 0, "S": 1, "B": 2, "M": 3, "E": 4},  # BMES label
-                 max_enc_len=512):
+                 max_enc_len=512,
+                 cache_dir=None,
+                 stride=None):
+        if not tokenizer.is_fast:
+            # 字符偏移(offset mapping)需要 fast tokenizer, 词表与分词结果与 BertTokenizer 一致
+            tokenizer = BertTokenizerFast.from_pretrained(tokenizer.name_or_path)
         self.tokenizer = tokenizer
         self.label2id = label2id
         self.max_encode_len = max_enc_len
+        self.stride = stride
+        self.cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(data_path)), ".cache")
 
-        self.samples = self.get_samples(data_path)
+        cache_path = self.get_cache_path(data_path)
+        if not all(os.path.exists(os.path.join(cache_path, name + ".npy")) for name in CACHE_FILES):
+            self.build_cache(data_path, cache_path)
+        self.input_ids, self.labels, self.token_offsets, self.sample_offsets = [
+            np.load(os.path.join(cache_path, name + ".npy"), mmap_mode="r") for name in CACHE_FILES]
+        # 每个样本(窗口)在扁平数组中的 [start, end)
+        self.windows = self.get_windows()
 
     def __len__(self):
-        return len(self.samples)
+        return len(self.windows)
 
     def __getitem__(self, index):
-        return self.samples[index]
-
-    def get_samples(self, data_path):
+        start, end = self.windows[index]
+        labels = torch.from_numpy(self.labels[start:end].astype(np.int64))
+        if self.stride is not None:
+            self.fix_window_labels(labels, end)
+        return {
+            "input_ids": torch.from_numpy(self.input_ids[start:end].astype(np.int64)),
+            "labels": labels,
+            "attention_mask": torch.ones(end - start, dtype=torch.float)
+        }
+
+    def fix_window_labels(self, labels, end):
+        """
+        窗口边界切断知识点时修正标签, 保证窗口内的标签序列满足 CRF 的转移约束:
+        开头的 M 改为 B, 开头的 E 改为 S; 结尾的 M 改为 E, 结尾单独的 B 改为 S
+        """
+        if labels[0] == self.label2id["M"]:
+            labels[0] = self.label2id["B"]
+        elif labels[0] == self.label2id["E"]:
+            labels[0] = self.label2id["S"]
+        # 只在当前文档内判断知识点是否延续到窗口之后
+        doc_end = self.sample_offsets[np.searchsorted(self.sample_offsets, end)]
+        continued = end < doc_end and self.labels[end] in (self.label2id["M"], self.label2id["E"])
+        if continued and labels[-1] == self.label2id["B"]:
+            labels[-1] = self.label2id["S"]
+        elif continued and labels[-1] == self.label2id["M"]:
+            labels[-1] = self.label2id["E"]
+
+    def get_windows(self):
+        sample_offsets = np.asarray(self.sample_offsets)
+        if self.stride is None:
+            return np.stack([sample_offsets[:-1], sample_offsets[1:]], axis=1)
+        windows = []
+        for doc_start, doc_end in zip(sample_offsets[:-1], sample_offsets[1:]):
+            for start, end in sliding_windows(int(doc_end - doc_start), self.max_encode_len, self.stride):
+                windows.append((doc_start + start, doc_start + end))
+        return np.asarray(windows, dtype=np.int64).reshape(-1, 2)
+
+    def get_char_offsets(self, index):
+        """每个 token 在预处理后 context 中的 [start, end) 字符位置"""
+        start, end = self.windows[index]
+        return np.asarray(self.token_offsets[start:end])
+
+    def get_cache_path(self, data_path):
+        """缓存与数据文件、分词器、最大长度和标签绑定, 任一变化都会重新构建"""
+        stat = os.stat(data_path)
+        key = json.dumps([os.path.abspath(data_path), stat.st_size, stat.st_mtime_ns,
+                          type(self.tokenizer).__name__, self.tokenizer.name_or_path, len(self.tokenizer),
+                          self.max_encode_len, self.stride is not None, sorted(self.label2id.items())])
+        name = os.path.splitext(os.path.basename(data_path))[0]
+        return os.path.join(self.cache_dir, "{}_{}".format(name, hashlib.md5(key.encode("utf-8")).hexdigest()[:16]))
+
+    def build_cache(self, data_path, cache_path):
         data = self.get_data(data_path)
-        samples = []
-        for id, single_data in enumerate(tqdm(data)):
-            context = single_data.get('text')
-            process_context = context.replace("\n", " ").replace("\t", " ").replace("\\", "")
-            context_tokens = self.tokenizer.tokenize(process_context)
-            if len(context_tokens) == 0:
-                # 忽略这条数据
-                continue
-            if len(context_tokens) > self.max_encode_len:
-                context_tokens = context_tokens[:self.max_encode_len]
-
-            labels = ['S'] * len(context_tokens)
-
-            answers = single_data.get('annotations')
-            nums = 0
-            for answer in answers:
-                answer_tokens = self.tokenizer.tokenize(answer.get("A"))
-                if len(answer_tokens) == 0:
-                    nums += 1
+        input_ids, labels, token_offsets, lengths = [], [], [], []
+        for chunk_start in tqdm(range(0, len(data), 1000)):
+            chunk = data[chunk_start:chunk_start + 1000]
+            contexts = [self.process_text(single_data.get('text')) for single_data in chunk]
+            # fast tokenizer 批量分词
+            # 窗口模式下保留完整文档
+            encodings = self.tokenizer(contexts, add_special_tokens=False, truncation=self.stride is None,
+                                       max_length=self.max_encode_len if self.stride is None else None,
+                                       return_offsets_mapping=True)
+            for i, single_data in enumerate(chunk):
+                sample = self.encode_sample(contexts[i], encodings["input_ids"][i],
+                                            encodings["offset_mapping"][i], single_data.get('annotations'))
+                if sample is None:
                     continue
-                try:
-                    # 确定答案在上下文的位置
-                    start_id, end_id = self.get_answer_span(context_tokens, answer_tokens)
-                except Exception:
-                    nums += 1
-                    continue
-                labels[start_id] = "B"
-                labels[start_id+1:end_id-1] = ["M"] * (len(answer_tokens) - 2)
-                labels[end_id-1] = "E"
-            if nums == len(answers):
-                # 答案匹配全为空
+                input_ids.append(sample[0])
+                labels.append(sample[1])
+                token_offsets.append(sample[2])
+                lengths.append(len(sample[0]))
+
+        arrays = {
+            "input_ids": np.concatenate(input_ids).astype(np.int32),
+            "labels": np.concatenate(labels).astype(np.int8),
+            "token_offsets": np.concatenate(token_offsets).astype(np.int32),
+            "sample_offsets": np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+        }
+        os.makedirs(cache_path, exist_ok=True)
+        for name, array in arrays.items():
+            # 先写临时文件再改名, 中断时不会留下不完整的缓存
+            tmp_file = os.path.join(cache_path, name + ".tmp.npy")
+            np.save(tmp_file, array)
+            os.replace(tmp_file, os.path.join(cache_path, name + ".npy"))
+        logger.info("Save {} samples ({} tokens) to {}".format(len(lengths), len(arrays["input_ids"]), cache_path))
+
+    @staticmethod
+    def process_text(text):
+        return text.replace("\n", " ").replace("\t", " ").replace("\\", "")
+
+    def encode_sample(self, process_context, input_ids, offset_mapping, answers):
+        """返回 (input_ids, label_ids, token_offsets: [num_tokens, 2]), 没有可匹配的答案时返回 None"""
+        if len(input_ids) == 0:
+            # 忽略这条数据
+            return None
+        token_offsets = np.asarray(offset_mapping, dtype=np.int32).reshape(-1, 2)
+        # 只在截断后的文本中匹配答案
+        process_context = process_context[:token_offsets[-1, 1]]
+        # 字符位置 -> token 位置, 不属于任何 token 的字符(空白)为 -1
+        char_to_token = np.full(len(process_context), -1, dtype=np.int64)
+        token_lengths = token_offsets[:, 1] - token_offsets[:, 0]
+        char_positions = np.arange(token_lengths.sum()) + np.repeat(
+            token_offsets[:, 0] - np.cumsum(token_lengths) + token_lengths, token_lengths)
+        char_to_token[char_positions] = np.repeat(np.arange(len(token_offsets)), token_lengths)
+
+        labels = ['S'] * len(input_ids)
+        nums = 0
+        for answer in answers:
+            # 确定答案在上下文的位置
+            span = self.get_answer_span(process_context, char_to_token, answer.get("A"))
+            if span is None:
+                nums += 1
                 continue
+            start_id, end_id = span
+            labels[start_id] = "B"
+            labels[start_id+1:end_id-1] = ["M"] * (end_id - start_id - 2)
+            labels[end_id-1] = "E"
+        if nums == len(answers):
+            # 答案匹配全为空
+            return None
 
-            input_ids = self.tokenizer.convert_tokens_to_ids(context_tokens)
-            # label_ids = list(map(lambda x: self.label2id[x], labels))
-            # assert len(input_ids) == len(label_ids), "the input and label data length is inconsistent."
-            mask_ids = [1.0] * len(input_ids)
-
-            extra = self.max_encode_len - len(input_ids)
-            if extra > 0:
-                input_ids += [self.tokenizer.pad_token_id] * extra
-                mask_ids += [0.0] * extra
-                labels += ["<pad>"] * extra
-
-            label_ids = list(map(lambda x: self.label2id[x], labels))
-            assert len(input_ids) == len(label_ids) == len(mask_ids), \
-                "the input and label data length is inconsistent."
-
-            samples.append({
-                "input_ids": torch.tensor(input_ids).long(),
-                "labels": torch.tensor(label_ids).long(),
-                "attention_mask": torch.tensor(mask_ids).float()
-            })
-
-        return samples
+        label_ids = [self.label2id[label] for label in labels]
+        return input_ids, label_ids, token_offsets
 
     def get_data(self, data_path):
         with open(data_path, mode='r', encoding='utf-8') as fp:
             return json.load(fp)
 
-    def get_answer_span(self, context: list, answer: list):
-        """获取答案在上下文中的位置"""
-        length = len(answer)
-        for i in range(len(context)):
-            # 对上下文子串进行对比
-            if context[i:i + length] == answer:
-                # 返回起始结束位置
-                return i, i + length
+    def get_answer_span(self, context: str, char_to_token: np.ndarray, answer: str):
+        """通过字符偏移获取答案在上下文 token 序列中的位置 [start, end), 未找到时返回 None"""
+        answer = self.process_text(answer).strip()
+        if len(answer) == 0:
+            return None
+        char_start = context.find(answer)
+        if char_start < 0:
+            return None
+        tokens = char_to_token[char_start:char_start + len(answer)]
+        tokens = tokens[tokens >= 0]
+        if len(tokens) == 0:
+            return None
+        return int(tokens[0]), int(tokens[-1]) + 1
+
+
+class ChineseMedicalAnswerExtractionCollator(object):
+    """动态 padding: 只 pad 到 batch 内最大长度"""
+    def __init__(self, pad_token_id=0, label_pad_id=0):
+        self.pad_token_id = pad_token_id
+        self.label_pad_id = label_pad_id
+
+    def __call__(self, features):
+        max_len = max(len(feature["input_ids"]) for feature in features)
+        batch = {
+            "input_ids": torch.full((len(features), max_len), self.pad_token_id, dtype=torch.long),
+            "attention_mask": torch.zeros((len(features), max_len), dtype=torch.float),
+        }
+        if "labels" in features[0]:
+            batch["labels"] = torch.full((len(features), max_len), self.label_pad_id, dtype=torch.long)
+        for i, feature in enumerate(features):
+            length = len(feature["input_ids"])
+            for key in batch:
+                batch[key][i, :length] = feature[key]
+
+        return batch
 
 
 if __name__ == '__main__':
-    tokenizer = BertTokenizer.from_pretrained("hfl/chinese-bert-wwm")
+    tokenizer = BertTokenizerFast.from_pretrained("hfl/chinese-bert-wwm")
     data_path = "../../data/round1_train_0907.json"
     dataset = ChineseMedicalAnswerExtractionDataset(data_path, tokenizer)
     print(dataset[0])
@@ -0,0 +1,221 @@
+"""
+# CPU 部署导出: bert + MLP 发射分数部分导出为 TorchScript(可选 ONNX), Linear 层 int8 动态量化,
+# CRF 转移分数单独保存, 解码使用 batched_viterbi_decode
+# 同时输出 eager / TorchScript fp32 / TorchScript int8 (/ ONNX) 的一致性校验与延迟对比报告
+    python -m src.export_model --model_dir=checkpoints --export_dir=checkpoints/export --data_file=data/juesai_1011.json
+"""
+import os
+import json
+import time
+import random
+import logging
+import argparse
+import numpy as np
+import torch
+from transformers import BertTokenizer
+
+from src.models.knowledge_point_extraction import (
+    KnowledgePointExtractionModel,
+    crf_transitions,
+    batched_viterbi_decode
+)
+from src.inference import ID2LABEL, tokenize_context, collate_batch, get_data_from_json_file
+
+logger = logging.getLogger(__name__)
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EMISSIONS_FILE = "emissions{}.pt"
+TRANSITIONS_FILE = "crf_transitions.pt"
+
+
+def set_parameters():
+    parse = argparse.ArgumentParser(description="知识点抽取模型 CPU 导出")
+    parse.add_argument("--model_dir", type=str, default=os.path.join(root, "checkpoints"), help="训练好的模型路径.")
+    parse.add_argument("--export_dir", type=str, default=os.path.join(root, "checkpoints/export"), help="导出路径.")
+    parse.add_argument("--data_file", type=str, default=None, help="校验/测速样本, 不设置时使用随机 token.")
+    parse.add_argument("--num_samples", type=int, default=64, help="校验/测速样本数.")
+    parse.add_argument("--batch_sizes", type=str, default="1,8,32", help="测速 batch 大小, 逗号分隔.")
+    parse.add_argument("--max_encode_len", type=int, default=512, help="最大 token 长度.")
+    parse.add_argument("--repeat", type=int, default=5, help="测速重复次数.")
+    parse.add_argument("--onnx", action="store_true", help="同时导出 ONNX(需要 onnx / onnxruntime).")
+    parse.add_argument("--num_threads", type=int, default=None, help="torch CPU 线程数.")
+    return parse.parse_args()
+
+
+class EmissionModule(torch.nn.Module):
+    """导出用: 只包含 bert + MLP 发射分数部分"""
+    def __init__(self, model: KnowledgePointExtractionModel):
+        super(EmissionModule, self).__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model.emissions(input_ids, attention_mask=attention_mask)
+
+
+class ExportedExtractor(object):
+    """加载导出的发射分数模型与 CRF 转移分数, 调用方式与 KnowledgePointExtractionModel 推理一致"""
+    def __init__(self, export_dir, quantized=True):
+        self.emission_model = torch.jit.load(
+            os.path.join(export_dir, EMISSIONS_FILE.format("_int8" if quantized else "")), map_location="cpu")
+        self.transitions = torch.load(os.path.join(export_dir, TRANSITIONS_FILE))
+
+    def emissions(self, input_ids, attention_mask=None):
+        if attention_mask is None:
+            attention_mask = input_ids.ne(0).float()
+        return self.emission_model(input_ids, attention_mask)
+
+    def viterbi_decode(self, logits, mask):
+        return batched_viterbi_decode(logits, mask, *self.transitions)
+
+    def __call__(self, input_ids, attention_mask=None):
+        if attention_mask is None:
+            attention_mask = input_ids.ne(0).float()
+        with torch.no_grad():
+            logits = self.emissions(input_ids, attention_mask=attention_mask)
+            paths, _ = self.viterbi_decode(logits, attention_mask)
+        return {"pred": paths}
+
+
+def export_torchscript(model, example_inputs, export_dir):
+    """fp32 与 int8(Linear 动态量化) 两个 TorchScript 模型, 以及 CRF 转移分数"""
+    os.makedirs(export_dir, exist_ok=True)
+    emission_module = EmissionModule(model).eval()
+    quantized_module = torch.quantization.quantize_dynamic(emission_module, {torch.nn.Linear}, dtype=torch.qint8)
+
+    with torch.no_grad():
+        for suffix, module in (("", emission_module), ("_int8", quantized_module)):
+            traced = torch.jit.trace(module, example_inputs, check_trace=False)
+            traced.save(os.path.join(export_dir, EMISSIONS_FILE.format(suffix)))
+    torch.save(crf_transitions(model.kpe_crf), os.path.join(export_dir, TRANSITIONS_FILE))
+    logger.info("Export TorchScript models to {}".format(export_dir))
+
+
+def export_onnx(model, example_inputs, export_dir):
+    """ONNX fp32 导出, onnxruntime 动态量化为 int8"""
+    try:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+    except ImportError:
+        logger.warning("onnxruntime is not installed, skip ONNX export.")
+        return None
+
+    onnx_file = os.path.join(export_dir, "emissions.onnx")
+    torch.onnx.export(EmissionModule(model).eval(), example_inputs, onnx_file,
+                      input_names=["input_ids", "attention_mask"], output_names=["emissions"],
+                      dynamic_axes={"input_ids": {0: "batch", 1: "length"},
+                                    "attention_mask": {0: "batch", 1: "length"},
+                                    "emissions": {0: "batch", 1: "length"}},
+                      opset_version=14)
+    quantized_file = os.path.join(export_dir, "emissions_int8.onnx")
+    quantize_dynamic(onnx_file, quantized_file, weight_type=QuantType.QInt8)
+    logger.info("Export ONNX models to {}".format(export_dir))
+
+    return quantized_file
+
+
+class OnnxEmissions(object):
+    def __init__(self, onnx_file):
+        import onnxruntime
+        self.session = onnxruntime.InferenceSession(onnx_file, providers=["CPUExecutionProvider"])
+
+    def __call__(self, input_ids, attention_mask):
+        outputs = self.session.run(["emissions"], {"input_ids": input_ids.numpy(),
+                                                   "attention_mask": attention_mask.numpy()})
+        return torch.from_numpy(outputs[0])
+
+
+def load_samples(args, tokenizer):
+    """校验/测速样本 token ids"""
+    if args.data_file:
+        data = get_data_from_json_file(args.data_file)[:args.num_samples]
+        return [tokenize_context(tokenizer, single["text"], max_encode_len=args.max_encode_len) for single in data]
+    rng = random.Random(1234)
+    return [[rng.randint(len(tokenizer.all_special_ids), len(tokenizer) - 1)
+             for _ in range(rng.randint(16, args.max_encode_len))] for _ in range(args.num_samples)]
+
+
+def compare(model, emission_fns, samples, transitions, batch_size=8):
+    """与 eager 模型比较发射分数最大误差与解码路径一致率"""
+    report = {name: {"max_abs_diff": 0.0, "path_tokens": 0, "path_matches": 0} for name in emission_fns}
+    for start in range(0, len(samples), batch_size):
+        inputs = collate_batch(samples[start:start + batch_size])
+        mask = inputs["attention_mask"].bool()
+        with torch.no_grad():
+            expected = model.emissions(**inputs)
+            expected_paths, _ = batched_viterbi_decode(expected, mask, *transitions)
+            for name, emission_fn in emission_fns.items():
+                logits = emission_fn(inputs["input_ids"], inputs["attention_mask"])
+                paths, _ = batched_viterbi_decode(logits, mask, *transitions)
+                report[name]["max_abs_diff"] = max(report[name]["max_abs_diff"],
+                                                   float((logits - expected)[mask].abs().max()))
+                report[name]["path_tokens"] += int(mask.sum())
+                report[name]["path_matches"] += int((paths == expected_paths)[mask].sum())
+    for name in report:
+        report[name]["path_agreement"] = report[name]["path_matches"] / max(report[name]["path_tokens"], 1)
+
+    return report
+
+
+def latency(emission_fn, samples, transitions, batch_size, repeat):
+    """发射分数 + viterbi 解码, 每条样本平均耗时(ms)"""
+    batches = [collate_batch(samples[start:start + batch_size]) for start in range(0, len(samples), batch_size)]
+    with torch.no_grad():
+        emission_fn(batches[0]["input_ids"], batches[0]["attention_mask"])  # warmup
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for inputs in batches:
+                logits = emission_fn(inputs["input_ids"], inputs["attention_mask"])
+                batched_viterbi_decode(logits, inputs["attention_mask"].bool(), *transitions)
+    return (time.perf_counter() - start) * 1000 / (repeat * len(samples))
+
+
+def main():
+    args = set_parameters()
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+    tokenizer = BertTokenizer.from_pretrained(args.model_dir)
+    model = KnowledgePointExtractionModel.from_pretrained(args.model_dir).eval()
+    transitions = crf_transitions(model.kpe_crf)
+    samples = load_samples(args, tokenizer)
+
+    example_inputs = tuple(collate_batch(samples[:2]).values())
+    export_torchscript(model, example_inputs, args.export_dir)
+    emission_fns = {
+        "torchscript_fp32": torch.jit.load(os.path.join(args.export_dir, EMISSIONS_FILE.format(""))),
+        "torchscript_int8": torch.jit.load(os.path.join(args.export_dir, EMISSIONS_FILE.format("_int8"))),
+    }
+    if args.onnx:
+        onnx_file = export_onnx(model, example_inputs, args.export_dir)
+        if onnx_file is not None:
+            emission_fns["onnx_int8"] = OnnxEmissions(onnx_file)
+
+    report = {"num_samples": len(samples), "num_tags": len(ID2LABEL),
+              "mean_tokens": float(np.mean([len(sample) for sample in samples]))}
+    report["parity"] = compare(model, emission_fns, samples, transitions)
+    # fp32 导出与 eager 计算一致
+    assert report["parity"]["torchscript_fp32"]["max_abs_diff"] < 1e-3, report["parity"]["torchscript_fp32"]
+    for name, result in report["parity"].items():
+        logger.info("{}: max abs diff {:.6f}, path agreement {:.4f}".format(
+            name, result["max_abs_diff"], result["path_agreement"]))
+
+    emission_fns["eager_fp32"] = lambda input_ids, attention_mask: model.emissions(input_ids, attention_mask)
+    report["latency_ms_per_sample"] = {}
+    for batch_size in [int(x) for x in args.batch_sizes.split(",")]:
+        report["latency_ms_per_sample"][batch_size] = {
+            name: latency(emission_fn, samples, transitions, batch_size, args.repeat)
+            for name, emission_fn in emission_fns.items()}
+        logger.info("batch {}: {}".format(batch_size, ", ".join(
+            "{} {:.2f}ms".format(name, value) for name, value in report["latency_ms_per_sample"][batch_size].items())))
+
+    report_file = os.path.join(args.export_dir, "export_report.json")
+    with open(report_file, mode='w', encoding='utf-8') as fw:
+        json.dump(report, fw, ensure_ascii=False, indent=2)
+    logger.info("Save report to {}".format(report_file))
+
+    return report
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='[%(asctime)s %(filename)s:%(lineno)s] %(message)s',
+                        level=logging.INFO,
+                        filename=None,
+                        filemode='a')
+    main()
@@ -5,10 +5,14 @@ import os
 os.environ["CUDA_VISIBLE_DEVICES"] = '1'
 import logging
 import json
+import argparse
+import multiprocessing
+from collections import Counter
 from rouge import Rouge  # F1---评测指标
 import torch
 from transformers import BertTokenizer
 from src.models.knowledge_point_extraction import KnowledgePointExtractionModel
+from src.datasets.tianchi_zhongyi_answer_extraction_datasets import sliding_windows
 
 logger = logging.getLogger(__name__)
 root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -21,18 +25,23 @@ def get_data_from_json_file(json_file):
         return json.load(fp)
 
 
-def text2id(tokenizer, context, max_encode_len=512):
-    """context text 2 ids"""
+def tokenize_context(tokenizer, context, max_encode_len=512):
+    """context text 2 ids, 不做 padding, max_encode_len 为 None 时不截断"""
     process_context = context.replace("\n", " ").replace("\t", " ").replace("\\", "")
     context_tokens = tokenizer.tokenize(process_context)
-    if len(context_tokens) > max_encode_len:
+    if max_encode_len is not None and len(context_tokens) > max_encode_len:
         context_tokens = context_tokens[:max_encode_len]
 
-    input_ids = tokenizer.convert_tokens_to_ids(context_tokens)
+    return tokenizer.convert_tokens_to_ids(context_tokens)
+
+
+def text2id(tokenizer, context, max_encode_len=512, padding=True):
+    """context text 2 ids, padding 为 False 时只保留实际长度"""
+    input_ids = tokenize_context(tokenizer, context, max_encode_len=max_encode_len)
     mask_ids = [1.0] * len(input_ids)
 
     extra = max_encode_len - len(input_ids)
-    if extra > 0:
+    if padding and extra > 0:
         input_ids += [tokenizer.pad_token_id] * extra
         mask_ids += [0.0] * extra
 
@@ -42,6 +51,18 @@ def text2id(tokenizer, context, max_encode_len=512):
         }
 
 
+def collate_batch(batch_input_ids, pad_token_id=0):
+    """动态 padding: 只 pad 到 batch 内最大长度"""
+    max_len = max(max(len(input_ids) for input_ids in batch_input_ids), 1)
+    input_ids = torch.full((len(batch_input_ids), max_len), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(batch_input_ids), max_len), dtype=torch.float)
+    for i, ids in enumerate(batch_input_ids):
+        input_ids[i, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+        attention_mask[i, :len(ids)] = 1.0
+
+    return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+
 def get_answers(predict_label, context):
     """获取知识点列表"""
     answers = []
@@ -66,20 +87,210 @@ def get_answers(predict_label, context):
 
 
 def predict(model, tokenizer, context, device="cpu", max_encode_len=512):
-    inputs = text2id(tokenizer, context, max_encode_len=max_encode_len)
+    inputs = text2id(tokenizer, context, max_encode_len=max_encode_len, padding=False)
     for key, value in inputs.items():
         inputs[key] = value.unsqueeze(0).to(device)
 
-    results = model(**inputs)["pred"]
+    with torch.no_grad():
+        results = model(**inputs)["pred"]
+
+    return results[0].tolist()
+
+
+def iter_predict_batches(model, tokenizer, contexts, device="cpu", batch_size=32, max_encode_len=512):
+    """按 token 长度排序后分 batch, 每个 batch 只 pad 到最大长度, encoder + CRF 解码按 batch 执行
+    依次返回 (batch_index: contexts 中的下标, paths: [batch, max_len], lengths: [batch])"""
+    all_input_ids = [tokenize_context(tokenizer, context, max_encode_len=max_encode_len) for context in contexts]
+    order = sorted(range(len(contexts)), key=lambda i: len(all_input_ids[i]), reverse=True)
+
+    for start in range(0, len(order), batch_size):
+        batch_index = order[start:start + batch_size]
+        inputs = collate_batch([all_input_ids[i] for i in batch_index], pad_token_id=tokenizer.pad_token_id)
+        lengths = inputs["attention_mask"].sum(1).long()
+        for key, value in inputs.items():
+            inputs[key] = value.to(device)
+
+        with torch.no_grad():
+            paths = model(**inputs)["pred"].cpu()
+        yield batch_index, paths, lengths
+
+
+def predict_batch(model, tokenizer, contexts, device="cpu", batch_size=32, max_encode_len=512):
+    """批量预测, 返回与 contexts 顺序一致的标签序列(不含 padding)"""
+    results = [None] * len(contexts)
+    for batch_index, paths, lengths in iter_predict_batches(model, tokenizer, contexts, device=device,
+                                                            batch_size=batch_size, max_encode_len=max_encode_len):
+        for row, index in enumerate(batch_index):
+            results[index] = paths[row, :lengths[row]].tolist()
+
+    return results
+
+
+def extract_spans(paths, lengths):
+    """向量化 BMES 解码, 与 get_answers 规则一致: B 开始, 其后连续的 M/E 属于同一知识点
+    paths: [batch, max_len]; lengths: [batch]; 返回每条样本的 [(start, end), ...], end 不包含"""
+    batch_size, max_len = paths.size()
+    positions = torch.arange(max_len).unsqueeze(0).expand(batch_size, max_len)
+    valid = positions < lengths.view(-1, 1)
+    is_cont = ((paths == LABEL2ID["M"]) | (paths == LABEL2ID["E"])) & valid
+    # 每个位置向前最近的非 M/E 位置, 若该位置为 B 则当前位置属于以它开头的知识点
+    breaks = torch.where(is_cont, torch.full_like(positions, -1), positions)
+    starts = breaks.cummax(1).values
+    in_span = (starts >= 0) & (paths.gather(1, starts.clamp(min=0)) == LABEL2ID["B"]) & valid
+    next_cont = torch.cat([is_cont[:, 1:], is_cont.new_zeros((batch_size, 1))], dim=1)
+    is_end = in_span & ~next_cont
+
+    spans = [[] for _ in range(batch_size)]
+    rows, ends = is_end.nonzero(as_tuple=True)
+    for row, start, end in zip(rows.tolist(), starts[rows, ends].tolist(), ends.tolist()):
+        spans[row].append((start, end + 1))
+
+    return spans
+
+
+def get_answers_batch(paths, lengths, contexts):
+    """batch 版本 get_answers, 标签与 context 按字符对齐"""
+    answers = []
+    for spans, context in zip(extract_spans(paths, lengths), contexts):
+        answers.append([context[start:min(end, len(context))] for start, end in spans if start < len(context)])
+
+    return answers
+
 
-    return results[0]
+def predict_answers(model, tokenizer, contexts, device="cpu", batch_size=32, max_encode_len=512):
+    """批量预测知识点, 返回与 contexts 顺序一致的知识点列表"""
+    results = [None] * len(contexts)
+    for batch_index, paths, lengths in iter_predict_batches(model, tokenizer, contexts, device=device,
+                                                            batch_size=batch_size, max_encode_len=max_encode_len):
+        batch_answers = get_answers_batch(paths, lengths, [contexts[index] for index in batch_index])
+        for index, answers in zip(batch_index, batch_answers):
+            results[index] = answers
 
+    return results
 
-def evaluate():
-    pass
 
+def predict_answers_long(model, tokenizer, contexts, device="cpu", batch_size=32, window_size=512, stride=384):
+    """长文档滑动窗口预测: 所有文档的窗口一起按长度排序分 batch 计算发射分数,
+    重叠 token 的发射分数取平均后, 每篇文档整体只做一次 viterbi 解码"""
+    all_input_ids = [tokenize_context(tokenizer, context, max_encode_len=None) for context in contexts]
+    windows = [(doc, start, end) for doc, input_ids in enumerate(all_input_ids)
+               for start, end in sliding_windows(len(input_ids), window_size, stride)]
+    num_tags = len(ID2LABEL)
+    emissions = [torch.zeros(len(input_ids), num_tags) for input_ids in all_input_ids]
+    counts = [torch.zeros(len(input_ids), 1) for input_ids in all_input_ids]
 
-def main(do_eval=False):
+    order = sorted(range(len(windows)), key=lambda i: windows[i][2] - windows[i][1], reverse=True)
+    for batch_start in range(0, len(order), batch_size):
+        batch_windows = [windows[i] for i in order[batch_start:batch_start + batch_size]]
+        inputs = collate_batch([all_input_ids[doc][start:end] for doc, start, end in batch_windows],
+                               pad_token_id=tokenizer.pad_token_id)
+        for key, value in inputs.items():
+            inputs[key] = value.to(device)
+        with torch.no_grad():
+            logits = model.emissions(**inputs).cpu()
+        for row, (doc, start, end) in enumerate(batch_windows):
+            emissions[doc][start:end] += logits[row, :end - start]
+            counts[doc][start:end] += 1
+
+    results = [None] * len(contexts)
+    doc_order = sorted(range(len(contexts)), key=lambda i: len(all_input_ids[i]), reverse=True)
+    for batch_start in range(0, len(doc_order), batch_size):
+        batch_index = doc_order[batch_start:batch_start + batch_size]
+        lengths = torch.tensor([len(all_input_ids[i]) for i in batch_index], dtype=torch.long)
+        logits = torch.zeros(len(batch_index), max(int(lengths.max()), 1), num_tags)
+        for row, index in enumerate(batch_index):
+            logits[row, :lengths[row]] = emissions[index] / counts[index].clamp(min=1)
+        mask = torch.arange(logits.size(1)).unsqueeze(0) < lengths.unsqueeze(1)
+        with torch.no_grad():
+            paths, _ = model.viterbi_decode(logits.to(device), mask.to(device))
+        batch_answers = get_answers_batch(paths.cpu(), lengths, [contexts[index] for index in batch_index])
+        for index, answers in zip(batch_index, batch_answers):
+            results[index] = answers
+
+    return results
+
+
+def lcs_length(a, b):
+    """最长公共子序列长度, 单行滚动 DP"""
+    if len(a) < len(b):
+        a, b = b, a
+    row = [0] * (len(b) + 1)
+    for char_a in a:
+        prev = 0
+        for j, char_b in enumerate(b):
+            prev, row[j + 1] = row[j + 1], prev + 1 if char_a == char_b else max(row[j + 1], row[j])
+    return row[-1]
+
+
+def span_scores(prediction, gold):
+    """字级别 exact match / F1 / Rouge-L(F1)"""
+    if len(prediction) == 0 or len(gold) == 0:
+        return 0.0, 0.0, 0.0
+    em = float(prediction == gold)
+    common = sum((Counter(prediction) & Counter(gold)).values())
+    f1 = 2.0 * common / (len(prediction) + len(gold))
+    lcs = lcs_length(prediction, gold)
+    rouge_l = 2.0 * lcs / (len(prediction) + len(gold))
+
+    return em, f1, rouge_l
+
+
+def score_sample(args):
+    """每个标注答案取与预测知识点的最高分, 再在标注答案上求平均"""
+    predictions, golds = args
+    scores = {"em": 0.0, "f1": 0.0, "rouge_l": 0.0}
+    if len(golds) == 0:
+        return scores
+    for gold in golds:
+        best = [max(values) for values in zip(*[span_scores(prediction, gold) for prediction in predictions])] \
+            if predictions else [0.0, 0.0, 0.0]
+        for key, value in zip(("em", "f1", "rouge_l"), best):
+            scores[key] += value / len(golds)
+
+    return scores
+
+
+def score_samples(predictions, golds, num_workers=None):
+    """多进程计算每条样本的指标"""
+    num_workers = num_workers or multiprocessing.cpu_count()
+    pairs = list(zip(predictions, golds))
+    if num_workers <= 1:
+        return [score_sample(pair) for pair in pairs]
+    with multiprocessing.Pool(num_workers) as pool:
+        return pool.map(score_sample, pairs, chunksize=max(1, len(pairs) // (num_workers * 4)))
+
+
+def evaluate(model, tokenizer, dataset, device="cpu", batch_size=32, max_encode_len=512,
+             min_answer_len=5, num_workers=None, output_file=None, stride=None):
+    """批量预测 + 多进程评估, 逐条结果以 json lines 写入 output_file, 返回整体平均指标
+    stride 不为 None 时使用滑动窗口预测完整长文档"""
+    contexts = [single["text"] for single in dataset]
+    if stride is None:
+        predictions = predict_answers(model, tokenizer, contexts, device=device,
+                                      batch_size=batch_size, max_encode_len=max_encode_len)
+    else:
+        predictions = predict_answers_long(model, tokenizer, contexts, device=device, batch_size=batch_size,
+                                           window_size=max_encode_len, stride=stride)
+    predictions = [[answer for answer in answers if len(answer) >= min_answer_len] for answers in predictions]
+    golds = [[qa["A"] for qa in single["annotations"]] for single in dataset]
+    sample_scores = score_samples(predictions, golds, num_workers=num_workers)
+
+    if output_file is not None:
+        with open(output_file, mode='w', encoding='utf-8') as fw:
+            for index, (prediction, gold, scores) in enumerate(zip(predictions, golds, sample_scores)):
+                result = {"index": index, "predictions": prediction, "golds": gold}
+                result.update(scores)
+                fw.write(json.dumps(result, ensure_ascii=False) + "\n")
+        logger.info("Save per-sample results to {}".format(output_file))
+
+    metrics = {}
+    for key in ("em", "f1", "rouge_l"):
+        metrics[key] = sum(scores[key] for scores in sample_scores) / max(len(sample_scores), 1)
+
+    return metrics
+
+
+def main(do_eval=False, batch_size=32, num_workers=None, stride=None):
     logger.info("Load self trained model")
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     model_dir = os.path.join(root, "checkpoints")
@@ -91,20 +302,25 @@ def main(do_eval=False):
     test_data_path = os.path.join(root, "data/juesai_1011.json")
     test_dataset = get_data_from_json_file(test_data_path)
     if do_eval:
-        pass
+        metrics = evaluate(model, tokenizer, test_dataset, device=device, batch_size=batch_size,
+                           max_encode_len=512, num_workers=num_workers, stride=stride,
+                           output_file=os.path.join(root, "data/eval_results.jsonl"))
+        logger.info("EM: {em:.4f}, char F1: {f1:.4f}, Rouge-L: {rouge_l:.4f}".format(**metrics))
     else:
         rouge_obj = Rouge()
-        for id, single in enumerate(test_dataset):
-            context = single["text"]
+        contexts = [single["text"] for single in test_dataset]
+        if stride is None:
+            predict_results = predict_answers(model, tokenizer, contexts, device=device,
+                                              batch_size=batch_size, max_encode_len=512)
+        else:
+            predict_results = predict_answers_long(model, tokenizer, contexts, device=device,
+                                                   batch_size=batch_size, window_size=512, stride=stride)
+        for single, answers in zip(test_dataset, predict_results):
             labels = []
             qas = single["annotations"]
             for qa in qas:
                 labels.append(qa["A"])
 
-            predict_label = predict(model, tokenizer, context, device=device, max_encode_len=512)
-            logger.info(predict_label)
-
-            answers = get_answers(predict_label, context)
             logger.info(answers)
 
             for answer in answers:
@@ -120,5 +336,12 @@ if __name__ == '__main__':
                         level=logging.INFO,
                         filename=None,
                         filemode='a')
+    parse = argparse.ArgumentParser(description="知识点抽取推理/评估")
+    parse.add_argument("--do_eval", action="store_true", help="评估并输出逐条结果文件.")
+    parse.add_argument("--batch_size", type=int, default=32, help="推理 batch 大小.")
+    parse.add_argument("--num_workers", type=int, default=None, help="评估进程数, 默认 CPU 核数.")
+    parse.add_argument("--stride", type=int, default=None,
+                       help="设置时使用 512 长度滑动窗口预测完整长文档, 为相邻窗口起始位置间隔.")
+    args = parse.parse_args()
     logger.info("root dir: {}".format(root))
-    main()
+    main(do_eval=args.do_eval, batch_size=args.batch_size, num_workers=args.num_workers, stride=args.stride)
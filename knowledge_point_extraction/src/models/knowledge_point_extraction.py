@@ -20,6 +20,48 @@ from fastNLP.modules import (
 logger = logging.getLogger(__name__)
 
 
+def crf_transitions(crf: ConditionalRandomField):
+    """fastNLP CRF 参数合并约束(allowed_transitions)后的转移、起始、结束分数"""
+    num_tags = crf.num_tags
+    constrain = crf._constrain.data
+    transitions = constrain[:num_tags, :num_tags] + crf.trans_m.data
+    start_transitions = constrain[num_tags, :num_tags].clone()
+    end_transitions = constrain[:num_tags, num_tags + 1].clone()
+    if crf.include_start_end_trans:
+        start_transitions += crf.start_scores.data
+        end_transitions += crf.end_scores.data
+
+    return transitions, start_transitions, end_transitions
+
+
+def batched_viterbi_decode(logits, mask, transitions, start_transitions, end_transitions):
+    """batch 维与 tag 维全部张量化的 viterbi 解码, 只在时间维循环
+    logits: [batch_size, max_len, num_tags]; mask: [batch_size, max_len], 左对齐, 0 为 padding
+    返回 paths: [batch_size, max_len] (padding 位置为 0), scores: [batch_size]"""
+    batch_size, max_len, num_tags = logits.size()
+    mask = mask.bool()
+    trans = transitions.unsqueeze(0)  # 1 x from x to
+
+    score = start_transitions.unsqueeze(0) + logits[:, 0]  # bsz x num_tags
+    history = logits.new_zeros((max_len, batch_size, num_tags), dtype=torch.long)
+    for i in range(1, max_len):
+        best_score, history[i] = (score.unsqueeze(2) + trans).max(1)
+        # padding 位置保持上一步分数, 序列结束后分数不再变化
+        score = torch.where(mask[:, i].unsqueeze(1), best_score + logits[:, i], score)
+    scores, last_tags = (score + end_transitions.unsqueeze(0)).max(1)
+
+    # 回溯: padding 位置沿用最后一个有效位置的 tag
+    paths = logits.new_zeros((max_len, batch_size), dtype=torch.long)
+    paths[max_len - 1] = last_tags
+    for i in range(max_len - 1, 0, -1):
+        prev_tags = history[i].gather(1, last_tags.unsqueeze(1)).squeeze(1)
+        last_tags = torch.where(mask[:, i], prev_tags, last_tags)
+        paths[i - 1] = last_tags
+    paths = paths.transpose(0, 1).masked_fill(~mask, 0)
+
+    return paths, scores
+
+
 class KnowledgePointExtractionModel(BertPreTrainedModel):
     """知识抽取---参照序列标注模型
         1. Embedding - 8 layer以下bert model,
@@ -50,11 +92,7 @@ class KnowledgePointExtractionModel(BertPreTrainedModel):
                 labels=None,
                 attention_mask=None):
         """前向传播"""
-        bert_outputs = self.bert(input_ids, attention_mask=attention_mask, return_dict=True)
-        embedding_output = bert_outputs.last_hidden_state
-
-        mlp_outputs = self.kpe_mlp(embedding_output)
-        logits = F.log_softmax(mlp_outputs, dim=-1)
+        logits = self.emissions(input_ids, attention_mask=attention_mask)
 
         if attention_mask is None:
             attention_mask = input_ids.ne(0)
@@ -67,7 +105,20 @@ class KnowledgePointExtractionModel(BertPreTrainedModel):
             return (loss, )  # {"loss": loss}  # 4.0以上版本
         else:
             # inference
-            paths, _ = self.kpe_crf.viterbi_decode(logits, mask=attention_mask)
+            paths, _ = self.viterbi_decode(logits, attention_mask)
             return {"pred": paths}
 
         return logits
+
+    def emissions(self, input_ids, attention_mask=None):
+        """bert + MLP 得到每个 token 的 CRF 发射分数(log softmax)"""
+        bert_outputs = self.bert(input_ids, attention_mask=attention_mask, return_dict=True)
+        embedding_output = bert_outputs.last_hidden_state
+
+        mlp_outputs = self.kpe_mlp(embedding_output)
+        return F.log_softmax(mlp_outputs, dim=-1)
+
+    def viterbi_decode(self, logits, mask):
+        """张量化 batch viterbi 解码, 结果与 self.kpe_crf.viterbi_decode 一致(padding 位置为 0)"""
+        transitions, start_transitions, end_transitions = crf_transitions(self.kpe_crf)
+        return batched_viterbi_decode(logits, mask, transitions, start_transitions, end_transitions)
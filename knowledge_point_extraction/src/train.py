@@ -3,21 +3,87 @@
 """
 import os
 os.environ["CUDA_VISIBLE_DEVICES"] = '0'
+import time
 import logging
+import argparse
+import torch
 from transformers import (
-    BertTokenizer,
+    BertTokenizerFast,
     BertConfig,
     Trainer,
     TrainingArguments
 )
 from src.models.knowledge_point_extraction import KnowledgePointExtractionModel
-from src.datasets.tianchi_zhongyi_answer_extraction_datasets import ChineseMedicalAnswerExtractionDataset
+from src.datasets.tianchi_zhongyi_answer_extraction_datasets import (
+    ChineseMedicalAnswerExtractionDataset,
+    ChineseMedicalAnswerExtractionCollator
+)
 
 logger = logging.getLogger(__name__)
 root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
+def set_parameters():
+    parse = argparse.ArgumentParser(description="知识点抽取模型训练")
+    parse.add_argument("--batch_size", type=int, default=96, help="每个设备每次前向的 batch 大小.")
+    parse.add_argument("--gradient_accumulation_steps", type=int, default=1,
+                       help="梯度累积步数, 实际 batch = batch_size * gradient_accumulation_steps.")
+    parse.add_argument("--precision", type=str, default="fp32", choices=["auto", "fp32", "bf16", "fp16"],
+                       help="默认 fp32, 混合精度需显式开启; auto: GPU 上 fp16(支持时 bf16), CPU 上 bf16 autocast.")
+    parse.add_argument("--group_by_length", action="store_true",
+                       help="长度相近的样本组成 batch, 减少 padding.")
+    parse.add_argument("--max_steps", type=int, default=5000, help="最大优化步数.")
+    parse.add_argument("--logging_steps", type=int, default=50, help="日志(含吞吐)间隔.")
+    return parse.parse_args()
+
+
+def get_precision_args(precision):
+    """TrainingArguments 的 fp16 / bf16 设置, fp16 只能在 GPU 上使用"""
+    cuda = torch.cuda.is_available()
+    if precision == "auto":
+        if cuda:
+            precision = "bf16" if torch.cuda.is_bf16_supported() else "fp16"
+        else:
+            precision = "bf16"
+    if precision == "fp16" and not cuda:
+        logger.warning("fp16 autocast needs GPU, use bf16 on CPU.")
+        precision = "bf16"
+    logger.info("Training precision: {}".format(precision))
+
+    precision_args = {"fp16": precision == "fp16", "bf16": precision == "bf16"}
+    if precision == "bf16" and not cuda:
+        # CPU bf16 autocast 需要显式使用 CPU 训练
+        precision_args["use_cpu"] = True
+    return precision_args
+
+
+class ThroughputTrainer(Trainer):
+    """在 Trainer 日志中加入训练吞吐: samples/sec 与 (非 padding) tokens/sec"""
+    def __init__(self, *args, **kwargs):
+        super(ThroughputTrainer, self).__init__(*args, **kwargs)
+        self.throughput_samples = 0
+        self.throughput_tokens = 0
+        self.throughput_start = None
+
+    def training_step(self, model, inputs, *args, **kwargs):
+        if self.throughput_start is None:
+            self.throughput_start = time.perf_counter()
+        self.throughput_samples += inputs["input_ids"].size(0)
+        self.throughput_tokens += int(inputs["attention_mask"].sum())
+        return super(ThroughputTrainer, self).training_step(model, inputs, *args, **kwargs)
+
+    def log(self, logs, *args, **kwargs):
+        if "loss" in logs and self.throughput_start is not None:
+            elapsed = time.perf_counter() - self.throughput_start
+            logs["train_samples_per_second"] = round(self.throughput_samples / elapsed, 2)
+            logs["train_tokens_per_second"] = round(self.throughput_tokens / elapsed, 2)
+            self.throughput_samples, self.throughput_tokens = 0, 0
+            self.throughput_start = time.perf_counter()
+        super(ThroughputTrainer, self).log(logs, *args, **kwargs)
+
+
 def main():
+    args = set_parameters()
     id2label = {0: "<pad>", 1: "S", 2: "B", 3: "M", 4: "E"}  # label
     label2id = {}
     for key, value in id2label.items():
@@ -36,7 +102,7 @@ def main():
     config.num_hidden_layers = 4  # word2vec hidden layer size
 
     logger.info("Load pre-training model.")
-    tokenizer = BertTokenizer.from_pretrained("hfl/chinese-bert-wwm")
+    tokenizer = BertTokenizerFast.from_pretrained("hfl/chinese-bert-wwm")
     model = KnowledgePointExtractionModel.from_pretrained("hfl/chinese-bert-wwm", config=config)
     # for name, weight in zip(model.named_parameters(), model.parameters()):
     #     print("name: {} --- weight: {}".format(name, weight))
@@ -53,21 +119,26 @@ def main():
     train_args = TrainingArguments(
         output_dir=os.path.join(root, "checkpoints"),
         logging_dir=os.path.join(root, "logs"),
-        per_device_train_batch_size=96,
+        per_device_train_batch_size=args.batch_size,
         per_device_eval_batch_size=32,
-        max_steps=5000,
+        gradient_accumulation_steps=args.gradient_accumulation_steps,
+        group_by_length=args.group_by_length,
+        max_steps=args.max_steps,
         eval_steps=1000,
         save_steps=1000,
         # num_train_epochs=10,
         evaluation_strategy="steps",
         warmup_steps=500,
-        logging_steps=50
+        logging_steps=args.logging_steps,
+        **get_precision_args(args.precision)
     )
-    trainer = Trainer(
+    trainer = ThroughputTrainer(
         model=model,
         args=train_args,
         train_dataset=train_dataset,
         eval_dataset=valid_dataset,
+        data_collator=ChineseMedicalAnswerExtractionCollator(pad_token_id=tokenizer.pad_token_id,
+                                                             label_pad_id=label2id["<pad>"]),
     )
 
     logger.info("Train model.")
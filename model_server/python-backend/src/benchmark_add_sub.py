@@ -0,0 +1,118 @@
+"""
+# 本地对比 add_sub 模型逐请求计算与跨请求向量化计算
+    使用 utils/triton_python_backend_utils.py 作为 triton_python_backend_utils, 无需启动 Triton server.
+    python benchmark_add_sub.py --num_requests=64 --batch_size=1 --repeat=200
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import importlib.util
+
+import numpy as np
+
+work_root = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# model.py imports `triton_python_backend_utils`, provided by Triton at runtime
+pb_utils = load_module("triton_python_backend_utils",
+                       os.path.join(work_root, "utils/triton_python_backend_utils.py"))
+sys.modules["triton_python_backend_utils"] = pb_utils
+add_sub = load_module("add_sub_model", os.path.join(work_root, "models/add_sub/1/model.py"))
+
+
+def create_model(max_batch_size):
+    model_config = {
+        "name": "add_sub",
+        "max_batch_size": max_batch_size,
+        "input": [{"name": "INPUT0", "data_type": "TYPE_FP32", "dims": [4]},
+                  {"name": "INPUT1", "data_type": "TYPE_FP32", "dims": [4]}],
+        "output": [{"name": "OUTPUT0", "data_type": "TYPE_FP32", "dims": [4]},
+                   {"name": "OUTPUT1", "data_type": "TYPE_FP32", "dims": [4]}],
+    }
+    model = add_sub.TritonPythonModel()
+    model.initialize({"model_config": json.dumps(model_config)})
+    return model
+
+
+def create_requests(num_requests, batch_size, max_batch_size, pool=None):
+    """pool 不为 None 时输入写入共享内存, 模型按 (名称, offset) 读取共享内存视图"""
+    requests = []
+    for i in range(num_requests):
+        shape = [batch_size, 4] if max_batch_size > 0 else [4]
+        inputs = [pb_utils.Tensor("INPUT0", np.random.rand(*shape).astype(np.float32)),
+                  pb_utils.Tensor("INPUT1", np.random.rand(*shape).astype(np.float32))]
+        if pool is not None:
+            inputs = [pb_utils.Tensor.from_shared_memory(
+                tensor.name(), pool.name(), shape, np.float32,
+                pool.offset(pool.create_tensor(tensor.name(), tensor.as_numpy()))) for tensor in inputs]
+        requests.append(pb_utils.InferenceRequest(inputs, str(i), 0, ["OUTPUT0", "OUTPUT1"]))
+    return requests
+
+
+def check_outputs(model, requests):
+    """逐请求与向量化两种方式输出完全一致(数值与shape)"""
+    expected = model.execute_per_request(requests)
+    actual = model.execute_batched(requests)
+    assert len(expected) == len(actual) == len(requests)
+    for expected_response, actual_response in zip(expected, actual):
+        for expected_tensor, actual_tensor in zip(expected_response.output_tensors(),
+                                                  actual_response.output_tensors()):
+            assert expected_tensor.name() == actual_tensor.name()
+            assert expected_tensor.as_numpy().shape == actual_tensor.as_numpy().shape
+            assert np.array_equal(expected_tensor.as_numpy(), actual_tensor.as_numpy())
+
+
+def throughput(execute_fn, requests, repeat):
+    """每秒处理的请求数"""
+    execute_fn(requests)  # warmup
+    start = time.perf_counter()
+    for _ in range(repeat):
+        execute_fn(requests)
+    return len(requests) * repeat / (time.perf_counter() - start)
+
+
+def main():
+    parse = argparse.ArgumentParser(description="add_sub 逐请求 vs 向量化吞吐对比")
+    parse.add_argument("--num_requests", type=str, default="1,8,32,64",
+                       help="单次 execute 调用中的请求数, 逗号分隔.")
+    parse.add_argument("--batch_size", type=int, default=1, help="每个请求自身的 batch 大小.")
+    parse.add_argument("--max_batch_size", type=int, default=64,
+                       help="模型配置 max_batch_size, 0 表示输入不带 batch 维.")
+    parse.add_argument("--repeat", type=int, default=200, help="重复次数.")
+    parse.add_argument("--copy_tensors", action="store_true",
+                       help="Tensor 构造与 as_numpy 时复制数据(默认 zero-copy, 与 Triton 共享内存传递一致).")
+    parse.add_argument("--shared_memory", action="store_true",
+                       help="请求输入放在 SharedMemoryPool 中, 模型读取共享内存视图.")
+    args = parse.parse_args()
+
+    pb_utils.set_zero_copy(not args.copy_tensors)
+    model = create_model(args.max_batch_size)
+    print("{:>12} {:>18} {:>18} {:>8}".format("requests", "per-request req/s", "batched req/s", "speedup"))
+    for num_requests in [int(x) for x in args.num_requests.split(",")]:
+        pool = None
+        if args.shared_memory:
+            # 每个输入按 64 字节对齐
+            pool = pb_utils.SharedMemoryPool(num_requests * 2 * ((args.batch_size * 4 * 4 + 63) // 64 * 64))
+        requests = create_requests(num_requests, args.batch_size, args.max_batch_size, pool)
+        check_outputs(model, requests)
+        per_request = throughput(model.execute_per_request, requests, args.repeat)
+        batched = throughput(model.execute_batched, requests, args.repeat)
+        print("{:>12} {:>18.0f} {:>18.0f} {:>7.2f}x".format(
+            num_requests, per_request, batched, batched / per_request))
+        if pool is not None:
+            # 先释放共享内存上的视图
+            del requests
+            pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -23,41 +23,313 @@
 # OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+# Triton HTTP(KServe v2 协议) 压测客户端
+    以固定并发(闭环)或目标 QPS(开环)驱动模型, 可复用连接、使用 binary tensor 扩展传输数据,
+    输出吞吐与 p50/p90/p99 延迟直方图. --local_echo 启动进程内 echo server, 无需部署 Triton.
 
-from tritonclient.utils import *
-import tritonclient.grpc as grpcclient
-import tritonclient.http as httpclient
+    python client.py --url=localhost:8000 --model_name=add_sub --concurrency=8 --num_requests=2000
+    python client.py --local_echo --qps=500 --num_requests=2000 --binary --reuse_connection
+"""
+import json
+import time
+import socket
+import argparse
+import threading
+import http.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
-model_name = "add_sub"
-shape = [4]
-
-with httpclient.InferenceServerClient("localhost:8000") as client:
-    input0_data = np.random.rand(*shape).astype(np.float32)
-    input1_data = np.random.rand(*shape).astype(np.float32)
-    inputs = [
-        httpclient.InferInput("INPUT0", input0_data.shape,
-                              np_to_triton_dtype(input0_data.dtype)),
-        httpclient.InferInput("INPUT1", input1_data.shape,
-                              np_to_triton_dtype(input1_data.dtype)),
-    ]
-
-    inputs[0].set_data_from_numpy(input0_data)
-    inputs[1].set_data_from_numpy(input1_data)
-
-    outputs = [
-        httpclient.InferRequestedOutput("OUTPUT0"),
-        httpclient.InferRequestedOutput("OUTPUT1"),
-    ]
-
-    response = client.infer(model_name,
-                            inputs,
-                            request_id=str(1),
-                            outputs=outputs)
-
-    result = response.get_response()
-    print("INPUT0 ({}) + INPUT1 ({}) = OUTPUT0 ({})".format(
-        input0_data, input1_data, response.as_numpy("OUTPUT0")))
-    print("INPUT0 ({}) - INPUT1 ({}) = OUTPUT0 ({})".format(
-        input0_data, input1_data, response.as_numpy("OUTPUT1")))
+V2_TO_NUMPY = {
+    "BOOL": np.bool_,
+    "UINT8": np.uint8,
+    "UINT16": np.uint16,
+    "UINT32": np.uint32,
+    "UINT64": np.uint64,
+    "INT8": np.int8,
+    "INT16": np.int16,
+    "INT32": np.int32,
+    "INT64": np.int64,
+    "FP16": np.float16,
+    "FP32": np.float32,
+    "FP64": np.float64,
+}
+NUMPY_TO_V2 = {np.dtype(v): k for k, v in V2_TO_NUMPY.items()}
+HEADER_LENGTH = "Inference-Header-Content-Length"
+
+
+def encode_body(header, tensors):
+    """json header, 如果使用 binary tensor 扩展, 原始数据依次拼接在 header 之后"""
+    header = json.dumps(header).encode("utf-8")
+    if not tensors:
+        return header, {}
+    body = b"".join([header] + [np.ascontiguousarray(tensor).tobytes() for tensor in tensors])
+    return body, {HEADER_LENGTH: str(len(header))}
+
+
+def decode_tensors(header, binary, entries):
+    """根据 header 中的 outputs/inputs 描述解析出 numpy 数组"""
+    tensors, offset = {}, 0
+    for entry in entries:
+        dtype = V2_TO_NUMPY[entry["datatype"]]
+        size = entry.get("parameters", {}).get("binary_data_size")
+        if size is not None:
+            tensors[entry["name"]] = np.frombuffer(binary, dtype=dtype, count=size // np.dtype(dtype).itemsize,
+                                                   offset=offset).reshape(entry["shape"])
+            offset += size
+        else:
+            tensors[entry["name"]] = np.asarray(entry["data"], dtype=dtype).reshape(entry["shape"])
+    return tensors
+
+
+def split_body(body, headers):
+    header_length = headers.get(HEADER_LENGTH)
+    if header_length is None:
+        return json.loads(body), b""
+    header_length = int(header_length)
+    return json.loads(body[:header_length]), body[header_length:]
+
+
+class InferenceClient(object):
+    """KServe v2 HTTP 推理客户端, reuse_connection 时复用一个 keep-alive 连接(非线程安全, 每个线程一个实例)"""
+    def __init__(self, url, reuse_connection=True, timeout=60):
+        self.url = url
+        self.reuse_connection = reuse_connection
+        self.timeout = timeout
+        self.connection = None
+
+    def _get_connection(self):
+        if self.connection is None or not self.reuse_connection:
+            self.connection = http.client.HTTPConnection(self.url, timeout=self.timeout)
+            self.connection.connect()
+            # header 与 body 分两次发送, 关闭 Nagle 避免与 delayed ACK 叠加产生 ~40ms 延迟
+            self.connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return self.connection
+
+    def infer(self, model_name, inputs, output_names, binary=False):
+        """inputs: dict name -> numpy array; 返回 dict name -> numpy array"""
+        header = {"inputs": [], "outputs": []}
+        for name, tensor in inputs.items():
+            entry = {"name": name, "shape": list(tensor.shape), "datatype": NUMPY_TO_V2[tensor.dtype]}
+            if binary:
+                entry["parameters"] = {"binary_data_size": tensor.nbytes}
+            else:
+                entry["data"] = tensor.flatten().tolist()
+            header["inputs"].append(entry)
+        for name in output_names:
+            header["outputs"].append({"name": name, "parameters": {"binary_data": binary}})
+        body, headers = encode_body(header, list(inputs.values()) if binary else [])
+        headers["Content-Type"] = "application/octet-stream" if binary else "application/json"
+
+        connection = self._get_connection()
+        try:
+            connection.request("POST", "/v2/models/{}/infer".format(model_name), body=body, headers=headers)
+            response = connection.getresponse()
+            response_body = response.read()
+        except (http.client.HTTPException, OSError):
+            # 服务端关闭了 keep-alive 连接, 下次重建
+            connection.close()
+            self.connection = None
+            raise
+        if not self.reuse_connection:
+            connection.close()
+        if response.status != 200:
+            raise RuntimeError("infer failed ({}): {}".format(response.status, response_body[:200]))
+
+        response_header, binary_data = split_body(response_body, response.headers)
+        return decode_tensors(response_header, binary_data, response_header["outputs"])
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class LatencyHistogram(object):
+    """记录请求延迟(ms), 输出分位数与对数分桶直方图"""
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def record(self, latency_ms):
+        with self.lock:
+            self.latencies.append(latency_ms)
+
+    def record_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def summary(self, wall_time):
+        latencies = np.asarray(self.latencies)
+        if len(latencies) == 0:
+            return {"requests": 0, "errors": self.errors, "throughput_rps": 0.}
+        return {
+            "requests": int(len(latencies)),
+            "errors": self.errors,
+            "throughput_rps": float(len(latencies) / wall_time),
+            "mean_ms": float(latencies.mean()),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p90_ms": float(np.percentile(latencies, 90)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "max_ms": float(latencies.max()),
+        }
+
+    def histogram(self, num_buckets=12, width=40):
+        """对数分桶的文本直方图"""
+        latencies = np.asarray(self.latencies)
+        if len(latencies) == 0:
+            return ""
+        low, high = max(latencies.min(), 1e-3), max(latencies.max(), 1e-3)
+        edges = np.geomspace(low, high * 1.0001, num_buckets + 1)
+        counts, _ = np.histogram(latencies, bins=edges)
+        lines = []
+        for i, count in enumerate(counts):
+            bar = "#" * int(round(width * count / counts.max())) if counts.max() else ""
+            lines.append("{:>9.3f} - {:>9.3f} ms | {:<{width}} {}".format(
+                edges[i], edges[i + 1], bar, count, width=width))
+        return "\n".join(lines)
+
+
+def run_load(url, model_name, make_inputs, output_names, num_requests=1000, concurrency=1,
+             qps=None, binary=False, reuse_connection=True):
+    """发送 num_requests 个请求
+    qps 为 None 时 concurrency 个线程闭环发送; 否则按 qps 开环调度, 延迟从计划发送时刻开始计算(包含排队)
+    """
+    histogram = LatencyHistogram()
+    local = threading.local()
+    clients = []
+    clients_lock = threading.Lock()
+
+    def get_client():
+        if not hasattr(local, "client"):
+            local.client = InferenceClient(url, reuse_connection=reuse_connection)
+            with clients_lock:
+                clients.append(local.client)
+        return local.client
+
+    def send(index):
+        inputs = make_inputs(index)
+        if qps:
+            scheduled = start + index / qps
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        else:
+            scheduled = time.perf_counter()
+        try:
+            get_client().infer(model_name, inputs, output_names, binary=binary)
+            histogram.record((time.perf_counter() - scheduled) * 1000)
+        except (RuntimeError, http.client.HTTPException, OSError):
+            histogram.record_error()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, range(num_requests)))
+    wall_time = time.perf_counter() - start
+    for client in clients:
+        client.close()
+
+    return histogram, wall_time
+
+
+class _EchoHandler(BaseHTTPRequestHandler):
+    """进程内 echo server: 每个 INPUTx 原样返回为 OUTPUTx, 支持 json 与 binary tensor 扩展"""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        header, binary_data = split_body(body, self.headers)
+        inputs = decode_tensors(header, binary_data, header["inputs"])
+        requested = {output["name"]: output.get("parameters", {}).get("binary_data", False)
+                     for output in header.get("outputs", [])}
+
+        response = {"model_name": self.path.split("/")[3], "outputs": []}
+        binary_outputs = []
+        for name, tensor in inputs.items():
+            output_name = name.replace("INPUT", "OUTPUT")
+            if requested and output_name not in requested:
+                continue
+            entry = {"name": output_name, "shape": list(tensor.shape), "datatype": NUMPY_TO_V2[tensor.dtype]}
+            if requested.get(output_name, False):
+                entry["parameters"] = {"binary_data_size": tensor.nbytes}
+                binary_outputs.append(tensor)
+            else:
+                entry["data"] = tensor.flatten().tolist()
+            response["outputs"].append(entry)
+
+        response_body, headers = encode_body(response, binary_outputs)
+        self.send_response(200)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", "application/octet-stream" if binary_outputs else "application/json")
+        self.send_header("Content-Length", str(len(response_body)))
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class EchoServer(object):
+    """在后台线程运行的 echo server, 用于本地测试压测客户端"""
+    def __init__(self, host="127.0.0.1", port=0):
+        self.server = ThreadingHTTPServer((host, port), _EchoHandler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return "{}:{}".format(host, port)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parse = argparse.ArgumentParser(description="Triton HTTP 压测客户端")
+    parse.add_argument("--url", type=str, default="localhost:8000", help="Triton HTTP 地址.")
+    parse.add_argument("--model_name", type=str, default="add_sub", help="模型名称.")
+    parse.add_argument("--shape", type=str, default="1,4", help="INPUT0/INPUT1 的 shape.")
+    parse.add_argument("--num_requests", type=int, default=1000, help="请求总数.")
+    parse.add_argument("--concurrency", type=int, default=4, help="并发线程数.")
+    parse.add_argument("--qps", type=float, default=None, help="目标 QPS, 设置后按开环方式调度.")
+    parse.add_argument("--binary", action="store_true", help="使用 binary tensor 扩展传输数据.")
+    parse.add_argument("--reuse_connection", action="store_true", help="每个线程复用 keep-alive 连接.")
+    parse.add_argument("--local_echo", action="store_true", help="启动进程内 echo server 代替 Triton.")
+    args = parse.parse_args()
+
+    shape = [int(x) for x in args.shape.split(",")]
+    payloads = [{"INPUT0": np.random.rand(*shape).astype(np.float32),
+                 "INPUT1": np.random.rand(*shape).astype(np.float32)} for _ in range(64)]
+
+    def make_inputs(index):
+        return payloads[index % len(payloads)]
+
+    def run(url):
+        histogram, wall_time = run_load(url, args.model_name, make_inputs, ["OUTPUT0", "OUTPUT1"],
+                                        num_requests=args.num_requests, concurrency=args.concurrency,
+                                        qps=args.qps, binary=args.binary,
+                                        reuse_connection=args.reuse_connection)
+        summary = histogram.summary(wall_time)
+        print(json.dumps(summary, indent=2))
+        print(histogram.histogram())
+        return summary
+
+    if args.local_echo:
+        with EchoServer() as server:
+            return run(server.url)
+    return run(args.url)
+
+
+if __name__ == '__main__':
+    main()
@@ -75,6 +75,14 @@ class TritonPythonModel:
         self.output1_dtype = pb_utils.triton_string_to_numpy(
             output1_config['data_type'])
 
+        # With max_batch_size > 0 every input carries its own batch
+        # dimension, so the requests of one call are concatenated along
+        # axis 0, otherwise they are stacked into a new leading axis.
+        self.max_batch_size = int(model_config.get('max_batch_size', 0))
+        batched_execute = model_config.get('parameters', {}).get(
+            'BATCHED_EXECUTE', {}).get('string_value', 'true')
+        self.batched_execute = batched_execute.lower() == 'true'
+
     def execute(self, requests):
         """`execute` MUST be implemented in every Python model. `execute`
         function receives a list of pb_utils.InferenceRequest as the only
@@ -97,6 +105,12 @@ class TritonPythonModel:
           be the same as `requests`
         """
 
+        if self.batched_execute and len(requests) > 1:
+            return self.execute_batched(requests)
+        return self.execute_per_request(requests)
+
+    def execute_per_request(self, requests):
+        """Compute the response of every request independently."""
         output0_dtype = self.output0_dtype
         output1_dtype = self.output1_dtype
 
@@ -135,6 +149,51 @@ class TritonPythonModel:
         # of this list must match the length of `requests` list.
         return responses
 
+    def execute_batched(self, requests):
+        """Concatenate the inputs of all `requests`, run one vectorized
+        computation and split the outputs back per request.
+
+        Parameters
+        ----------
+        requests : list
+          A list of pb_utils.InferenceRequest
+
+        Returns
+        -------
+        list
+          A list of pb_utils.InferenceResponse, in the order of `requests`
+        """
+        in_0 = [pb_utils.get_input_tensor_by_name(request, "INPUT0").as_numpy()
+                for request in requests]
+        in_1 = [pb_utils.get_input_tensor_by_name(request, "INPUT1").as_numpy()
+                for request in requests]
+
+        if self.max_batch_size > 0:
+            batch_sizes = [x.shape[0] for x in in_0]
+            in_0, in_1 = np.concatenate(in_0), np.concatenate(in_1)
+        else:
+            in_0, in_1 = np.stack(in_0), np.stack(in_1)
+
+        out_0 = (in_0 + in_1).astype(self.output0_dtype, copy=False)
+        out_1 = (in_0 - in_1).astype(self.output1_dtype, copy=False)
+
+        # Split back into per request views, no extra copy.
+        responses = []
+        start = 0
+        for i in range(len(requests)):
+            if self.max_batch_size > 0:
+                end = start + batch_sizes[i]
+                out_tensor_0 = pb_utils.Tensor("OUTPUT0", out_0[start:end])
+                out_tensor_1 = pb_utils.Tensor("OUTPUT1", out_1[start:end])
+                start = end
+            else:
+                out_tensor_0 = pb_utils.Tensor("OUTPUT0", out_0[i])
+                out_tensor_1 = pb_utils.Tensor("OUTPUT1", out_1[i])
+            responses.append(pb_utils.InferenceResponse(
+                output_tensors=[out_tensor_0, out_tensor_1]))
+
+        return responses
+
     def finalize(self):
         """`finalize` is called only once when the model is being unloaded.
         Implementing `finalize` function is OPTIONAL. This function allows
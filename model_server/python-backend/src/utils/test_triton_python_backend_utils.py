@@ -0,0 +1,101 @@
+"""
+# SharedMemoryPool / Tensor.from_shared_memory 往返测试
+    cd model_server/python-backend/src && python -m pytest -q utils/test_triton_python_backend_utils.py
+"""
+import os
+import subprocess
+import sys
+import textwrap
+
+import numpy as np
+import pytest
+
+import triton_python_backend_utils as pb_utils
+
+ARRAYS = [
+    np.arange(7, dtype=np.int32),
+    np.linspace(-1, 1, 12, dtype=np.float16).reshape(3, 4),
+    np.array([[True, False, True]]),
+    np.random.RandomState(0).rand(2, 3, 5).astype(np.float64),
+    np.array(5, dtype=np.int64),
+]
+
+
+@pytest.fixture
+def pool():
+    pool = pb_utils.SharedMemoryPool(1024)
+    yield pool
+    pool.close()
+
+
+@pytest.fixture
+def zero_copy():
+    pb_utils.set_zero_copy(True)
+    yield
+    pb_utils.set_zero_copy(True)
+
+
+def test_round_trip(pool, zero_copy):
+    tensors = [pool.create_tensor("INPUT{}".format(i), array) for i, array in enumerate(ARRAYS)]
+    offsets = [pool.offset(tensor) for tensor in tensors]
+    assert offsets[0] == 0
+    assert all(offset % 64 == 0 for offset in offsets)
+    assert offsets == sorted(set(offsets))
+
+    for tensor, offset, expected in zip(tensors, offsets, ARRAYS):
+        loaded = pb_utils.Tensor.from_shared_memory(tensor.name(), pool.name(), expected.shape,
+                                                    expected.dtype, offset)
+        # 复用 pool 的句柄, 不再重复映射同一块共享内存
+        assert loaded._shm is pool._shm
+        assert loaded.name() == tensor.name()
+        assert loaded.as_numpy().shape == expected.shape
+        assert loaded.as_numpy().dtype == expected.dtype
+        assert np.array_equal(loaded.as_numpy(), expected)
+
+        # zero-copy: 两个 Tensor 是同一块内存的视图, 写入互相可见
+        assert np.shares_memory(loaded.as_numpy(), tensor.as_numpy())
+        tensor.as_numpy()[...] = np.zeros_like(expected)
+        assert not loaded.as_numpy().any()
+        loaded.as_numpy()[...] = expected
+        assert np.array_equal(tensor.as_numpy(), expected)
+    del tensors, tensor, loaded
+
+
+def test_copy_mode(pool, zero_copy):
+    expected = ARRAYS[1]
+    tensor = pool.create_tensor("INPUT0", expected)
+    pb_utils.set_zero_copy(False)
+    loaded = pb_utils.Tensor.from_shared_memory("INPUT0", pool.name(), expected.shape, expected.dtype,
+                                                pool.offset(tensor))
+    assert np.array_equal(loaded.as_numpy(), expected)
+    assert not np.shares_memory(loaded.as_numpy(), tensor.as_numpy())
+    del tensor, loaded
+
+
+def test_pool_full(pool):
+    pool.create_tensor("INPUT0", np.zeros(1000, dtype=np.uint8))
+    with pytest.raises(pb_utils.TritonModelException):
+        pool.create_tensor("INPUT1", np.zeros(64, dtype=np.uint8))
+    pool.reset()
+    assert pool.offset(pool.create_tensor("INPUT1", np.zeros(64, dtype=np.uint8))) == 0
+
+
+def test_attach_from_other_process(pool):
+    expected = ARRAYS[3]
+    offset = pool.offset(pool.create_tensor("INPUT0", expected))
+    script = textwrap.dedent("""
+        import sys
+        import numpy as np
+        sys.path.insert(0, {path!r})
+        import triton_python_backend_utils as pb_utils
+        tensor = pb_utils.Tensor.from_shared_memory("INPUT0", {name!r}, {shape!r}, np.{dtype}, {offset})
+        tensor.as_numpy()[...] *= 2
+    """).format(path=os.path.dirname(os.path.abspath(pb_utils.__file__)), name=pool.name(), shape=expected.shape,
+                dtype=expected.dtype.name, offset=offset)
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    # 读取方不拥有这块内存: 退出时既不报泄漏也不 unlink
+    assert "leaked" not in result.stderr
+    loaded = pb_utils.Tensor.from_shared_memory("INPUT0", pool.name(), expected.shape, expected.dtype, offset)
+    assert np.array_equal(loaded.as_numpy(), expected * 2)
+    del loaded
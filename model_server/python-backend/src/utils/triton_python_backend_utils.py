@@ -24,6 +24,8 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+from multiprocessing import resource_tracker, shared_memory
+
 import numpy as np
 
 TRITON_TO_NUMPY_TYPE = {
@@ -56,7 +58,7 @@ TRITON_TO_NUMPY_TYPE = {
 }
 
 TRITON_STRING_TO_NUMPY = {
-    'TYPE_BOOL': np.bool,
+    'TYPE_BOOL': np.bool_,
     'TYPE_UINT8': np.uint8,
     'TYPE_UINT16': np.uint16,
     'TYPE_UINT32': np.uint32,
@@ -74,6 +76,70 @@ TRITON_STRING_TO_NUMPY = {
 NUMPY_TO_TRITON_TYPE = {v: k for k, v in TRITON_TO_NUMPY_TYPE.items()}
 NUMPY_TO_TRITON_STRING = {v: k for k, v in TRITON_TO_NUMPY_TYPE.items()}
 
+# DLPack device type of host memory
+_DLPACK_CPU = 1
+
+# When True (default) tensors wrap the caller's numpy array and `as_numpy`
+# returns it as is, like the shared memory handoff of the real python
+# backend. When False every Tensor construction and `as_numpy` call copies,
+# which emulates a serializing harness.
+_ZERO_COPY = True
+
+
+def set_zero_copy(enabled):
+    """Switch the stub between zero-copy views and copying tensors.
+    Parameters
+    ----------
+    enabled : bool
+        True to share buffers between the caller and the model
+    """
+    global _ZERO_COPY
+    _ZERO_COPY = bool(enabled)
+
+
+def is_zero_copy():
+    """True if tensors share buffers with the caller"""
+    return _ZERO_COPY
+
+
+# Blocks created by SharedMemoryPool in this process, by name. Tensors on
+# these blocks reuse the pool's handle instead of mapping the block again.
+_SHM_POOLS = {}
+
+
+def _attach_shared_memory(shm_name):
+    """Map a block created by another process without tracking it here, the
+    creator owns and unlinks it. A tracked handle makes the resource tracker
+    warn about a leak and unlink the block when this process exits."""
+    try:
+        # python >= 3.13
+        return shared_memory.SharedMemory(name=shm_name, track=False)
+    except TypeError:
+        pass
+    # older versions always register the name; unregistering afterwards
+    # would drop the creator's entry when the tracker is shared (forked
+    # workers), so skip the registration instead
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=shm_name)
+    finally:
+        resource_tracker.register = register
+
+
+class _DLPackCapsule:
+    """Expose a raw DLPack capsule through the `__dlpack__` protocol so it
+    can be consumed by `numpy.from_dlpack`."""
+
+    def __init__(self, capsule):
+        self._capsule = capsule
+
+    def __dlpack__(self, stream=None):
+        return self._capsule
+
+    def __dlpack_device__(self):
+        return (_DLPACK_CPU, 0)
+
 
 class InferenceRequest:
     """InferenceRequest represents a request for inference for a model that
@@ -203,7 +269,61 @@ class Tensor:
                 ' Please use np.object_ instead.')
 
         self._name = name
-        self._numpy_array = numpy_array
+        self._numpy_array = numpy_array if _ZERO_COPY else numpy_array.copy()
+        self._shm = None
+        self._shm_offset = None
+
+    @classmethod
+    def from_dlpack(cls, name, dlpack_tensor):
+        """Create a Tensor sharing memory with a DLPack tensor
+        Parameters
+        ----------
+        name : str
+            Tensor name
+        dlpack_tensor : object
+            A DLPack capsule or an object implementing `__dlpack__`
+            (e.g. torch.Tensor on CPU, numpy.ndarray)
+        Returns
+        -------
+        Tensor
+            A Tensor viewing the same buffer
+        """
+        if not hasattr(dlpack_tensor, '__dlpack__'):
+            dlpack_tensor = _DLPackCapsule(dlpack_tensor)
+        return cls(name, np.from_dlpack(dlpack_tensor))
+
+    @classmethod
+    def from_shared_memory(cls, name, shm_name, shape, dtype, offset=0):
+        """Create a Tensor backed by an existing shared memory block, the
+        model reads the buffer written by another process without a copy.
+        Parameters
+        ----------
+        name : str
+            Tensor name
+        shm_name : str
+            Name of a multiprocessing.shared_memory.SharedMemory block, e.g.
+            `SharedMemoryPool.name()`
+        shape : tuple
+            Shape of the tensor
+        dtype : numpy.dtype
+            Data type of the tensor
+        offset : int
+            Byte offset of the tensor in the block, e.g.
+            `SharedMemoryPool.offset(tensor)`
+        Returns
+        -------
+        Tensor
+            A Tensor viewing the shared memory
+        """
+        shm = _SHM_POOLS.get(shm_name)
+        if shm is None:
+            shm = _attach_shared_memory(shm_name)
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+        tensor = cls(name, array)
+        # keep the mapping alive as long as the tensor
+        tensor._shm = shm
+        tensor._shm_offset = offset
+        return tensor
 
     def name(self):
         """Get the name of tensor
@@ -221,7 +341,81 @@ class Tensor:
         numpy.ndarray
             The numpy array
         """
-        return self._numpy_array
+        return self._numpy_array if _ZERO_COPY else self._numpy_array.copy()
+
+    def to_dlpack(self):
+        """Get a DLPack capsule sharing memory with this tensor
+        Returns
+        -------
+        PyCapsule
+            A DLPack capsule, e.g. for torch.utils.dlpack.from_dlpack
+        """
+        return self._numpy_array.__dlpack__()
+
+    def __dlpack__(self, stream=None):
+        return self._numpy_array.__dlpack__()
+
+    def __dlpack_device__(self):
+        return (_DLPACK_CPU, 0)
+
+
+class SharedMemoryPool:
+    """A shared memory block holding several tensors back to back, so a load
+    generator can write request data once and hand the model views of it,
+    the same way Triton passes inputs to python backend stubs.
+    Parameters
+    ----------
+    byte_size : int
+        Size of the block in bytes
+    name : str
+        Name of the block, a random name is used if None
+    """
+
+    def __init__(self, byte_size, name=None):
+        self._shm = shared_memory.SharedMemory(name=name, create=True,
+                                               size=byte_size)
+        self._offset = 0
+        _SHM_POOLS[self._shm.name] = self._shm
+
+    def name(self):
+        """Get the name of the shared memory block"""
+        return self._shm.name
+
+    def reset(self):
+        """Reuse the block from the beginning"""
+        self._offset = 0
+
+    def offset(self, tensor):
+        """Byte offset in the block of a Tensor created from the pool, to
+        pass to `Tensor.from_shared_memory` together with `name()`"""
+        if tensor._shm is not self._shm:
+            raise TritonModelException("tensor is not in this pool")
+        return tensor._shm_offset
+
+    def create_tensor(self, name, numpy_array):
+        """Copy `numpy_array` into the block once and return a Tensor viewing
+        it. Raises TritonModelException if the block is full."""
+        # unlike ascontiguousarray, keeps 0-d arrays 0-d
+        numpy_array = np.asarray(numpy_array, order="C")
+        # keep every tensor aligned to 64 bytes
+        offset = (self._offset + 63) // 64 * 64
+        if offset + numpy_array.nbytes > self._shm.size:
+            raise TritonModelException("shared memory pool is full")
+        array = np.ndarray(numpy_array.shape, dtype=numpy_array.dtype,
+                           buffer=self._shm.buf, offset=offset)
+        array[...] = numpy_array
+        self._offset = offset + numpy_array.nbytes
+        tensor = Tensor(name, array)
+        tensor._shm = self._shm
+        tensor._shm_offset = offset
+        return tensor
+
+    def close(self):
+        """Release and unlink the block, tensors created from the pool must
+        not be used afterwards."""
+        _SHM_POOLS.pop(self._shm.name, None)
+        self._shm.close()
+        self._shm.unlink()
 
 
 class TritonError:
@@ -10,7 +10,7 @@ import torch
 from torch import nn
 import torch.nn.functional as F
 
-from model import get_model_optimizer
+from model import get_model, average_checkpoints
 from loops import train_loop, evaluate, infer
 from dataset import (
     cross_validation_split,
@@ -30,6 +30,7 @@ parser = argparse.ArgumentParser()
 parser.add_argument("--experiment", type=str, required=True)
 parser.add_argument("--epochs", type=int, nargs="+", required=True)
 parser.add_argument("--data_path", type=str, required=True)
+parser.add_argument("--cache_dir", type=str, default=None)
 
 args = parser.parse_args()
 
@@ -57,6 +58,7 @@ original_args = argparse.Namespace(
     max_question_length=getattr(config, "max_question_length", 260),
     max_answer_length=getattr(config, "max_answer_length", 210),
     head_tail=getattr(config, "head_tail", True),
+    cache_dir=args.cache_dir,
     use_folds=None,
 )
 
@@ -107,20 +109,12 @@ for (
         experiment.predictions, "fold{}".format(fold)
     )
 
-    criterion = nn.BCEWithLogitsLoss()
-    model, optimizer = get_model_optimizer(original_args)
-
     checkpoint = os.path.join(fold_checkpoints, "model_on_epoch_{}.pth")
 
-    state_dicts = [
-        torch.load(checkpoint.format(epoch)) for epoch in args.epochs
-    ]
-    averaged_state_dict = state_dicts[0]
-    for k in averaged_state_dict:
-        averaged_state_dict[k] = torch.mean(
-            torch.stack([state_dict[k] for state_dict in state_dicts], dim=0),
-            dim=0,
-        )
+    # running mean, one epoch checkpoint in memory at a time
+    averaged_state_dict = average_checkpoints(
+        [checkpoint.format(epoch) for epoch in args.epochs]
+    )
 
     torch.save(
         averaged_state_dict,
@@ -130,9 +124,10 @@ for (
         )
     )
 
+    criterion = nn.BCEWithLogitsLoss()
+    model = get_model(original_args, pretrained=False)
     model.load_state_dict(averaged_state_dict)
 
-    # del state_dicts
     del averaged_state_dict
     torch.cuda.empty_cache()
 
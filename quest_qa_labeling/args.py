@@ -27,6 +27,7 @@ parser.add_argument("--max_title_length", type=int, default=30)
 parser.add_argument("--max_question_length", type=int, default=128)
 parser.add_argument("--max_answer_length", type=int, default=128)
 parser.add_argument("--head_tail", type=str, default="True")
+parser.add_argument("--cache_dir", type=str, default=None)
 
 # infer
 parser.add_argument("--sub_file", type=str, default="submission.csv")
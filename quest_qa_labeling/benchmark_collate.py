@@ -0,0 +1,107 @@
+"""Microbenchmark of make_collate_fn against the previous per-sample np.pad collate.
+
+    python benchmark_collate.py --batch_sizes 2 8 32 128 --max_sequence_length 500
+
+Outputs of both collates are checked to be identical before timing.
+"""
+import time
+import argparse
+
+import numpy as np
+import torch
+from torch.utils.data.dataloader import default_collate
+
+from dataset import make_collate_fn
+
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 2, 8, 32, 128])
+parser.add_argument("--max_sequence_length", type=int, default=500)
+parser.add_argument("--num_classes", type=int, default=30)
+parser.add_argument("--repeat", type=int, default=200)
+parser.add_argument("--seed", type=int, default=42)
+
+
+def make_legacy_collate_fn(padding_values={"input_ids": 0, "input_masks": 0, "input_segments": 0}):
+
+    def _collate_fn(batch):
+
+        for name, padding_value in padding_values.items():
+
+            lengths = [len(sample[name]) for sample in batch]
+            max_length = max(lengths)
+
+            for n, size in enumerate(lengths):
+                p = max_length - size
+                if p:
+                    pad_width = [(0, p)] + [(0, 0)] * (batch[n][name].ndim - 1)
+                    if padding_value == "edge":
+                        batch[n][name] = np.pad(
+                            batch[n][name], pad_width,
+                            mode="edge")
+                    else:
+                        batch[n][name] = np.pad(
+                            batch[n][name], pad_width,
+                            mode="constant", constant_values=padding_value)
+
+        return default_collate(batch)
+
+    return _collate_fn
+
+
+def make_batch(batch_size, max_sequence_length, num_classes, rng):
+    batch = []
+    for idx in range(batch_size):
+        length = int(rng.integers(16, max_sequence_length + 1))
+        batch.append(dict(
+            idx=idx,
+            input_ids=rng.integers(1, 30000, length).astype(np.int64),
+            input_masks=np.ones(length, dtype=np.int64),
+            input_segments=(np.arange(length) > length // 2).astype(np.int64),
+            lengths=length,
+            labels=torch.rand(num_classes),
+        ))
+    return batch
+
+
+def copy_batch(batch):
+    # the legacy collate replaces arrays in the sample dicts
+    return [dict(sample) for sample in batch]
+
+
+def timeit(collate_fn, batch, repeat):
+    collate_fn(copy_batch(batch))
+    start = time.perf_counter()
+    for _ in range(repeat):
+        collate_fn(copy_batch(batch))
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main(args):
+    rng = np.random.default_rng(args.seed)
+    legacy_collate_fn = make_legacy_collate_fn()
+    collate_fn = make_collate_fn()
+    edge_values = {"input_ids": 0, "input_masks": 0, "input_segments": "edge"}
+
+    print("{:>6} {:>12} {:>12} {:>8}".format("batch", "np.pad us", "slice us", "speedup"))
+    for batch_size in args.batch_sizes:
+        batch = make_batch(batch_size, args.max_sequence_length, args.num_classes, rng)
+
+        for expected, actual in (
+            (legacy_collate_fn(copy_batch(batch)), collate_fn(copy_batch(batch))),
+            (make_legacy_collate_fn(edge_values)(copy_batch(batch)), make_collate_fn(edge_values)(copy_batch(batch))),
+        ):
+            assert list(expected) == list(actual)
+            for key in expected:
+                assert expected[key].dtype == actual[key].dtype, key
+                assert torch.equal(expected[key], actual[key]), key
+
+        legacy_us = timeit(legacy_collate_fn, batch, args.repeat)
+        vectorized_us = timeit(collate_fn, batch, args.repeat)
+        print("{:>6} {:>12.1f} {:>12.1f} {:>7.2f}x".format(
+            batch_size, legacy_us, vectorized_us, legacy_us / vectorized_us))
+
+
+if __name__ == "__main__":
+    main(parser.parse_args())
@@ -1,3 +1,6 @@
+import os
+import hashlib
+import json
 from math import floor, ceil
 
 import torch
@@ -198,40 +201,76 @@ def compute_output_arrays(df, columns):
 
 
 class BucketingSampler:
-
-    def __init__(self, lengths, batch_size, maxlen=500):
-
-        self.lengths = lengths
+    """Batches by padded-token budget: every batch satisfies
+    len(batch) * max(lengths in batch) <= max_tokens, using the real (unpadded,
+    untruncated) lengths the collate pads to. A sample longer than the budget
+    allows gets a batch of its own.
+
+    By default the budget equals a full fixed-size batch of maxlen tokens
+    (batch_size * maxlen), so short QA pairs get larger batches and long ones smaller,
+    with the same peak memory. With shuffle=True the order is reshuffled on every
+    epoch: samples are shuffled, sorted by length inside buckets of bucket_size
+    batches, split into batches and the batch order is shuffled.
+
+    The number of batches can differ slightly between shuffled epochs. Each
+    epoch's batches are built once, before the epoch starts, and __len__ returns
+    that epoch's count: fixed while it runs, and the next epoch's count once it
+    has finished.
+    """
+
+    def __init__(self, lengths, batch_size, maxlen=500, max_tokens=None,
+                 shuffle=False, bucket_size=100, seed=42):
+
+        self.lengths = np.asarray(lengths)
         self.batch_size = batch_size
-        self.maxlen = 500
+        self.maxlen = maxlen
+        self.max_tokens = max_tokens or maxlen * batch_size
+        self.shuffle = shuffle
+        self.bucket_size = bucket_size
+        self.rng = np.random.RandomState(seed)
 
-        self.batches = self._make_batches(lengths, batch_size, maxlen)
+        self.batches = self._make_batches()
+        self.started = False
 
-    def _make_batches(self, lengths, batch_size, maxlen):
+    def _split_budget(self, ids):
+        """Split ids (sorted by length) into batches that fit the token budget"""
 
-        max_total_length = maxlen * batch_size
-        ids = np.argsort(lengths)
-
-        current_maxlen = 0
-        batch = []
         batches = []
+        batch = []
+        current_maxlen = 0
 
         for id in ids:
-            current_len = len(batch) * current_maxlen
-            size = lengths[id]
-            current_maxlen = max(size, current_maxlen)
-            new_len = current_maxlen * (len(batch) + 1)
-            if new_len < max_total_length:
-                batch.append(id)
-            else:
+            size = self.lengths[id]
+            new_maxlen = max(size, current_maxlen)
+            if batch and new_maxlen * (len(batch) + 1) > self.max_tokens:
                 batches.append(batch)
-                current_maxlen = size
-                batch = [id]
+                batch = []
+                new_maxlen = size
+            batch.append(int(id))
+            current_maxlen = new_maxlen
 
         if batch:
             batches.append(batch)
 
-        assert (sum(len(batch) for batch in batches)) == len(lengths)
+        return batches
+
+    def _make_batches(self):
+
+        if not self.shuffle:
+            ids = np.argsort(self.lengths, kind="stable")
+            batches = self._split_budget(ids)
+        else:
+            ids = self.rng.permutation(len(self.lengths))
+            # sort by length only inside buckets, so batches differ between epochs
+            bucket = self.bucket_size * self.batch_size
+            batches = []
+            for start in range(0, len(ids), bucket):
+                chunk = ids[start:start + bucket]
+                chunk = chunk[np.argsort(self.lengths[chunk], kind="stable")]
+                batches.extend(self._split_budget(chunk))
+            self.rng.shuffle(batches)
+
+        assert (sum(len(batch) for batch in batches)) == len(self.lengths)
 
         return batches
 
@@ -239,34 +278,158 @@ class BucketingSampler:
         return len(self.batches)
 
     def __iter__(self):
-        return iter(self.batches)
+        if self.shuffle and self.started:
+            # the previous epoch was stopped early, don't repeat its order
+            self.batches = self._make_batches()
+        self.started = True
+        yield from self.batches
+        self.started = False
+        if self.shuffle:
+            # prepare next epoch, only once this one is finished
+            self.batches = self._make_batches()
 
 
 def make_collate_fn(padding_values={"input_ids": 0, "input_masks": 0, "input_segments": 0}):
 
+    def _pad(arrays, padding_value):
+        """Pads a list of arrays along the first axis into one preallocated (batch, max_len, ...) array"""
+        lengths = np.array([len(array) for array in arrays])
+        max_length = lengths.max()
+        valid = np.arange(max_length)[None, :] < lengths[:, None]
+
+        first = arrays[0]
+        padded = np.empty((len(arrays), max_length) + first.shape[1:], dtype=np.result_type(*arrays))
+        if padding_value == "edge":
+            last = np.stack([array[-1] for array in arrays])
+            padded[:] = np.expand_dims(last, 1)
+        else:
+            padded.fill(padding_value)
+        padded[valid] = np.concatenate(arrays)
+
+        return torch.from_numpy(padded)
+
     def _collate_fn(batch):
 
+        collated = default_collate([
+            {key: value for key, value in sample.items() if key not in padding_values}
+            for sample in batch
+        ])
         for name, padding_value in padding_values.items():
+            collated[name] = _pad([np.asarray(sample[name]) for sample in batch], padding_value)
 
-            lengths = [len(sample[name]) for sample in batch]
-            max_length = max(lengths)
+        # keep the sample key order
+        return {key: collated[key] for key in batch[0]}
 
-            for n, size in enumerate(lengths):
-                p = max_length - size
-                if p:
-                    pad_width = [(0, p)] + [(0, 0)] * (batch[n][name].ndim - 1)
-                    if padding_value == "edge":
-                        batch[n][name] = np.pad(
-                            batch[n][name], pad_width,
-                            mode="edge")
-                    else:
-                        batch[n][name] = np.pad(
-                            batch[n][name], pad_width,
-                            mode="constant", constant_values=padding_value)
+    return _collate_fn
 
-        return default_collate(batch)
 
-    return _collate_fn
+class _CachedColumn:
+    """Per-sample view into a flat token array: item i is rows[i]'s tokens"""
+
+    def __init__(self, flat, offsets, rows, fill=None):
+        self.flat = flat
+        self.offsets = offsets
+        self.rows = rows
+        self.fill = fill
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, idx):
+        row = self.rows[idx]
+        start, end = self.offsets[row], self.offsets[row + 1]
+        if self.fill is not None:
+            return np.full(end - start, self.fill, dtype=np.int64)
+        return self.flat[start:end].astype(np.int64)
+
+
+class TokenCache:
+    """Tokenizes a frame once and keeps ids/segments/lengths per qa_id.
+
+    Arrays are flat (all samples concatenated) and indexed by offsets, so datasets
+    for any subset of rows (CV folds, SWA, inference) are index views. With
+    cache_dir the arrays are saved as .npy files keyed by the tokenization
+    settings and the frame contents, and reloaded with mmap_mode="r".
+    """
+
+    FILES = ("qa_ids", "input_ids", "input_segments", "offsets")
+
+    def __init__(self, qa_ids, input_ids, input_segments, offsets):
+        self.qa_ids = qa_ids
+        self.input_ids = input_ids
+        self.input_segments = input_segments
+        self.offsets = offsets
+        self.lengths = np.diff(np.asarray(offsets))
+        self.row_of = {qa_id: row for row, qa_id in enumerate(np.asarray(qa_ids).tolist())}
+
+    @staticmethod
+    def cache_key(args, df, tokenizer):
+        id_columns = ["qa_id"] if "qa_id" in df.columns else []
+        content = pd.util.hash_pandas_object(df[id_columns + list(args.input_columns)], index=False).values
+        basic_tokenizer = getattr(tokenizer, "basic_tokenizer", None)
+        settings = json.dumps([
+            type(tokenizer).__name__, len(tokenizer), getattr(tokenizer, "name_or_path", ""),
+            getattr(tokenizer, "do_lower_case", None), getattr(basic_tokenizer, "do_lower_case", None),
+            args.max_sequence_length, args.max_title_length, args.max_question_length,
+            args.max_answer_length, args.head_tail,
+        ])
+        return hashlib.md5(settings.encode("utf-8") + content.tobytes()).hexdigest()[:16]
+
+    @classmethod
+    def build(cls, args, df, tokenizer, cache_dir=None):
+        cache_path = None
+        if cache_dir is not None:
+            cache_path = os.path.join(cache_dir, cls.cache_key(args, df, tokenizer))
+            if all(os.path.exists(os.path.join(cache_path, name + ".npy")) for name in cls.FILES):
+                return cls(*[np.load(os.path.join(cache_path, name + ".npy"), mmap_mode="r")
+                             for name in cls.FILES])
+
+        input_ids, _, input_segments = compute_input_arays(
+            args,
+            df,
+            args.input_columns,
+            tokenizer,
+            max_sequence_length=args.max_sequence_length,
+            t_max_len=args.max_title_length,
+            q_max_len=args.max_question_length,
+            a_max_len=args.max_answer_length,
+        )
+        arrays = dict(
+            qa_ids=np.asarray(df["qa_id"] if "qa_id" in df.columns else np.arange(len(df)), dtype=np.int64),
+            input_ids=np.concatenate(input_ids).astype(np.int32),
+            input_segments=np.concatenate(input_segments).astype(np.int8),
+            offsets=np.concatenate([[0], np.cumsum([len(x) for x in input_ids])]).astype(np.int64),
+        )
+
+        if cache_path is not None:
+            os.makedirs(cache_path, exist_ok=True)
+            for name, array in arrays.items():
+                tmp_file = os.path.join(cache_path, name + ".tmp.npy")
+                np.save(tmp_file, array)
+                os.replace(tmp_file, os.path.join(cache_path, name + ".npy"))
+
+        return cls(**arrays)
+
+    def dataset(self, args, df, test=False, rows=None):
+        """QuestDataset over df's rows, without re-tokenizing.
+
+        Rows are looked up by qa_id, which must then be unique. Otherwise pass
+        rows: the positions of df's rows in the frame the cache was built from.
+        """
+        if rows is None:
+            rows = [self.row_of[qa_id] for qa_id in df["qa_id"].tolist()]
+        rows = np.asarray(rows, dtype=np.int64)
+        inputs = (
+            _CachedColumn(self.input_ids, self.offsets, rows),
+            _CachedColumn(None, self.offsets, rows, fill=1),
+            _CachedColumn(self.input_segments, self.offsets, rows),
+        )
+
+        outputs = None
+        if not test:
+            outputs = torch.tensor(compute_output_arrays(df, args.target_columns), dtype=torch.float32)
+
+        return QuestDataset(inputs=inputs, lengths=self.lengths[rows].tolist(), labels=outputs)
 
 
 class QuestDataset(torch.utils.data.Dataset):
@@ -279,6 +442,10 @@ class QuestDataset(torch.utils.data.Dataset):
     def from_frame(cls, args, df, tokenizer, test=False):
         """ here I put major preprocessing. why not lol
         """
+        cache_dir = getattr(args, "cache_dir", None)
+        if cache_dir is not None and "qa_id" in df.columns and df["qa_id"].is_unique:
+            return TokenCache.build(args, df, tokenizer, cache_dir).dataset(args, df, test)
+
         inputs = compute_input_arays(
             args,
             df,
@@ -333,6 +500,10 @@ def cross_validation_split(
 ):
     kf = GroupKFold(n_splits=args.folds)
     y_train = train_df[args.target_columns].values
+    # tokenize once, every fold is an index view
+    cache = TokenCache.build(args, train_df, tokenizer, getattr(args, "cache_dir", None))
+    # with duplicate (or missing) qa_ids, look rows up by position instead
+    by_qa_id = "qa_id" in train_df.columns and train_df["qa_id"].is_unique
 
     for fold, (train_index, val_index) in enumerate(kf.split(
         train_df.values, groups=train_df.question_title
@@ -343,13 +514,11 @@ def cross_validation_split(
 
         if not ignore_train:
             train_subdf = train_df.iloc[train_index]
-            train_set = QuestDataset.from_frame(args, train_subdf, tokenizer)
+            train_set = cache.dataset(args, train_subdf, rows=None if by_qa_id else train_index)
         else:
             train_set = None
 
-        valid_set = QuestDataset.from_frame(
-            args, train_df.iloc[val_index], tokenizer
-        )
+        valid_set = cache.dataset(args, train_df.iloc[val_index], rows=None if by_qa_id else val_index)
 
         yield (
             fold,
@@ -0,0 +1,115 @@
+"""Multi-fold ensemble inference on any device.
+
+The test set is tokenized once by the caller and shared by all folds. Every fold
+checkpoint is loaded, run over it and folded into a running mean as soon as it
+finishes. With workers > 1 folds run in forked CPU processes, each pinned to its
+own set of cores, so ensemble inference scales with the cores available.
+"""
+import os
+import multiprocessing as mp
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from dataset import BucketingSampler, make_collate_fn
+from loops import infer
+from model import get_model, get_device
+
+# per-process state of pool workers, set by _init_worker
+_worker = {}
+
+
+class RunningMean:
+    """Streaming mean of prediction matrices"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+
+    def update(self, preds):
+        self.count += 1
+        if self.mean is None:
+            self.mean = np.array(preds, dtype=np.float64)
+        else:
+            self.mean += (preds - self.mean) / self.count
+        return self.mean
+
+
+def split_cores(workers, cores=None):
+    """Splits the cores available to this process into `workers` disjoint sets"""
+    cores = sorted(os.sched_getaffinity(0)) if cores is None else sorted(cores)
+    if workers > len(cores):
+        raise ValueError("{} workers requested but only {} cores available".format(workers, len(cores)))
+    return [chunk.tolist() for chunk in np.array_split(cores, workers)]
+
+
+def make_test_loader(args, test_set):
+    return DataLoader(
+        test_set,
+        batch_sampler=BucketingSampler(
+            test_set.lengths,
+            batch_size=args.batch_size,
+            maxlen=args.max_sequence_length
+        ),
+        collate_fn=make_collate_fn(),
+    )
+
+
+def predict_fold(args, checkpoint, test_loader):
+    # the checkpoint overwrites every weight, no need to load the pretrained ones first
+    model = get_model(args, pretrained=False)
+    state_dict = torch.load(checkpoint, map_location=get_device(args))
+    model.load_state_dict(state_dict)
+    del state_dict
+
+    test_preds = infer(args, model, test_loader, test_shape=len(test_loader.dataset))
+
+    del model
+    torch.cuda.empty_cache()
+    return test_preds
+
+
+def _init_worker(args, test_set, core_sets):
+    cores = core_sets.get()
+    os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    _worker["args"] = args
+    _worker["test_loader"] = make_test_loader(args, test_set)
+
+
+def _predict_fold(task):
+    fold, checkpoint = task
+    return fold, predict_fold(_worker["args"], checkpoint, _worker["test_loader"])
+
+
+def ensemble_predict(args, checkpoints, test_set, workers=1, cores=None):
+    """Runs every fold checkpoint over test_set.
+
+    checkpoints: {fold: checkpoint path}
+    Yields (fold, fold predictions, ensemble mean so far) as folds finish, so
+    callers can write per-fold outputs while the rest are still running.
+    """
+    mean = RunningMean()
+
+    if workers <= 1:
+        test_loader = make_test_loader(args, test_set)
+        for fold, checkpoint in checkpoints.items():
+            test_preds = predict_fold(args, checkpoint, test_loader)
+            yield fold, test_preds, mean.update(test_preds)
+        return
+
+    if get_device(args).type != "cpu":
+        raise ValueError("Parallel fold workers run on cpu, got device {}".format(get_device(args)))
+
+    workers = min(workers, len(checkpoints))
+    # fork: the test set is inherited instead of pickled and scripts without
+    # a __main__ guard (infer.py) are not re-imported
+    context = mp.get_context("fork")
+    core_sets = context.Queue()
+    for core_set in split_cores(workers, cores):
+        core_sets.put(core_set)
+
+    with context.Pool(workers, initializer=_init_worker, initargs=(args, test_set, core_sets)) as pool:
+        for fold, test_preds in pool.imap_unordered(_predict_fold, checkpoints.items()):
+            yield fold, test_preds, mean.update(test_preds)
@@ -10,9 +10,8 @@ import torch
 from torch import nn
 import torch.nn.functional as F
 
-from model import get_model_optimizer
-from loops import train_loop, evaluate, infer
-from dataset import cross_validation_split, get_test_set, BucketingSampler, make_collate_fn
+from dataset import get_test_set
+from ensemble import ensemble_predict
 from transformers import BertTokenizer, AlbertTokenizer
 from torch.utils.data import DataLoader, Dataset
 from evaluation import target_metric
@@ -26,6 +25,10 @@ parser.add_argument("--experiment", type=str, required=True)
 parser.add_argument("--checkpoint", type=str, required=True)
 parser.add_argument("--dataframe", type=str, required=True)
 parser.add_argument("--output_dir", type=str, required=True)
+parser.add_argument("--cache_dir", type=str, default=None)
+parser.add_argument("--device", type=str, default=None)
+parser.add_argument("--workers", type=int, default=1,
+                    help="parallel cpu processes, each pinned to its own cores")
 
 args = parser.parse_args()
 
@@ -51,6 +54,8 @@ original_args = argparse.Namespace(
     max_question_length=getattr(config, "max_question_length", 260),
     max_answer_length=getattr(config, "max_answer_length", 210),
     head_tail=getattr(config, "head_tail", True),
+    cache_dir=args.cache_dir,
+    device=args.device,
     use_folds=None
 )
 
@@ -59,49 +64,32 @@ tokenizer = BertTokenizer.from_pretrained(
 )
 
 test_set = get_test_set(original_args, test_df, tokenizer)
-test_loader = DataLoader(
-    test_set,
-    batch_sampler=BucketingSampler(
-        test_set.lengths,
-        batch_size=original_args.batch_size,
-        maxlen=original_args.max_sequence_length
-    ),
-    collate_fn=make_collate_fn(),
-)
 
 os.makedirs(args.output_dir)
 
-for fold in range(config.folds):
-
-    print()
-    print("Fold:", fold)
-    print()
-
-    fold_checkpoints = os.path.join(
-        experiment.checkpoints, "fold{}".format(fold)
-    )
-
-    model, optimizer = get_model_optimizer(original_args)
-
-    checkpoint = os.path.join(fold_checkpoints, args.checkpoint)
+checkpoints = {
+    fold: os.path.join(experiment.checkpoints, "fold{}".format(fold), args.checkpoint)
+    for fold in range(config.folds)
+}
 
-    state_dict = torch.load(checkpoint)
-    model.load_state_dict(state_dict)
-    del state_dict
-    torch.cuda.empty_cache()
-
-    test_preds = infer(
-        original_args, model, test_loader, test_shape=len(test_set)
-    )
-
-    del model, optimizer
-    torch.cuda.empty_cache()
 
+def to_frame(test_preds):
     test_preds_df = test_df[["qa_id"]].copy()
     for k, col in enumerate(target_columns):
         test_preds_df[col] = test_preds[:, k].astype(np.float32)
-    test_preds_df.to_csv(
+    return test_preds_df
+
+
+for fold, test_preds, ensemble_preds in ensemble_predict(
+    original_args, checkpoints, test_set, workers=args.workers
+):
+    print("Fold {} done".format(fold))
+    to_frame(test_preds).to_csv(
         os.path.join(args.output_dir, "fold-{}.csv".format(fold)),
         index=False,
     )
 
+to_frame(ensemble_preds).to_csv(
+    os.path.join(args.output_dir, "ensemble.csv"),
+    index=False,
+)
@@ -5,8 +5,14 @@ from scipy.stats import spearmanr
 from tqdm import tqdm
 
 
+def model_device(model):
+    """Device of the model parameters, so loops run wherever the model was placed"""
+    return next(model.parameters()).device
+
+
 def train_loop(model, train_loader, optimizer, criterion, scheduler, args, iteration):
     model.train()
+    device = model_device(model)
 
     avg_loss = 0.0
 
@@ -19,10 +25,10 @@ def train_loop(model, train_loader, optimizer, criterion, scheduler, args, itera
             batch["labels"]
         )
         input_ids, input_masks, input_segments, labels = (
-            input_ids.cuda(),
-            input_masks.cuda(),
-            input_segments.cuda(),
-            labels.cuda(),
+            input_ids.to(device),
+            input_masks.to(device),
+            input_segments.to(device),
+            labels.to(device),
         )
 
         logits = model(
@@ -52,6 +58,7 @@ def train_loop(model, train_loader, optimizer, criterion, scheduler, args, itera
 def evaluate(args, model, val_loader, criterion, val_shape):
     avg_val_loss = 0.0
     model.eval()
+    device = model_device(model)
 
     valid_preds = []
     original = []
@@ -68,10 +75,10 @@ def evaluate(args, model, val_loader, criterion, val_shape):
             )
             ids.extend(id.cpu().numpy())
             input_ids, input_masks, input_segments, labels = (
-                input_ids.cuda(),
-                input_masks.cuda(),
-                input_segments.cuda(),
-                labels.cuda(),
+                input_ids.to(device),
+                input_masks.to(device),
+                input_segments.to(device),
+                labels.to(device),
             )
 
             logits = model(
@@ -99,6 +106,7 @@ def evaluate(args, model, val_loader, criterion, val_shape):
 def infer(args, model, test_loader, test_shape):
     test_preds = np.zeros((test_shape, args.num_classes))
     model.eval()
+    device = model_device(model)
 
     ids = []
     test_preds = []
@@ -109,9 +117,9 @@ def infer(args, model, test_loader, test_shape):
             ids.extend(batch["idx"].cpu().numpy())
 
             predictions = model(
-                input_ids=batch["input_ids"].cuda(),
-                attention_mask=batch["input_masks"].cuda(),
-                token_type_ids=batch["input_segments"].cuda(),
+                input_ids=batch["input_ids"].to(device),
+                attention_mask=batch["input_masks"].to(device),
+                token_type_ids=batch["input_segments"].to(device),
             )
             test_preds.extend(predictions.detach().cpu().numpy())
 
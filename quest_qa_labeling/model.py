@@ -85,10 +85,82 @@ class CustomBert(BertPreTrainedModel):
         return outputs  # (loss), logits, (hidden_states), (attentions)
 
 
+def get_device(args):
+    """args.device if set, otherwise cuda when available"""
+    device = getattr(args, "device", None)
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    return torch.device(device)
+
+
+class ModuleWrapper(nn.Module):
+    """Calls the wrapped module directly, keeping DataParallel's "module." key prefix.
+
+    Used on cpu, where DataParallel with no device ids still picks an output
+    device from them whenever cuda is available.
+    """
+
+    def __init__(self, module):
+        super().__init__()
+        self.module = module
+
+    def forward(self, *inputs, **kwargs):
+        return self.module(*inputs, **kwargs)
+
+
+def get_model(args, pretrained=True):
+    """Model on args' device, wrapped (DataParallel on cuda) so checkpoint keys match training.
+
+    With pretrained=False the weights are only initialized from the config,
+    for when a fold checkpoint is loaded right after.
+    """
+    if pretrained:
+        model = CustomBert.from_pretrained(args.bert_model, num_labels=args.num_classes)
+    else:
+        model = CustomBert(BertConfig.from_pretrained(args.bert_model, num_labels=args.num_classes))
+    device = get_device(args)
+    model.to(device)
+    if device.type != "cuda":
+        return ModuleWrapper(model)
+    # all gpus for plain "cuda", only the given one for "cuda:N"
+    return nn.DataParallel(model, device_ids=None if device.index is None else [device.index])
+
+
+def load_state_dict(checkpoint, mmap=True):
+    """torch.load onto cpu, memory-mapped when torch supports it (>= 2.1)"""
+    if mmap:
+        try:
+            return torch.load(checkpoint, map_location="cpu", mmap=True)
+        except TypeError:
+            pass
+    return torch.load(checkpoint, map_location="cpu")
+
+
+def average_checkpoints(checkpoints, mmap=True):
+    """Running mean of the state dicts in `checkpoints`, loaded one at a time.
+
+    Peak memory is the float32 accumulator plus one (memory-mapped) checkpoint
+    instead of all of them. Non floating point entries (e.g. integer buffers)
+    are taken from the first checkpoint.
+    """
+    averaged_state_dict, dtypes = {}, {}
+    for n, checkpoint in enumerate(checkpoints, start=1):
+        state_dict = load_state_dict(checkpoint, mmap=mmap)
+        for k, v in state_dict.items():
+            if n == 1:
+                dtypes[k] = v.dtype
+                # copy, so nothing refers to the memory-mapped checkpoint
+                averaged_state_dict[k] = v.to(torch.float32, copy=True) if v.is_floating_point() else v.clone()
+            elif v.is_floating_point():
+                averaged = averaged_state_dict[k]
+                averaged.add_(v.float() - averaged, alpha=1.0 / n)
+        del state_dict
+
+    return {k: v.to(dtypes[k]) for k, v in averaged_state_dict.items()}
+
+
 def get_model_optimizer(args):
-    model = CustomBert.from_pretrained(args.bert_model, num_labels=args.num_classes)
-    model.cuda()
-    model = nn.DataParallel(model)
+    model = get_model(args)
     params = list(model.named_parameters())
 
     def is_backbone(n):
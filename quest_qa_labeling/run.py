@@ -15,7 +15,7 @@ from torch.utils.data import ConcatDataset
 from transformers import get_linear_schedule_with_warmup
 from model import get_model_optimizer
 from loops import train_loop, evaluate, infer
-#from dataset import cross_validation_split, get_test_set, get_pseudo_set, make_collate_fn, BucketingSampler
+from dataset import cross_validation_split, get_test_set, get_pseudo_set, make_collate_fn, BucketingSampler
 from args import args
 from transformers import BertTokenizer, AlbertTokenizer
 from torch.utils.data import DataLoader, Dataset
@@ -120,6 +120,7 @@ for fold, train_set, valid_set, train_fold_df, val_fold_df in (
     for epoch in range(args.epochs):
 
         epoch_train_set = train_set
+        epoch_lengths = list(train_set.lengths)
 
         if args.pseudo_file is not None:
 
@@ -132,14 +133,19 @@ for fold, train_set, valid_set, train_fold_df, val_fold_df in (
             )
 
             epoch_train_set = ConcatDataset([epoch_train_set, pseudo_set])
+            epoch_lengths += list(pseudo_set.lengths)
 
         train_loader = DataLoader(
             epoch_train_set,
-            batch_size=args.batch_size,
+            batch_sampler=BucketingSampler(
+                epoch_lengths,
+                batch_size=args.batch_size,
+                maxlen=args.max_sequence_length,
+                shuffle=True,
+                seed=args.seed + epoch,
+            ),
             num_workers=args.workers,
             collate_fn=make_collate_fn(),
-            drop_last=True,
-            shuffle=True,
         )
 
         scheduler = get_linear_schedule_with_warmup(
@@ -0,0 +1,52 @@
+"""get_model on cpu must work on hosts where cuda is available.
+
+    python -m pytest -q test_model.py
+"""
+import argparse
+
+import pytest
+import torch
+from torch import nn
+from transformers import BertConfig
+
+import model as model_module
+from model import get_model
+
+
+@pytest.fixture
+def args(tmp_path):
+    BertConfig(vocab_size=100, hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+               intermediate_size=64, max_position_embeddings=64).save_pretrained(str(tmp_path))
+    return argparse.Namespace(bert_model=str(tmp_path), num_classes=3, device="cpu")
+
+
+@pytest.fixture
+def cuda_visible(monkeypatch):
+    """Makes torch report a cuda device, as on a gpu node"""
+    monkeypatch.setattr(torch.cuda, "is_available", lambda: True)
+    monkeypatch.setattr(torch.cuda, "device_count", lambda: 1)
+
+
+def test_cpu_model_with_cuda_visible(args, cuda_visible):
+    model = get_model(args, pretrained=False)
+
+    assert not isinstance(model, nn.DataParallel)
+    assert model_module.get_device(args).type == "cpu"
+    assert all(p.device.type == "cpu" for p in model.parameters())
+    # same keys as checkpoints saved from the DataParallel-wrapped training model
+    assert all(k.startswith("module.") for k in model.state_dict())
+
+    model.eval()
+    input_ids = torch.randint(1, 100, (2, 16))
+    with torch.no_grad():
+        logits = model(input_ids=input_ids, attention_mask=torch.ones_like(input_ids),
+                       token_type_ids=torch.zeros_like(input_ids))
+    assert logits.shape == (2, 3)
+
+
+def test_cpu_model_loads_dataparallel_checkpoint(args, cuda_visible):
+    state_dict = {"module." + k: v for k, v in model_module.CustomBert(
+        BertConfig.from_pretrained(args.bert_model, num_labels=args.num_classes)).state_dict().items()}
+
+    model = get_model(args, pretrained=False)
+    model.load_state_dict(state_dict)
@@ -116,6 +116,61 @@ class GRUAttnDecoder(torch.nn.Module):
         )
         self.epsilon = 1e-6
 
+    def step(self, emb, net_state, input_context, context_mask):
+        """ 单步解码: 通过注意力机制获取当前的context_rep, 并更新GRU状态 """
+        # step1: 通过注意力机制获取当前的context_rep
+        attn_score = torch.einsum("bsd,bd->bs", input_context, net_state)
+        attn_score.mul_(self.scale)
+        attn_score += (1.0 - context_mask) * (-1e30)
+        attn_prob = torch.softmax(attn_score, dim=-1)
+        attn_vec = torch.einsum("bs,bsd->bd", attn_prob, input_context)
+        # step2: 更新状态
+        x = torch.cat([attn_vec, emb, net_state], dim=-1)
+        reset_sig = self.reset_gate(x)
+        update_sig = self.update_gate(x)
+        update_value = self.update(torch.cat([attn_vec, emb, reset_sig * net_state], dim=-1))
+        return (1 - update_sig) * net_state + update_sig * update_value
+
+    def copy_logits(self, net_state, input_context, context_mask):
+        input_logits = torch.einsum("bd,bsd->bs", self.copy_output(net_state), input_context)
+        input_logits += (1.0 - context_mask) * (-1e30)
+        return input_logits  # (bsz, enc_seq)
+
+    def vocab_prob(self, net_state, input_ids, input_context, context_mask):
+        """ 完整的解码分布 (bsz, vocab), 解码时使用 """
+        # step3: 计算分布概率--> mos
+        # pi_k = self.pi_mos(net_state)
+        # for k in range(args["mos"]):
+        #     output = self.output[k](net_state)
+        #     vocab_logits = torch.nn.functional.linear(input=output, weight=self.embedding_matrix.weight)
+        #     vocab_prob_list.append(torch.softmax(vocab_logits, dim=-1)[..., None])
+        # vocab_prob = torch.einsum("bk,bvk->bv", pi_k, torch.cat(vocab_prob_list, dim=-1))
+        output = self.output(net_state)
+        vocab_logits = torch.nn.functional.linear(input=output, weight=self.embedding_matrix.weight)
+        vocab_prob = torch.softmax(vocab_logits, dim=-1)
+        input_prob = torch.softmax(self.copy_logits(net_state, input_context, context_mask), dim=-1)
+        # step4: 根据mode_sig混合两个概率
+        mode_sig = self.mode_select(net_state)
+        vocab_prob = vocab_prob * mode_sig
+        return torch.scatter_add(vocab_prob, dim=1, index=input_ids, src=input_prob * (1 - mode_sig))
+
+    def target_log_prob(self, net_state, input_ids, input_context, context_mask, target):
+        """
+        只计算目标token的对数概率 (bsz,), 不构造混合后的 (bsz, vocab) 分布, 全程在对数空间:
+        log p(t) = logaddexp(log(m) + log p_vocab(t), log(1-m) + logsumexp_{s: input_ids[s]=t} log p_copy(s))
+        """
+        output = self.output(net_state)
+        vocab_logits = torch.nn.functional.linear(input=output, weight=self.embedding_matrix.weight)
+        vocab_logp = torch.gather(vocab_logits, dim=1, index=target[:, None]).squeeze(dim=-1) - \
+            torch.logsumexp(vocab_logits, dim=-1)
+        input_logp = torch.log_softmax(self.copy_logits(net_state, input_context, context_mask), dim=-1)
+        # 不是目标token的输入位置用一个有限的极小值屏蔽, 避免没有匹配位置时 logsumexp 梯度为 nan
+        input_logp = input_logp.masked_fill(input_ids != target[:, None], -1e30)
+        copy_logp = torch.logsumexp(input_logp, dim=-1)
+        mode_logit = self.mode_select[0](net_state).squeeze(dim=-1)  # mode_sig = sigmoid(mode_logit)
+        return torch.logaddexp(torch.nn.functional.logsigmoid(mode_logit) + vocab_logp,
+                               torch.nn.functional.logsigmoid(-mode_logit) + copy_logp)
+
     def forward(self, input_ids, input_context, context_mask, decode_input, decode_target, use_beam_search, beam_width):
         """
         :param input_ids: 用于解码增强的输入ids序列
@@ -127,95 +182,113 @@ class GRUAttnDecoder(torch.nn.Module):
         :param beam_width: beam宽度
         :return: 训练时返回损失, 测试时返回解码序列
         """
+        if decode_target is not None:
+            return self.copy_loss(input_ids, input_context, context_mask, decode_input, decode_target)
+        elif use_beam_search:
+            return self.beam_search(input_ids, input_context, context_mask, beam_width)
+        else:  # 贪婪式解码
+            return self.greedy_search(input_ids, input_context, context_mask)
+
+    def copy_loss(self, input_ids, input_context, context_mask, decode_input, decode_target):
+        """
+        每步只取目标token的对数概率并累加损失, 不保存每步 (bsz, vocab) 的分布再拼接;
+        只解码到batch内最长的目标长度(之后全是pad, 损失为0)
+        损失与 -log(p + epsilon) 相同: log(p + epsilon) = logaddexp(log p, log epsilon)
+        """
         bsz = input_context.size(0)
         net_state = self.init_hidden_unit.repeat(bsz, 1)
-        if decode_target is not None:
-            dec_list = []
-            decode_emb = self.embedding_matrix(decode_input)  # 作为输入的一部分(bsz, dec_seq, dim)
-            for i in range(self.seq_len):
-                # step1: 通过注意力机制获取当前的context_rep
-                attn_score = torch.einsum("bsd,bd->bs", input_context, net_state)
-                attn_score.mul_(self.scale)
-                attn_score += (1.0 - context_mask) * (-1e30)
-                attn_prob = torch.softmax(attn_score, dim=-1)
-                attn_vec = torch.einsum("bs,bsd->bd", attn_prob, input_context)
-                # step2: 更新状态
-                x = torch.cat([attn_vec, decode_emb[:, i, :], net_state], dim=-1)
-                reset_sig = self.reset_gate(x)
-                update_sig = self.update_gate(x)
-                update_value = self.update(torch.cat([attn_vec, decode_emb[:, i, :], reset_sig * net_state], dim=-1))
-                net_state = (1 - update_sig) * net_state + update_sig * update_value
-                # step3: 计算分布概率--> mos
-                vocab_prob_list = []
-                # pi_k = self.pi_mos(net_state)
-                # for k in range(args["mos"]):
-                #     output = self.output[k](net_state)
-                #     vocab_logits = torch.nn.functional.linear(input=output, weight=self.embedding_matrix.weight)
-                #     vocab_prob_list.append(torch.softmax(vocab_logits, dim=-1)[..., None])
-                # vocab_prob = torch.einsum("bk,bvk->bv", pi_k, torch.cat(vocab_prob_list, dim=-1))
-                output = self.output(net_state)
-                vocab_logits = torch.nn.functional.linear(input=output, weight=self.embedding_matrix.weight)
-                vocab_prob = torch.softmax(vocab_logits, dim=-1)
-                input_logits = torch.einsum("bd,bsd->bs", self.copy_output(net_state), input_context)
-                input_logits += (1.0 - context_mask) * (-1e30)
-                input_prob = torch.softmax(input_logits, dim=-1)  # (bsz, enc_seq)
-                # step4: 根据mode_sig混合两个概率
-                mode_sig = self.mode_select(net_state)
-                vocab_prob = vocab_prob * mode_sig
-                vocab_prob = torch.scatter_add(vocab_prob, dim=1, index=input_ids, src=input_prob * (1 - mode_sig))
-                dec_list.append(vocab_prob[:, None, :])
-            # 计算损失
-            predict = torch.cat(dec_list, dim=1)  # (bsz, dec_seq, vocab)
-            predict = predict.view(size=(-1, predict.size(-1)))
-            decode_target = decode_target.view(size=(-1,))
-            predict = torch.gather(predict, dim=1, index=decode_target[:, None]).squeeze(dim=-1)
-            init_loss = -torch.log(predict + self.epsilon)
-            init_loss *= (decode_target != 0).float()
-            loss = torch.sum(init_loss) / torch.nonzero(decode_target != 0, as_tuple=False).size(0)
-            return loss[None].repeat(bsz)
-        else:
-            if use_beam_search:
-                pass
-            else:  # 贪婪式解码
-                dec_list = []
-                for i in range(self.seq_len):
-                    # step1: 通过注意力机制获取当前的context_rep
-                    attn_score = torch.einsum("bsd,bd->bs", input_context, net_state)
-                    attn_score.mul_(self.scale)
-                    attn_score += (1.0 - context_mask) * (-1e30)
-                    attn_prob = torch.softmax(attn_score, dim=-1)
-                    attn_vec = torch.einsum("bs,bsd->bd", attn_prob, input_context)
-                    # step2: 更新状态
-                    if i == 0:
-                        emb = self.embedding_matrix(
-                            torch.full(size=(bsz,), fill_value=args["start_token_id"], dtype=torch.int32).long().to(device))
-                    else:
-                        emb = self.embedding_matrix(dec_list[i - 1].squeeze(dim=-1))
-                    x = torch.cat([attn_vec, emb, net_state], dim=-1)
-                    reset_sig = self.reset_gate(x)
-                    update_sig = self.update_gate(x)
-                    update_value = self.update(torch.cat([attn_vec, emb, reset_sig * net_state], dim=-1))
-                    net_state = (1 - update_sig) * net_state + update_sig * update_value
-                    # step3: 计算分布得分
-                    vocab_prob_list = []
-                    # pi_k = self.pi_mos(net_state)
-                    # for k in range(args["mos"]):
-                    #     output = self.output[k](net_state)
-                    #     vocab_logits = torch.nn.functional.linear(input=output, weight=self.embedding_matrix.weight)
-                    #     vocab_prob_list.append(torch.softmax(vocab_logits, dim=-1)[..., None])
-                    # vocab_prob = torch.einsum("bk,bvk->bv", pi_k, torch.cat(vocab_prob_list, dim=-1))
-                    output = self.output(net_state)
-                    vocab_logits = torch.nn.functional.linear(input=output, weight=self.embedding_matrix.weight)
-                    vocab_prob = torch.softmax(vocab_logits, dim=-1)
-                    input_logits = torch.einsum("bd,bsd->bs", self.copy_output(net_state), input_context)
-                    input_logits += (1.0 - context_mask) * (-1e30)
-                    input_prob = torch.softmax(input_logits, dim=-1)  # (bsz, enc_seq)
-                    # step4: 根据mode_sig混合两个概率
-                    mode_sig = self.mode_select(net_state)
-                    vocab_prob = vocab_prob * mode_sig
-                    vocab_prob = torch.scatter_add(vocab_prob, dim=1, index=input_ids, src=input_prob * (1 - mode_sig))
-                    dec_list.append(torch.argmax(vocab_prob, dim=-1)[:, None])
-                return torch.cat(dec_list, dim=-1)
+        target_mask = (decode_target != 0).float()
+        positions = torch.arange(1, decode_target.size(1) + 1, device=decode_target.device)
+        dec_len = int((positions[None, :] * (decode_target != 0).long()).max())
+        decode_emb = self.embedding_matrix(decode_input[:, :dec_len])  # 作为输入的一部分(bsz, dec_seq, dim)
+        log_epsilon = float(np.log(self.epsilon))
+        total_loss = 0
+        for i in range(dec_len):
+            net_state = self.step(decode_emb[:, i, :], net_state, input_context, context_mask)
+            target_logp = self.target_log_prob(net_state, input_ids, input_context, context_mask, decode_target[:, i])
+            init_loss = -torch.logaddexp(target_logp, torch.full_like(target_logp, log_epsilon))
+            total_loss = total_loss + torch.sum(init_loss * target_mask[:, i])
+        loss = total_loss / torch.nonzero(decode_target != 0, as_tuple=False).size(0)
+        return loss[None].repeat(bsz)
+
+    def greedy_search(self, input_ids, input_context, context_mask):
+        """ 批量贪婪解码, 生成end_token的序列从batch中移除, 全部结束时提前停止; 结束后的位置填充end_token """
+        bsz = input_context.size(0)
+        net_state = self.init_hidden_unit.repeat(bsz, 1)
+        dec_seq = torch.full(size=(bsz, self.seq_len), fill_value=args["end_token_id"], dtype=torch.long,
+                             device=input_ids.device)
+        alive = torch.arange(bsz, device=input_ids.device)  # 未结束序列在原batch中的位置
+        token_ids = torch.full(size=(bsz,), fill_value=args["start_token_id"], dtype=torch.long, device=input_ids.device)
+        for i in range(self.seq_len):
+            net_state = self.step(self.embedding_matrix(token_ids), net_state, input_context, context_mask)
+            token_ids = torch.argmax(self.vocab_prob(net_state, input_ids, input_context, context_mask), dim=-1)
+            dec_seq[alive, i] = token_ids
+            keep = token_ids != args["end_token_id"]
+            if not bool(keep.all()):
+                if not bool(keep.any()):
+                    return dec_seq[:, :i + 1]
+                alive, token_ids, net_state = alive[keep], token_ids[keep], net_state[keep]
+                input_ids, input_context, context_mask = input_ids[keep], input_context[keep], context_mask[keep]
+        return dec_seq
+
+    def beam_search(self, input_ids, input_context, context_mask, beam_width):
+        """
+        批量集束搜索, 每个样本的beam_width条序列按 对数概率和 / 长度 ** beam_length_penalty 排序;
+        一个样本的所有beam都生成end_token后, 取最优序列并将该样本从batch中移除, 全部结束时提前停止
+        :return: (bsz, dec_len) 每个样本的最优序列, 结束后的位置填充end_token
+        """
+        bsz = input_context.size(0)
+        device_ = input_ids.device
+        end_token_id = args["end_token_id"]
+        # 第j个样本的beam位于 j * beam_width: (j + 1) * beam_width 行
+        input_ids = input_ids.repeat_interleave(beam_width, dim=0)
+        input_context = input_context.repeat_interleave(beam_width, dim=0)
+        context_mask = context_mask.repeat_interleave(beam_width, dim=0)
+        net_state = self.init_hidden_unit.repeat(bsz * beam_width, 1)
+        token_ids = torch.full(size=(bsz * beam_width,), fill_value=args["start_token_id"], dtype=torch.long,
+                               device=device_)
+        # 解码第一个词时只能从一个beam扩展, 否则beam search将完全沦为greedy search
+        log_probs = torch.full(size=(bsz, beam_width), fill_value=-1e9, device=device_)
+        log_probs[:, 0] = 0
+        seq_lens = torch.ones(size=(bsz, beam_width), device=device_)  # 加上偏置项1, 防止长度惩罚时出现div 0
+        finished = torch.zeros(size=(bsz, beam_width), dtype=torch.bool, device=device_)
+        sequences = torch.zeros(size=(bsz, beam_width, 0), dtype=torch.long, device=device_)
+        dec_seq = torch.full(size=(bsz, self.seq_len), fill_value=end_token_id, dtype=torch.long, device=device_)
+        alive = torch.arange(bsz, device=device_)
+        length_penalty = args["beam_length_penalty"]
+        for i in range(self.seq_len):
+            n = alive.size(0)
+            net_state = self.step(self.embedding_matrix(token_ids), net_state, input_context, context_mask)
+            vocab_prob = self.vocab_prob(net_state, input_ids, input_context, context_mask)
+            vocab_logp = torch.log(vocab_prob + self.epsilon).view(n, beam_width, -1)  # 取对数， 加eps
+            vocab_size = vocab_logp.size(-1)
+            # 已结束的beam只能继续输出end_token, 概率和与长度均不变
+            vocab_logp = vocab_logp.masked_fill(finished[..., None], float("-inf"))
+            vocab_logp[..., end_token_id] = vocab_logp[..., end_token_id].masked_fill(finished, 0)
+            cand_log_probs = (log_probs[..., None] + vocab_logp).view(n, -1)
+            cand_lens = (seq_lens + (~finished).float())[..., None].expand(n, beam_width, vocab_size).reshape(n, -1)
+            sort_logits, indices = (cand_log_probs / cand_lens ** length_penalty).topk(k=beam_width, dim=-1)
+            parents, token_ids = indices // vocab_size, indices % vocab_size
+            log_probs = cand_log_probs.gather(1, indices)
+            seq_lens = cand_lens.gather(1, indices)
+            finished = finished.gather(1, parents) | (token_ids == end_token_id)
+            sequences = torch.cat([sequences.gather(1, parents[..., None].expand(-1, -1, i)), token_ids[..., None]], dim=-1)
+            rows = (torch.arange(n, device=device_)[:, None] * beam_width + parents).view(-1)
+            net_state, token_ids = net_state[rows], token_ids.view(-1)
+            # topk结果已按排序得分降序, 第0个beam即为最优序列
+            done = finished.all(dim=-1)
+            if bool(done.any()):
+                dec_seq[alive[done], :i + 1] = sequences[done, 0]
+                if bool(done.all()):
+                    return dec_seq[:, :i + 1]
+                keep = ~done
+                alive, log_probs, seq_lens, finished, sequences = \
+                    alive[keep], log_probs[keep], seq_lens[keep], finished[keep], sequences[keep]
+                rows = keep.repeat_interleave(beam_width)
+                net_state, token_ids = net_state[rows], token_ids[rows]
+                input_ids, input_context, context_mask = input_ids[rows], input_context[rows], context_mask[rows]
+        dec_seq[alive] = sequences[:, 0]
+        return dec_seq
 
 
 class MyModel(torch.nn.Module):
@@ -473,6 +546,7 @@ if __name__ == "__main__":
         "max_answer_len": 100,
         "use_beam_search": False,
         "beam_width": 5,
+        "beam_length_penalty": 0.6,
         "warm_start": False,
         "freeze_roberta": False
     }
@@ -195,11 +195,20 @@ class RelPartialLearnableMultiHeadAttn(torch.nn.Module):
         mask_attn_output = self.layer_norm_mask_attn(w + attn_out)
 
         # 与编码器交互部分
+        inter_k, inter_v = self._interaction_kv(enc_context)
+        return self._interaction(mask_attn_output, inter_k, inter_v, padding_mask)
+
+    def _interaction_kv(self, enc_context):
+        enc_len, bsz = enc_context.size(0), enc_context.size(1)
         inter_k, inter_v = torch.chunk(self.interaction_kv_net(enc_context), 2, dim=-1)
-        inter_q = self.interaction_q_net(mask_attn_output)
-        inter_q = inter_q.view(dec_len, bsz, self.n_heads, self.d_head)
         inter_k = inter_k.view(enc_len, bsz, self.n_heads, self.d_head)
         inter_v = inter_v.view(enc_len, bsz, self.n_heads, self.d_head)
+        return inter_k, inter_v
+
+    def _interaction(self, mask_attn_output, inter_k, inter_v, padding_mask):
+        dec_len, bsz = mask_attn_output.size(0), mask_attn_output.size(1)
+        inter_q = self.interaction_q_net(mask_attn_output)
+        inter_q = inter_q.view(dec_len, bsz, self.n_heads, self.d_head)
 
         attn_score = torch.einsum("qbnd,kbnd->qkbn", inter_q, inter_k)
         attn_score.mul_(self.scale)
@@ -218,6 +227,50 @@ class RelPartialLearnableMultiHeadAttn(torch.nn.Module):
         interaction_output = self.layer_norm_interaction(attn_out + mask_attn_output)
         return interaction_output
 
+    def init_state(self, r, enc_context):
+        """ 增量解码缓存
+        :param r: 全部相对位置编码 (seq_len, d_model), 对应相对距离 seq_len-1 ... 0
+        :param enc_context: (enc_len, bsz, d_model)
+        :return: 相对位置 K 与编码器交互 K/V 只计算一次, 已解码位置的自注意力 K/V 逐步追加
+        """
+        bsz = enc_context.size(1)
+        inter_k, inter_v = self._interaction_kv(enc_context)
+        empty = enc_context.new_zeros((0, bsz, self.n_heads, self.d_head))
+        return {
+            "r_head_k": self.r_net(r).view(r.size(0), self.n_heads, self.d_head),
+            "inter_k": inter_k, "inter_v": inter_v,
+            "k": empty, "v": empty
+        }
+
+    def step(self, w, state, padding_mask):
+        """ 只计算最新的一个解码位置, 与 forward 对整个前缀计算后取最后一个位置等价
+        :param w: (1, bsz, d_model)
+        """
+        bsz = w.size(1)
+        w_head_q, w_head_k, w_head_v = torch.chunk(self.mask_attn_qkv_net(w), 3, dim=-1)
+        w_head_q = w_head_q.view(1, bsz, self.n_heads, self.d_head)
+        state["k"] = torch.cat([state["k"], w_head_k.view(1, bsz, self.n_heads, self.d_head)], dim=0)
+        state["v"] = torch.cat([state["v"], w_head_v.view(1, bsz, self.n_heads, self.d_head)], dim=0)
+        klen = state["k"].size(0)
+        # 第 j 个位置与当前位置的相对距离为 klen-1-j, 无需 _rel_shift 与因果 mask
+        r_head_k = state["r_head_k"][-klen:]
+
+        AC = torch.einsum("ibnd,jbnd->ijbn", w_head_q + self.r_w_bias, state["k"])  # 1 x klen x bsz x n_head
+        BD = torch.einsum("ibnd,jnd->ijbn", w_head_q + self.r_r_bias, r_head_k)  # 1 x klen x bsz x n_head
+        attn_score = AC + BD
+        attn_score.mul_(self.scale)
+        attn_prob = torch.softmax(attn_score, dim=1)
+        attn_prob = self.drop(attn_prob)
+
+        attn_vec = torch.einsum("ijbn,jbnd->ibnd", attn_prob, state["v"])
+        attn_vec = attn_vec.contiguous().view(1, bsz, self.d_model)
+
+        attn_out = self.mask_attn_o_net(attn_vec)
+        attn_out = self.drop(attn_out)
+
+        mask_attn_output = self.layer_norm_mask_attn(w + attn_out)
+        return self._interaction(mask_attn_output, state["inter_k"], state["inter_v"], padding_mask)
+
 
 class RelPartialLearnableDecoderLayer(torch.nn.Module):
 
@@ -235,6 +288,11 @@ class RelPartialLearnableDecoderLayer(torch.nn.Module):
         ffn_out = self.ffn_layer(attn_output)
         return ffn_out
 
+    def step(self, dec_inp, state, enc_mask):
+        attn_output = self.dec_attn.step(w=dec_inp, state=state, padding_mask=enc_mask)
+        ffn_out = self.ffn_layer(attn_output)
+        return ffn_out
+
 
 class XLDecoder(torch.nn.Module):
 
@@ -270,6 +328,43 @@ class XLDecoder(torch.nn.Module):
             nn.Sigmoid()
         )
 
+    def init_decode_state(self, encoder_rep, input_mask):
+        """ 增量解码状态: 每层缓存已解码位置的 K/V、相对位置项与编码器交互 K/V """
+        pos_seq = torch.arange(self.seq_len - 1, -1, -1.0, device=encoder_rep.device, dtype=encoder_rep.dtype)
+        pos_embed = self.pos_emb(pos_seq)
+        enc_rep_t = encoder_rep.transpose(0, 1).contiguous()
+        return {
+            "enc_mask_t": input_mask.transpose(0, 1).contiguous(),
+            "layers": [layer.dec_attn.init_state(pos_embed, enc_rep_t) for layer in self.layers]
+        }
+
+    @staticmethod
+    def reorder_decode_state(state, index):
+        """ beam search 重排序列后, 已解码位置的 K/V 跟随父序列 """
+        for layer_state in state["layers"]:
+            layer_state["k"] = layer_state["k"].index_select(1, index)
+            layer_state["v"] = layer_state["v"].index_select(1, index)
+
+    def decode_step(self, token_ids, input_ids, encoder_rep, input_mask, state):
+        """ 输入最新解码的 token (bsz,), 返回下一个 token 的概率分布 (bsz, vocab) """
+        core_out = self.word_emb(token_ids)[None, :, :]  # (1, bsz, dim)
+        for layer, layer_state in zip(self.layers, state["layers"]):
+            core_out = layer.step(dec_inp=core_out, state=layer_state, enc_mask=state["enc_mask_t"])
+        return self.vocab_prob(core_out[0], input_ids, encoder_rep, input_mask)
+
+    def vocab_prob(self, core_out, input_ids, encoder_rep, input_mask):
+        """ 解码位置表示 (bsz, dim) ==> 结合 copy 机制的词表概率 (bsz, vocab) """
+        output = self.output(core_out)
+        vocab_logits = torch.nn.functional.linear(input=output, weight=self.word_emb.weight)
+        vocab_prob = torch.softmax(vocab_logits, dim=-1)
+        input_logits = torch.einsum("bd,bjd->bj", self.copy_output(core_out), encoder_rep)  # (bsz, enc_len)
+        input_logits = input_logits + (1.0 - input_mask) * (-1e30)
+        input_prob = torch.softmax(input_logits, dim=-1)  # (bsz, enc_len)
+        mode_sig = self.mode_select(core_out)  # (bsz, 1)
+        vocab_prob = vocab_prob * mode_sig
+        vocab_prob = torch.scatter_add(vocab_prob, dim=1, index=input_ids, src=(1 - mode_sig) * input_prob)
+        return vocab_prob
+
     def forward(self, input_ids, encoder_rep, input_mask, decode_input, decode_target, use_beam_search, beam_width):
         bsz = input_ids.size(0)
         if decode_input is not None:  # 代表训练模式
@@ -306,35 +401,14 @@ class XLDecoder(torch.nn.Module):
             # 为了并行化设计, 将loss变成(bsz,)
             return loss[None].repeat(bsz)
         else:  # 代表验证或者测试解码模式 ==> 比较耗时
+            # 增量解码: 每步只计算最新 token, 之前位置的 K/V 从缓存读取
+            state = self.init_decode_state(encoder_rep, input_mask)
             dec_list = []
-            decode_ids = torch.full(size=(bsz, 1), fill_value=args["start_token_id"], dtype=torch.int32).long().to(device)
+            token_ids = torch.full(size=(bsz,), fill_value=args["start_token_id"], dtype=torch.long, device=input_ids.device)
             for i in range(1, self.seq_len + 1):
-                if i > 1:
-                    decode_ids = torch.cat([decode_ids, dec_list[i - 2]], dim=-1)
-                decode_embed = self.word_emb(decode_ids)
-                all_ones = decode_embed.new_ones((i, i), dtype=torch.uint8)
-                dec_attn_mask = torch.tril(all_ones, diagonal=0)[:, :, None, None]
-                pos_seq = torch.arange(i - 1, -1, -1.0, device=device, dtype=decode_embed.dtype)
-                pos_embed = self.pos_emb(pos_seq)
-                core_out = decode_embed.transpose(0, 1).contiguous()
-                enc_rep_t = encoder_rep.transpose(0, 1).contiguous()
-                enc_mask_t = input_mask.transpose(0, 1).contiguous()
-                for layer in self.layers:
-                    core_out = layer(
-                        dec_inp=core_out, r=pos_embed, enc_inp=enc_rep_t,
-                        dec_mask=dec_attn_mask, enc_mask=enc_mask_t
-                    )
-                core_out = core_out.transpose(0, 1).contiguous()[:, -1, :]
-                output = self.output(core_out)
-                vocab_logits = torch.nn.functional.linear(input=output, weight=self.word_emb.weight)
-                vocab_prob = torch.softmax(vocab_logits, dim=-1)
-                input_logits = torch.einsum("bd,bjd->bj", self.copy_output(core_out), encoder_rep)  # (bsz, enc_len)
-                input_logits = input_logits + (1.0 - input_mask) * (-1e30)
-                input_prob = torch.softmax(input_logits, dim=-1)  # (bsz, enc_len)
-                mode_sig = self.mode_select(core_out)  # (bsz, 1)
-                vocab_prob = vocab_prob * mode_sig
-                vocab_prob = torch.scatter_add(vocab_prob, dim=1, index=input_ids, src=(1 - mode_sig) * input_prob)
-                dec_list.append(torch.argmax(vocab_prob, dim=-1)[:, None])
+                vocab_prob = self.decode_step(token_ids, input_ids, encoder_rep, input_mask, state)
+                token_ids = torch.argmax(vocab_prob, dim=-1)
+                dec_list.append(token_ids[:, None])
             return torch.cat(dec_list, dim=-1)
 
 
@@ -0,0 +1,115 @@
+"""
+# 问题生成吞吐对比: 逐条生成(固定 padding 到 max_enc_len)  vs  predict_batch(按长度分桶 + 动态 padding + 提前结束)
+# 使用随机初始化的小模型与字表, 不需要预训练权重; greedy 结果逐条校验一致
+    python benchmark_generation.py --num_items=256 --batch_sizes=8,32,64
+"""
+import os
+import time
+import random
+import tempfile
+import argparse
+import json
+import torch
+from transformers import BertTokenizer
+
+import question_generation_inference as qg
+from question_generation_inference import QGUtils, QuestionGeneration, QuestionGenerationInfer, args
+
+SPECIAL_TOKENS = ["[PAD]", "[unused1]", "[unused2]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+CORPUS = "黄帝说：我愿意听你讲讲三阴三阳的离合情况。岐伯说：圣人面向南方站立，前方名叫广明，后方名叫太冲，行于太冲部位的经脉，叫做少阴。" \
+         "在少阴经上面的经脉，名叫太阳，太阳经的下端起于足小趾外侧的至阴穴，其上端结于晴明穴，因太阳为少阴之表，故称为阴中之阳。" \
+         "再以人身上下而言，上半身属于阳，称为广明，广明之下称为太阴，太阴前面的经脉，名叫阳明，阳明经的下端起于足大趾侧次趾之端的历兑穴。"
+
+
+def set_parameters():
+    parse = argparse.ArgumentParser(description="问题生成吞吐对比")
+    parse.add_argument("--num_items", type=int, default=128, help="(上下文, 答案)对数量.")
+    parse.add_argument("--min_len", type=int, default=32, help="上下文最小字数.")
+    parse.add_argument("--max_len", type=int, default=480, help="上下文最大字数.")
+    parse.add_argument("--batch_sizes", type=str, default="8,32", help="batch 大小, 逗号分隔.")
+    parse.add_argument("--dimension", type=int, default=256)
+    parse.add_argument("--encoder_layers", type=int, default=2)
+    parse.add_argument("--decoder_layers", type=int, default=2)
+    parse.add_argument("--max_dec_len", type=int, default=50)
+    parse.add_argument("--beam_width", type=int, default=3)
+    parse.add_argument("--seed", type=int, default=1234)
+    parse.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    return parse.parse_args()
+
+
+def build_model(opts, work_dir):
+    chars = sorted(set(CORPUS))
+    with open(os.path.join(work_dir, "vocab.txt"), "w", encoding="utf-8") as fw:
+        fw.write("\n".join(SPECIAL_TOKENS + chars))
+    with open(os.path.join(work_dir, "config.json"), "w", encoding="utf-8") as fw:
+        json.dump({"vocab_size": len(SPECIAL_TOKENS) + len(chars), "hidden_size": opts.dimension,
+                   "num_hidden_layers": opts.encoder_layers, "num_attention_heads": 4,
+                   "intermediate_size": 4 * opts.dimension, "max_position_embeddings": 512}, fw)
+    args.update(dimension=opts.dimension, decoder_layers=opts.decoder_layers, max_dec_len=opts.max_dec_len,
+                beam_width=opts.beam_width, use_beam_search=False)
+    tokenizer = BertTokenizer(os.path.join(work_dir, "vocab.txt"))
+    args["vocab_size"] = len(tokenizer)
+
+    model = QuestionGeneration(pre_train_dir=work_dir)
+    for name, p in model.decoder_layer.named_parameters():
+        if name.endswith("r_r_bias") or name.endswith("r_w_bias"):  # 未初始化的参数
+            torch.nn.init.normal_(p, 0.0, 0.02)
+    return QuestionGenerationInfer(model=model.to(qg.device), tokenizer=tokenizer)
+
+
+def make_items(opts):
+    rng = random.Random(opts.seed)
+    texts, answers = [], []
+    for _ in range(opts.num_items):
+        length = rng.randint(opts.min_len, opts.max_len)
+        text = (CORPUS * (length // len(CORPUS) + 1))[:length]
+        start = rng.randint(0, length - 10)
+        texts.append(text)
+        answers.append(text[start:start + rng.randint(4, 30)])
+    return texts, answers
+
+
+def loop_predict(infer, texts, answers, use_beam_search):
+    """ 原来的方式: 每次一条, padding 到 max_enc_len """
+    infer.model.eval()
+    questions = []
+    with torch.no_grad():
+        for text, answer in zip(texts, answers):
+            dec_seq = infer.model(**QGUtils.text_encode(infer.tokenizer, text, answer), use_beam_search=use_beam_search)
+            questions.append(QGUtils.ids_to_string(infer.tokenizer, dec_seq.cpu().numpy()[0], text=text, answer=answer))
+    return questions
+
+
+def timed(fn, *inputs, **kwargs):
+    start = time.perf_counter()
+    output = fn(*inputs, **kwargs)
+    return output, time.perf_counter() - start
+
+
+def main():
+    opts = set_parameters()
+    qg.device = opts.device
+    torch.manual_seed(opts.seed)
+    with tempfile.TemporaryDirectory() as work_dir:
+        infer = build_model(opts, work_dir)
+    texts, answers = make_items(opts)
+
+    print("{:>6} {:>8} {:>14} {:>10}".format("mode", "batch", "items/s", "speedup"))
+    for use_beam_search in (False, True):
+        mode = "beam" if use_beam_search else "greedy"
+        expected, loop_seconds = timed(loop_predict, infer, texts, answers, use_beam_search)
+        print("{:>6} {:>8} {:>14.2f} {:>10}".format(mode, "loop", len(texts) / loop_seconds, "1.00x"))
+        for batch_size in [int(x) for x in opts.batch_sizes.split(",")]:
+            questions, seconds = timed(infer.predict_batch, texts, answers, batch_size=batch_size,
+                                       use_beam_search=use_beam_search)
+            if not use_beam_search:
+                assert questions == expected, "batched greedy results mismatch"
+            else:
+                agreement = sum(q == e for q, e in zip(questions, expected)) / len(expected)
+            print("{:>6} {:>8} {:>14.2f} {:>9.2f}x{}".format(
+                mode, batch_size, len(texts) / seconds, loop_seconds / seconds,
+                "" if not use_beam_search else "  (same as loop: {:.1%})".format(agreement)))
+
+
+if __name__ == "__main__":
+    main()
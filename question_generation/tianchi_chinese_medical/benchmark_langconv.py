@@ -0,0 +1,90 @@
+"""
+# 繁简转换吞吐对比: langconv.Converter  vs  fast_langconv.Converter(单进程 / 多进程流式)
+# 语料由 zh_wiki 中的繁体词(含多字词)与常见字随机拼接, 两者结果逐行校验一致
+    python benchmark_langconv.py --num_lines=2000 --workers=1,2,4
+"""
+import os
+import time
+import random
+import tempfile
+import argparse
+
+from langconv import Converter
+from zh_wiki import zh2Hans
+import fast_langconv
+
+COMMON = "黄帝说我愿意听你讲讲三阴三阳的离合情况岐伯圣人面向南方站立前方名叫广明后方太冲，。：；？！、abc123 "
+
+
+def set_parameters():
+    parse = argparse.ArgumentParser(description="繁简转换吞吐对比")
+    parse.add_argument("--num_lines", type=int, default=2000, help="语料行数.")
+    parse.add_argument("--line_len", type=int, default=200, help="每行大约的字数.")
+    parse.add_argument("--workers", type=str, default="1,2", help="fast_langconv 进程数, 逗号分隔.")
+    parse.add_argument("--chunk_size", type=int, default=200)
+    parse.add_argument("--seed", type=int, default=1234)
+    return parse.parse_args()
+
+
+def make_lines(opts):
+    rng = random.Random(opts.seed)
+    words = sorted(zh2Hans)
+    long_words = [w for w in words if len(w) > 1]
+    lines = []
+    for _ in range(opts.num_lines):
+        pieces, length = [], 0
+        while length < opts.line_len:
+            r = rng.random()
+            if r < 0.3:
+                piece = rng.choice(long_words)
+                # 截断或拼接多字词, 覆盖前缀匹配失败与词之间重叠的情况
+                if rng.random() < 0.3:
+                    piece = piece[:rng.randint(1, len(piece))] + rng.choice(long_words)
+            elif r < 0.6:
+                piece = rng.choice(words)
+            else:
+                piece = rng.choice(COMMON)
+            pieces.append(piece)
+            length += len(piece)
+        lines.append("".join(pieces))
+    return lines
+
+
+def main():
+    opts = set_parameters()
+    lines = make_lines(opts)
+    num_chars = sum(len(line) for line in lines)
+
+    start = time.perf_counter()
+    converter = Converter("zh-hans")
+    expected = [converter.convert(line) for line in lines]
+    langconv_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    converter = fast_langconv.Converter("zh-hans")
+    actual = [converter.convert(line) for line in lines]
+    fast_seconds = time.perf_counter() - start
+    mismatch = [i for i, (e, a) in enumerate(zip(expected, actual)) if e != a]
+    assert not mismatch, "line {} mismatch".format(mismatch[0])
+
+    print("{:>22} {:>14} {:>10}".format("converter", "chars/s", "speedup"))
+    print("{:>22} {:>14.0f} {:>10}".format("langconv", num_chars / langconv_seconds, "1.00x"))
+    print("{:>22} {:>14.0f} {:>9.2f}x".format("fast_langconv", num_chars / fast_seconds,
+                                              langconv_seconds / fast_seconds))
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        file_in, file_out = os.path.join(work_dir, "in.txt"), os.path.join(work_dir, "out.txt")
+        with open(file_in, "w", encoding="utf-8") as fw:
+            fw.write("\n".join(lines) + "\n")
+        for workers in [int(x) for x in opts.workers.split(",")]:
+            start = time.perf_counter()
+            fast_langconv.convert_file(file_in, file_out, "zh-hans", workers=workers, chunk_size=opts.chunk_size)
+            seconds = time.perf_counter() - start
+            with open(file_out, encoding="utf-8") as fr:
+                assert fr.read().split("\n")[:-1] == expected, "convert_file mismatch"
+            print("{:>22} {:>14.0f} {:>9.2f}x".format("convert_file -j {}".format(workers), num_chars / seconds,
+                                                      langconv_seconds / seconds))
+
+
+if __name__ == "__main__":
+    main()
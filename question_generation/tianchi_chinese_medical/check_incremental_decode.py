@@ -0,0 +1,127 @@
+"""
+# XLDecoder 增量解码(K/V 缓存) 与整段前缀重算的一致性校验及耗时对比
+# 使用随机初始化的小模型, 不需要预训练权重
+    python check_incremental_decode.py --batch_size=4 --dec_len=64
+"""
+import time
+import argparse
+import torch
+from torch import nn
+
+import question_generation_inference as qg
+from question_generation_inference import XLDecoder, args
+
+
+class FullRecomputeXLDecoder(XLDecoder):
+    """ 参照实现: 每一步把整个已解码前缀重新输入所有层(增量解码之前的做法) """
+
+    def init_decode_state(self, encoder_rep, input_mask):
+        return {"decode_ids": None}
+
+    @staticmethod
+    def reorder_decode_state(state, index):
+        state["decode_ids"] = state["decode_ids"].index_select(0, index)
+
+    def decode_step(self, token_ids, input_ids, encoder_rep, input_mask, state):
+        if state["decode_ids"] is None:
+            state["decode_ids"] = token_ids[:, None]
+        else:
+            state["decode_ids"] = torch.cat([state["decode_ids"], token_ids[:, None]], dim=-1)
+        i = state["decode_ids"].size(1)
+        decode_embed = self.word_emb(state["decode_ids"])
+        all_ones = decode_embed.new_ones((i, i), dtype=torch.uint8)
+        dec_attn_mask = torch.tril(all_ones, diagonal=0)[:, :, None, None]
+        pos_seq = torch.arange(i - 1, -1, -1.0, device=decode_embed.device, dtype=decode_embed.dtype)
+        pos_embed = self.pos_emb(pos_seq)
+        core_out = decode_embed.transpose(0, 1).contiguous()
+        enc_rep_t = encoder_rep.transpose(0, 1).contiguous()
+        enc_mask_t = input_mask.transpose(0, 1).contiguous()
+        for layer in self.layers:
+            core_out = layer(
+                dec_inp=core_out, r=pos_embed, enc_inp=enc_rep_t,
+                dec_mask=dec_attn_mask, enc_mask=enc_mask_t
+            )
+        core_out = core_out.transpose(0, 1).contiguous()[:, -1, :]
+        return self.vocab_prob(core_out, input_ids, encoder_rep, input_mask)
+
+
+def set_parameters():
+    parse = argparse.ArgumentParser(description="XLDecoder 增量解码校验")
+    parse.add_argument("--batch_size", type=int, default=4)
+    parse.add_argument("--enc_len", type=int, default=128)
+    parse.add_argument("--dec_len", type=int, default=64)
+    parse.add_argument("--dimension", type=int, default=256)
+    parse.add_argument("--decoder_layers", type=int, default=3)
+    parse.add_argument("--vocab_size", type=int, default=2000)
+    parse.add_argument("--beam_width", type=int, default=3)
+    parse.add_argument("--seed", type=int, default=1234)
+    parse.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    return parse.parse_args()
+
+
+def build_decoders(opts):
+    args["decoder_layers"] = opts.decoder_layers
+    args["vocab_size"] = opts.vocab_size
+    word_emb = nn.Embedding(opts.vocab_size, opts.dimension)
+    incremental = XLDecoder(dim=opts.dimension, embedding_matrix=word_emb, seq_len=opts.dec_len)
+    for p in incremental.parameters():
+        if p.dim() > 1:
+            nn.init.normal_(p, 0.0, 0.1)
+        else:
+            nn.init.normal_(p, 0.0, 0.02)  # r_r_bias / r_w_bias 未初始化
+    reference = FullRecomputeXLDecoder(dim=opts.dimension, embedding_matrix=word_emb, seq_len=opts.dec_len)
+    reference.load_state_dict(incremental.state_dict())
+    return incremental.to(qg.device).eval(), reference.to(qg.device).eval()
+
+
+def make_inputs(opts):
+    input_ids = torch.randint(3, opts.vocab_size, (opts.batch_size, opts.enc_len), device=qg.device)
+    encoder_rep = torch.randn(opts.batch_size, opts.enc_len, opts.dimension, device=qg.device)
+    lengths = torch.randint(opts.enc_len // 4, opts.enc_len + 1, (opts.batch_size,), device=qg.device)
+    input_mask = (torch.arange(opts.enc_len, device=qg.device)[None, :] < lengths[:, None]).float()
+    return input_ids, encoder_rep, input_mask
+
+
+def step_probs(decoder, input_ids, encoder_rep, input_mask, tokens):
+    """ 用同一串 teacher-forcing token 逐步解码, 返回每步的概率分布 """
+    state = decoder.init_decode_state(encoder_rep, input_mask)
+    return [decoder.decode_step(tokens[:, i], input_ids, encoder_rep, input_mask, state) for i in range(tokens.size(1))]
+
+
+def timed(fn, *inputs):
+    start = time.perf_counter()
+    output = fn(*inputs)
+    return output, (time.perf_counter() - start) * 1000
+
+
+def main():
+    opts = set_parameters()
+    qg.device = opts.device
+    torch.manual_seed(opts.seed)
+    incremental, reference = build_decoders(opts)
+    input_ids, encoder_rep, input_mask = make_inputs(opts)
+
+    with torch.no_grad():
+        # 1. 每步概率分布
+        tokens = torch.randint(3, opts.vocab_size, (opts.batch_size, opts.dec_len), device=qg.device)
+        tokens[:, 0] = args["start_token_id"]
+        max_diff = max(float((a - b).abs().max()) for a, b in zip(
+            step_probs(incremental, input_ids, encoder_rep, input_mask, tokens),
+            step_probs(reference, input_ids, encoder_rep, input_mask, tokens)))
+        print("max abs diff of step probabilities: {:.3e}".format(max_diff))
+        assert max_diff < 1e-5, max_diff
+
+        # 2. greedy / beam search 解码结果
+        for use_beam_search in (False, True):
+            decode = lambda decoder: decoder(input_ids, encoder_rep, input_mask, None, None,
+                                             use_beam_search, opts.beam_width)
+            expected, reference_ms = timed(decode, reference)
+            actual, incremental_ms = timed(decode, incremental)
+            assert torch.equal(expected, actual), "{} decoding mismatch".format(
+                "beam" if use_beam_search else "greedy")
+            print("{:>6}: full recompute {:8.1f} ms, incremental {:8.1f} ms, speedup {:.2f}x".format(
+                "beam" if use_beam_search else "greedy", reference_ms, incremental_ms, reference_ms / incremental_ms))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,20 @@
 """
 # 原始数据预处理
+# 大规模语料使用流式模式: 分块读取 -> 多进程处理 -> 按输入顺序增量写出分片, 内存占用与语料大小无关
+    python data_preprocess.py --stream --slide --data_path=./DataSet/passages.json --output_dir=./DataSet/shards --workers=4
 """
 import os
+import re
 import logging
 import json
 import pickle
+import argparse
+from collections import deque
+from multiprocessing import Pool
 from random import shuffle
 import numpy as np
 from tqdm import tqdm
-from langconv import *
+from fast_langconv import Converter
 
 obj = Converter('zh-hans')
 logger = logging.getLogger(__name__)
@@ -86,20 +92,7 @@ class DatasetPreprocess(object):
         with open(data_path, mode='r', encoding='utf-8') as fp:
             origin_data = json.load(fp)
             for art_idx, single_artical in enumerate(tqdm(origin_data)):
-                for pgh_idx, paragraph in enumerate(single_artical['paragraphs']):
-                    for qa_ids, qas in enumerate(paragraph['annotations']):
-                        if self.a2q:
-                            data_output['train_items'].append({
-                                "context": paragraph["text"],
-                                "query": qas["Q"],
-                                "answer": qas["A"]
-                            })
-                        else:
-                            data_output['train_items'].append({
-                                "context": paragraph["text"],
-                                "query": qas["A"],
-                                "answer": qas["Q"]
-                            })
+                data_output['train_items'].extend(self.artical_items(single_artical, slide=False))
 
         for i in range(3):
             shuffle(data_output['train_items'])  # 数据随机化
@@ -114,17 +107,7 @@ class DatasetPreprocess(object):
         with open(data_path, mode='r', encoding='utf-8') as fp:
             origin_data = json.load(fp)
             for art_idx, single_artical in enumerate(tqdm(origin_data)):
-                paragraph_str = str()
-                qas = []
-                for pgh_idx, paragraph in enumerate(single_artical['paragraphs']):
-                    text = paragraph['text']  # 是否需要对末尾标点进行判断处理
-                    paragraph_str += text
-                    qas.extend(paragraph['annotations'])
-
-                if paragraph_str and qas:
-                    artical_data = self.slide_paragraph(paragraph_str, qas, max_len=512, step=3)
-                    if artical_data:
-                        data_output['train_items'].extend(artical_data)
+                data_output['train_items'].extend(self.artical_items(single_artical, slide=True))
 
         for i in range(3):
             shuffle(data_output['train_items'])  # 数据随机化
@@ -133,6 +116,69 @@ class DatasetPreprocess(object):
         with open(output_data_path, mode='wb') as f:
             pickle.dump(data_output, f)
 
+    def artical_items(self, single_artical, slide=False, max_len=512, step=3):
+        """单篇文章生成的训练数据, slide=True 时整篇拼接后添加滑窗"""
+        items = []
+        if not slide:
+            for pgh_idx, paragraph in enumerate(single_artical['paragraphs']):
+                for qa_ids, qas in enumerate(paragraph['annotations']):
+                    if self.a2q:
+                        items.append({
+                            "context": paragraph["text"],
+                            "query": qas["Q"],
+                            "answer": qas["A"]
+                        })
+                    else:
+                        items.append({
+                            "context": paragraph["text"],
+                            "query": qas["A"],
+                            "answer": qas["Q"]
+                        })
+            return items
+
+        paragraph_str = str()
+        qas = []
+        for pgh_idx, paragraph in enumerate(single_artical['paragraphs']):
+            text = paragraph['text']  # 是否需要对末尾标点进行判断处理
+            paragraph_str += text
+            qas.extend(paragraph['annotations'])
+
+        if paragraph_str and qas:
+            items.extend(self.slide_paragraph(paragraph_str, qas, max_len=max_len, step=step))
+        return items
+
+    def cloudwalk_stream(self, data_path, output_dir, slide=False, workers=1, chunk_size=64, shard_size=10000,
+                         max_len=512, step=3):
+        """
+        流式处理自定义数据: 分块读取文章, 多进程处理, 按输入顺序增量写出分片 shard-00000.pkl, ... 与清单 shards.json
+        每个分片格式与 cloudwalk_json 的输出相同({"train_items": [...]}), 分片内不打乱, 结果与进程数无关
+        :param data_path: json 数组文件或 jsonl 文件(每行一篇文章)
+        :param chunk_size: 每个进程任务的文章数
+        :param shard_size: 每个分片的最大数据条数
+        :return: 分片路径列表
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        writer = ShardWriter(output_dir, shard_size)
+        chunks = iter_chunks(iter_articles(data_path), chunk_size)
+        options = (self.a2q, slide, max_len, step)
+        if workers <= 1:
+            _init_worker(*options)
+            for chunk in tqdm(chunks):
+                writer.write(_process_chunk(chunk))
+        else:
+            with Pool(workers, initializer=_init_worker, initargs=options) as pool:
+                # 有界的在途任务队列, 按提交顺序取回结果: 读取速度不会超过处理速度, 输出顺序确定
+                pending = deque()
+                for chunk in tqdm(chunks):
+                    pending.append(pool.apply_async(_process_chunk, (chunk,)))
+                    if len(pending) >= 2 * workers:
+                        writer.write(pending.popleft().get())
+                while pending:
+                    writer.write(pending.popleft().get())
+        writer.close()
+        print("cloudwalk用于训练数据一共有{}条, 写入{}个分片".format(writer.total, len(writer.paths)))
+        return writer.paths
+
     def slide_paragraph(self, doc, answers, max_len=512, step=3):
         """
         :param doc:
@@ -218,7 +264,141 @@ class DatasetPreprocess(object):
         return sent_list
 
 
+def iter_articles(data_path, buffer_size=1 << 20):
+    """逐篇读取文章, 不把整个文件载入内存: jsonl 每行一篇; json 数组按块读取并逐个解析元素"""
+    with open(data_path, mode='r', encoding='utf-8') as fp:
+        if data_path.endswith(".jsonl"):
+            for line in fp:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        decoder = json.JSONDecoder()
+        buffer, pos, started, eof = "", 0, False, False
+        while True:
+            # 跳过空白与分隔符
+            while pos < len(buffer):
+                if buffer[pos] in " \t\r\n,":
+                    pos += 1
+                elif not started and buffer[pos] == "[":
+                    started = True
+                    pos += 1
+                elif started and buffer[pos] == "]":
+                    return
+                else:
+                    break
+            if pos < len(buffer) and started:
+                try:
+                    item, end = decoder.raw_decode(buffer, pos)
+                    yield item
+                    pos = end
+                    continue
+                except ValueError:
+                    if eof:
+                        raise
+            elif eof:
+                return
+            # 当前块中元素不完整, 继续读取
+            chunk = fp.read(buffer_size)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+
+
+def iter_chunks(items, chunk_size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+SHARD_MANIFEST = "shards.json"
+
+
+class ShardWriter(object):
+    """
+    按顺序写出分片, 每满 shard_size 条写一个文件(先写临时文件再重命名, 中断时不会留下不完整的分片)
+    开始时删除目录中上一次运行的分片与清单, 全部写完后才写出清单 shards.json, load_shards 只读取清单中的分片
+    """
+    def __init__(self, output_dir, shard_size):
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        self.buffer = []
+        self.paths = []
+        self.total = 0
+        for file in os.listdir(output_dir):
+            if file == SHARD_MANIFEST or (file.startswith("shard-") and ".pkl" in file):
+                os.remove(os.path.join(output_dir, file))
+
+    def write(self, items):
+        self.buffer.extend(items)
+        self.total += len(items)
+        while len(self.buffer) >= self.shard_size:
+            self.flush(self.buffer[:self.shard_size])
+            self.buffer = self.buffer[self.shard_size:]
+
+    def flush(self, items):
+        path = os.path.join(self.output_dir, "shard-{:05d}.pkl".format(len(self.paths)))
+        with open(path + ".tmp", mode='wb') as f:
+            pickle.dump({"train_items": items}, f)
+        os.replace(path + ".tmp", path)
+        self.paths.append(path)
+
+    def close(self):
+        if self.buffer:
+            self.flush(self.buffer)
+            self.buffer = []
+        manifest = os.path.join(self.output_dir, SHARD_MANIFEST)
+        with open(manifest + ".tmp", mode='w', encoding='utf-8') as f:
+            json.dump({"shards": [os.path.basename(path) for path in self.paths], "total": self.total}, f)
+        os.replace(manifest + ".tmp", manifest)
+
+
+def load_shards(output_dir):
+    """按清单合并分片为 cloudwalk_json 的输出格式, 供训练脚本直接使用; 没有清单(运行未完成)时报错"""
+    with open(os.path.join(output_dir, SHARD_MANIFEST), mode='r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    train_items = []
+    for file in manifest["shards"]:
+        with open(os.path.join(output_dir, file), mode='rb') as f:
+            train_items.extend(pickle.load(f)["train_items"])
+    assert len(train_items) == manifest["total"], "分片与清单不一致: {}".format(output_dir)
+    return {"train_items": train_items}
+
+
+# 进程内的处理对象, 由 _init_worker 设置
+_worker = {}
+
+
+def _init_worker(a2q, slide, max_len, step):
+    data_obj = DatasetPreprocess()
+    data_obj.a2q = a2q
+    _worker.update(data_obj=data_obj, slide=slide, max_len=max_len, step=step)
+
+
+def _process_chunk(chunk):
+    items = []
+    for single_artical in chunk:
+        items.extend(_worker["data_obj"].artical_items(
+            single_artical, slide=_worker["slide"], max_len=_worker["max_len"], step=_worker["step"]))
+    return items
+
+
 if __name__ == "__main__":
+    parse = argparse.ArgumentParser(description="原始数据预处理")
+    parse.add_argument("--data_path", type=str, default="./DataSet/cloudwalk_train_enhancement.json")
+    parse.add_argument("--output_data_path", type=str, default="./DataSet/cloudwalk_dataset_enhancement_q2a.pkl")
+    parse.add_argument("--slide", action="store_true", help="整篇文章拼接后添加滑窗.")
+    parse.add_argument("--stream", action="store_true", help="流式处理, 分片写出到 output_dir.")
+    parse.add_argument("--output_dir", type=str, default="./DataSet/cloudwalk_shards")
+    parse.add_argument("--workers", type=int, default=1, help="流式处理的进程数.")
+    parse.add_argument("--chunk_size", type=int, default=64, help="每个进程任务的文章数.")
+    parse.add_argument("--shard_size", type=int, default=10000, help="每个分片的最大数据条数.")
+    opts = parse.parse_args()
+
     data_obj = DatasetPreprocess()
     # print("处理DuReader数据.")
     # data_obj.deal_dureader_dataset()
@@ -237,7 +417,10 @@ if __name__ == "__main__":
     # data_obj.deal_drcd_dataset()
 
     print("处理CloudWalk数据.")
-    data_path = "./DataSet/cloudwalk_train_enhancement.json"
-    output_data_path = "./DataSet/cloudwalk_dataset_enhancement_q2a.pkl"
-    data_obj.cloudwalk_json(data_path, output_data_path)
-    # data_obj.cloudwalk_json_slide(data_path, output_data_path)
+    if opts.stream:
+        data_obj.cloudwalk_stream(opts.data_path, opts.output_dir, slide=opts.slide, workers=opts.workers,
+                                  chunk_size=opts.chunk_size, shard_size=opts.shard_size)
+    elif opts.slide:
+        data_obj.cloudwalk_json_slide(opts.data_path, opts.output_data_path)
+    else:
+        data_obj.cloudwalk_json(opts.data_path, opts.output_data_path)
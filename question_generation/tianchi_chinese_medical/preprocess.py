@@ -66,7 +66,7 @@ for file in os.listdir("DataSet/MultiTask/CMRC"):
 
 print("===完成CMRC数据处理===")
 
-from langconv import *
+from fast_langconv import Converter
 obj = Converter('zh-hans')
 
 
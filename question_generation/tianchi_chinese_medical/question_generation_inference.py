@@ -13,7 +13,6 @@ from torch import nn
 import pickle
 import json
 import re
-from copy import deepcopy
 from configs import *
 
 args = qg_configs
@@ -30,7 +29,8 @@ logger = logging.getLogger(__name__)
 
 class QGUtils(object):
     @staticmethod
-    def text_encode(tokenizer, context, answer):
+    def text_encode_ids(tokenizer, context, answer):
+        """ 不做 padding 的编码, 返回 (input_ids, input_seg) """
         process_context = context.replace("\n", " ").replace("\t", " ").replace("\\", "")
         context_tokens = tokenizer.tokenize(process_context)
         answer_tokens = tokenizer.tokenize(answer)[:args["max_answer_len"]]
@@ -39,19 +39,31 @@ class QGUtils(object):
             c = c[:args["max_enc_len"] - 1]
         c += ["[SEP]"]
         input_ids = tokenizer.convert_tokens_to_ids(c)
-        input_mask = [1.0] * len(input_ids)
         input_seg = [0] * (len(answer_tokens) + 2) + [1] * (len(input_ids) - 2 - len(answer_tokens))
-        extra = args["max_enc_len"] - len(input_ids)
-        if extra > 0:
-            input_ids += [0] * extra
-            input_mask += [0.0] * extra
-            input_seg += [1] * extra
+        return input_ids, input_seg
+
+    @staticmethod
+    def collate(encodings, max_len=None):
+        """ text_encode_ids 的结果 padding 到 max_len(默认 batch 内最大长度) """
+        if max_len is None:
+            max_len = max(len(input_ids) for input_ids, _ in encodings)
+        input_ids = torch.zeros((len(encodings), max_len), dtype=torch.long)
+        input_mask = torch.zeros((len(encodings), max_len), dtype=torch.float)
+        input_seg = torch.ones((len(encodings), max_len), dtype=torch.long)
+        for i, (ids, seg) in enumerate(encodings):
+            input_ids[i, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+            input_mask[i, :len(ids)] = 1.0
+            input_seg[i, :len(seg)] = torch.tensor(seg, dtype=torch.long)
         return {
-            "input_ids": torch.tensor(input_ids).long().unsqueeze(dim=0).to(device),
-            "input_mask": torch.tensor(input_mask).float().unsqueeze(dim=0).to(device),
-            "input_seg": torch.tensor(input_seg).long().unsqueeze(dim=0).to(device)
+            "input_ids": input_ids.to(device),
+            "input_mask": input_mask.to(device),
+            "input_seg": input_seg.to(device)
         }
 
+    @staticmethod
+    def text_encode(tokenizer, context, answer):
+        return QGUtils.collate([QGUtils.text_encode_ids(tokenizer, context, answer)], max_len=args["max_enc_len"])
+
     @staticmethod
     def ids_to_string(tokenizer, y, text, answer):
         """ 获取预测字符串
@@ -214,11 +226,20 @@ class RelPartialLearnableMultiHeadAttn(torch.nn.Module):
         mask_attn_output = self.layer_norm_mask_attn(w + attn_out)
 
         # 与编码器交互部分
+        inter_k, inter_v = self._interaction_kv(enc_context)
+        return self._interaction(mask_attn_output, inter_k, inter_v, padding_mask)
+
+    def _interaction_kv(self, enc_context):
+        enc_len, bsz = enc_context.size(0), enc_context.size(1)
         inter_k, inter_v = torch.chunk(self.interaction_kv_net(enc_context), 2, dim=-1)
-        inter_q = self.interaction_q_net(mask_attn_output)
-        inter_q = inter_q.view(dec_len, bsz, self.n_heads, self.d_head)
         inter_k = inter_k.view(enc_len, bsz, self.n_heads, self.d_head)
         inter_v = inter_v.view(enc_len, bsz, self.n_heads, self.d_head)
+        return inter_k, inter_v
+
+    def _interaction(self, mask_attn_output, inter_k, inter_v, padding_mask):
+        dec_len, bsz = mask_attn_output.size(0), mask_attn_output.size(1)
+        inter_q = self.interaction_q_net(mask_attn_output)
+        inter_q = inter_q.view(dec_len, bsz, self.n_heads, self.d_head)
 
         attn_score = torch.einsum("qbnd,kbnd->qkbn", inter_q, inter_k)
         attn_score.mul_(self.scale)
@@ -237,6 +258,68 @@ class RelPartialLearnableMultiHeadAttn(torch.nn.Module):
         interaction_output = self.layer_norm_interaction(attn_out + mask_attn_output)
         return interaction_output
 
+    def init_state(self, r, enc_context, padding_mask):
+        """ 增量解码缓存
+        :param r: 全部相对位置编码 (seq_len, d_model), 对应相对距离 seq_len-1 ... 0
+        :param enc_context: (enc_len, bsz, d_model)
+        :param padding_mask: (enc_len, bsz)
+        :return: 相对位置 K 与编码器交互 K/V 只计算一次, 已解码位置的自注意力 K/V 逐步追加
+        """
+        bsz = enc_context.size(1)
+        inter_k, inter_v = self._interaction_kv(enc_context)
+        empty = enc_context.new_zeros((0, bsz, self.n_heads, self.d_head))
+        return {
+            "r_head_k": self.r_net(r).view(r.size(0), self.n_heads, self.d_head),
+            # 每步只有一个 query, 编码器 K/V 预先转成 (bsz, n_head, enc_len, d_head) 直接 matmul, 避免每步重排
+            "inter_k": inter_k.permute(1, 2, 3, 0).contiguous(),  # bsz x n_head x d_head x enc_len
+            "inter_v": inter_v.permute(1, 2, 0, 3).contiguous(),  # bsz x n_head x enc_len x d_head
+            "padding_bias": ((1 - padding_mask) * (-1e30)).t()[:, None, None, :],  # bsz x 1 x 1 x enc_len
+            "k": empty, "v": empty
+        }
+
+    def step(self, w, state):
+        """ 只计算最新的一个解码位置, 与 forward 对整个前缀计算后取最后一个位置等价
+        :param w: (1, bsz, d_model)
+        """
+        bsz = w.size(1)
+        w_head_q, w_head_k, w_head_v = torch.chunk(self.mask_attn_qkv_net(w), 3, dim=-1)
+        w_head_q = w_head_q.view(1, bsz, self.n_heads, self.d_head)
+        state["k"] = torch.cat([state["k"], w_head_k.view(1, bsz, self.n_heads, self.d_head)], dim=0)
+        state["v"] = torch.cat([state["v"], w_head_v.view(1, bsz, self.n_heads, self.d_head)], dim=0)
+        klen = state["k"].size(0)
+        # 第 j 个位置与当前位置的相对距离为 klen-1-j, 无需 _rel_shift 与因果 mask
+        r_head_k = state["r_head_k"][-klen:]
+
+        AC = torch.einsum("ibnd,jbnd->ijbn", w_head_q + self.r_w_bias, state["k"])  # 1 x klen x bsz x n_head
+        BD = torch.einsum("ibnd,jnd->ijbn", w_head_q + self.r_r_bias, r_head_k)  # 1 x klen x bsz x n_head
+        attn_score = AC + BD
+        attn_score.mul_(self.scale)
+        attn_prob = torch.softmax(attn_score, dim=1)
+        attn_prob = self.drop(attn_prob)
+
+        attn_vec = torch.einsum("ijbn,jbnd->ibnd", attn_prob, state["v"])
+        attn_vec = attn_vec.contiguous().view(1, bsz, self.d_model)
+
+        attn_out = self.mask_attn_o_net(attn_vec)
+        attn_out = self.drop(attn_out)
+
+        mask_attn_output = self.layer_norm_mask_attn(w + attn_out)
+
+        # 与编码器交互部分
+        inter_q = self.interaction_q_net(mask_attn_output).view(bsz, self.n_heads, 1, self.d_head)
+        attn_score = torch.matmul(inter_q, state["inter_k"])  # bsz x n_head x 1 x enc_len
+        attn_score.mul_(self.scale)
+        attn_score = attn_score + state["padding_bias"]
+        attn_prob = torch.softmax(attn_score, dim=-1)
+        attn_prob = self.drop(attn_prob)
+        attn_vec = torch.matmul(attn_prob, state["inter_v"]).view(1, bsz, self.d_model)
+
+        attn_out = self.interaction_o_net(attn_vec)
+        attn_out = self.drop(attn_out)
+
+        interaction_output = self.layer_norm_interaction(attn_out + mask_attn_output)
+        return interaction_output
+
 
 class RelPartialLearnableDecoderLayer(torch.nn.Module):
 
@@ -254,6 +337,11 @@ class RelPartialLearnableDecoderLayer(torch.nn.Module):
         ffn_out = self.ffn_layer(attn_output)
         return ffn_out
 
+    def step(self, dec_inp, state):
+        attn_output = self.dec_attn.step(w=dec_inp, state=state)
+        ffn_out = self.ffn_layer(attn_output)
+        return ffn_out
+
 
 class XLDecoder(torch.nn.Module):
 
@@ -289,6 +377,43 @@ class XLDecoder(torch.nn.Module):
             nn.Sigmoid()
         )
 
+    def init_decode_state(self, encoder_rep, input_mask):
+        """ 增量解码状态: 每层缓存已解码位置的 K/V、相对位置项与编码器交互 K/V """
+        pos_seq = torch.arange(self.seq_len - 1, -1, -1.0, device=encoder_rep.device, dtype=encoder_rep.dtype)
+        pos_embed = self.pos_emb(pos_seq)
+        enc_rep_t = encoder_rep.transpose(0, 1).contiguous()
+        enc_mask_t = input_mask.transpose(0, 1).contiguous()
+        return {
+            "layers": [layer.dec_attn.init_state(pos_embed, enc_rep_t, enc_mask_t) for layer in self.layers]
+        }
+
+    @staticmethod
+    def reorder_decode_state(state, index):
+        """ beam search 重排序列后, 已解码位置的 K/V 跟随父序列 """
+        for layer_state in state["layers"]:
+            layer_state["k"] = layer_state["k"].index_select(1, index)
+            layer_state["v"] = layer_state["v"].index_select(1, index)
+
+    def decode_step(self, token_ids, input_ids, encoder_rep, input_mask, state):
+        """ 输入最新解码的 token (bsz,), 返回下一个 token 的概率分布 (bsz, vocab) """
+        core_out = self.word_emb(token_ids)[None, :, :]  # (1, bsz, dim)
+        for layer, layer_state in zip(self.layers, state["layers"]):
+            core_out = layer.step(dec_inp=core_out, state=layer_state)
+        return self.vocab_prob(core_out[0], input_ids, encoder_rep, input_mask)
+
+    def vocab_prob(self, core_out, input_ids, encoder_rep, input_mask):
+        """ 解码位置表示 (bsz, dim) ==> 结合 copy 机制的词表概率 (bsz, vocab) """
+        output = self.output(core_out)
+        vocab_logits = torch.nn.functional.linear(input=output, weight=self.word_emb.weight)
+        vocab_prob = torch.softmax(vocab_logits, dim=-1)
+        input_logits = torch.einsum("bd,bjd->bj", self.copy_output(core_out), encoder_rep)  # (bsz, enc_len)
+        input_logits = input_logits + (1.0 - input_mask) * (-1e30)
+        input_prob = torch.softmax(input_logits, dim=-1)  # (bsz, enc_len)
+        mode_sig = self.mode_select(core_out)  # (bsz, 1)
+        vocab_prob = vocab_prob * mode_sig
+        vocab_prob = torch.scatter_add(vocab_prob, dim=1, index=input_ids, src=(1 - mode_sig) * input_prob)
+        return vocab_prob
+
     def forward(self, input_ids, encoder_rep, input_mask, decode_input, decode_target, use_beam_search, beam_width):
         bsz = input_ids.size(0)
         if decode_input is not None:  # 代表训练模式
@@ -326,35 +451,19 @@ class XLDecoder(torch.nn.Module):
             return loss[None].repeat(bsz)
         else:  # 代表验证或者测试解码模式 ==> 比较耗时
             if not use_beam_search:  # 使用贪心搜索 ==> 验证集
+                # 增量解码: 每步只计算最新 token, 之前位置的 K/V 从缓存读取
+                state = self.init_decode_state(encoder_rep, input_mask)
                 dec_list = []
-                decode_ids = torch.full(size=(bsz, 1), fill_value=args["start_token_id"], dtype=torch.int32).long().to(device)
+                token_ids = torch.full(size=(bsz,), fill_value=args["start_token_id"], dtype=torch.long, device=input_ids.device)
+                finished = torch.zeros(size=(bsz,), dtype=torch.bool, device=input_ids.device)
                 for i in range(1, self.seq_len + 1):
-                    if i > 1:
-                        decode_ids = torch.cat([decode_ids, dec_list[i - 2]], dim=-1)
-                    decode_embed = self.word_emb(decode_ids)
-                    all_ones = decode_embed.new_ones((i, i), dtype=torch.uint8)
-                    dec_attn_mask = torch.tril(all_ones, diagonal=0)[:, :, None, None]
-                    pos_seq = torch.arange(i - 1, -1, -1.0, device=device, dtype=decode_embed.dtype)
-                    pos_embed = self.pos_emb(pos_seq)
-                    core_out = decode_embed.transpose(0, 1).contiguous()
-                    enc_rep_t = encoder_rep.transpose(0, 1).contiguous()
-                    enc_mask_t = input_mask.transpose(0, 1).contiguous()
-                    for layer in self.layers:
-                        core_out = layer(
-                            dec_inp=core_out, r=pos_embed, enc_inp=enc_rep_t,
-                            dec_mask=dec_attn_mask, enc_mask=enc_mask_t
-                        )
-                    core_out = core_out.transpose(0, 1).contiguous()[:, -1, :]
-                    output = self.output(core_out)
-                    vocab_logits = torch.nn.functional.linear(input=output, weight=self.word_emb.weight)
-                    vocab_prob = torch.softmax(vocab_logits, dim=-1)
-                    input_logits = torch.einsum("bd,bjd->bj", self.copy_output(core_out), encoder_rep)  # (bsz, enc_len)
-                    input_logits = input_logits + (1.0 - input_mask) * (-1e30)
-                    input_prob = torch.softmax(input_logits, dim=-1)  # (bsz, enc_len)
-                    mode_sig = self.mode_select(core_out)  # (bsz, 1)
-                    vocab_prob = vocab_prob * mode_sig
-                    vocab_prob = torch.scatter_add(vocab_prob, dim=1, index=input_ids, src=(1 - mode_sig) * input_prob)
-                    dec_list.append(torch.argmax(vocab_prob, dim=-1)[:, None])
+                    vocab_prob = self.decode_step(token_ids, input_ids, encoder_rep, input_mask, state)
+                    # 已生成 end_token 的序列之后只输出 end_token, 全部结束时提前停止
+                    token_ids = torch.argmax(vocab_prob, dim=-1).masked_fill(finished, args["end_token_id"])
+                    dec_list.append(token_ids[:, None])
+                    finished |= token_ids == args["end_token_id"]
+                    if bool(finished.all()):
+                        break
                 return torch.cat(dec_list, dim=-1)
             else:  # 使用集束搜索
                 # 扩展成beam_width * bsz
@@ -371,35 +480,13 @@ class XLDecoder(torch.nn.Module):
                 dec_topK_log_probs = [0] * (beam_width * bsz)  # (bsz*beam)  每个序列的当前log概率和
                 dec_topK_sequences = [[] for _ in range(beam_width * bsz)]  # (bsz*beam, seq_len) 解码id序列
                 dec_topK_seq_lens = [1] * (beam_width * bsz)  # 解码序列长度 ==> 加上一个偏置项1, 防止进行长度惩罚时出现div 0的情况
+                state = self.init_decode_state(encoder_rep, input_mask)
                 for i in range(1, self.seq_len + 1):
                     if i > 1:
-                        input_decode_ids = torch.cat([decode_ids, torch.tensor(dec_topK_sequences).long().to(device)],
-                                                     dim=-1)
+                        token_ids = torch.tensor([seq[-1] for seq in dec_topK_sequences]).long().to(device)
                     else:
-                        input_decode_ids = decode_ids
-                    decode_embed = self.word_emb(input_decode_ids)
-                    all_ones = decode_embed.new_ones((i, i), dtype=torch.uint8)
-                    dec_attn_mask = torch.tril(all_ones, diagonal=0)[:, :, None, None]
-                    pos_seq = torch.arange(i - 1, -1, -1.0, device=device, dtype=decode_embed.dtype)
-                    pos_embed = self.pos_emb(pos_seq)
-                    core_out = decode_embed.transpose(0, 1).contiguous()
-                    enc_rep_t = encoder_rep.transpose(0, 1).contiguous()
-                    enc_mask_t = input_mask.transpose(0, 1).contiguous()
-                    for layer in self.layers:
-                        core_out = layer(
-                            dec_inp=core_out, r=pos_embed, enc_inp=enc_rep_t,
-                            dec_mask=dec_attn_mask, enc_mask=enc_mask_t
-                        )
-                    core_out = core_out.transpose(0, 1).contiguous()[:, -1, :]
-                    output = self.output(core_out)
-                    vocab_logits = torch.nn.functional.linear(input=output, weight=self.word_emb.weight)
-                    vocab_prob = torch.softmax(vocab_logits, dim=-1)
-                    input_logits = torch.einsum("bd,bjd->bj", self.copy_output(core_out), encoder_rep)  # (bsz*beam, enc_len)
-                    input_logits = input_logits + (1.0 - input_mask) * (-1e30)
-                    input_prob = torch.softmax(input_logits, dim=-1)  # (bsz*beam, enc_len)
-                    mode_sig = self.mode_select(core_out)  # (bsz*beam, 1)
-                    vocab_prob = vocab_prob * mode_sig
-                    vocab_prob = torch.scatter_add(vocab_prob, dim=1, index=input_ids, src=(1 - mode_sig) * input_prob)  # (bsz*beam, vocab)
+                        token_ids = decode_ids[:, 0]
+                    vocab_prob = self.decode_step(token_ids, input_ids, encoder_rep, input_mask, state)  # (bsz*beam, vocab)
                     vocab_logp = torch.log(vocab_prob + self.epsilon)  # 取对数， 加eps
                     """ step1: 检查是否存在trigram blocking重叠, 只需要检查最后一项和之前项是否存在重叠即可 """
                     if i > 4:  # 当序列长度大于等于4时才有意义, 或者当前解码时刻大于4时才有检查的必要
@@ -412,8 +499,13 @@ class XLDecoder(torch.nn.Module):
                             if len(trigram_blocks) > 1 and trigram_blocks[-1] in trigram_blocks[:-1]:
                                 dec_topK_log_probs[j] += -1e9
                     """ step2: 为每个样本, 选择topK个序列 ==> 类似于重构dec_topK_sequences"""
+                    parents = list(range(beam_width * bsz))
+                    # 一次取出所有序列的topK, 各样本只读写自己的beam, 一份快照即可(序列只会被替换, 不会原地修改)
+                    all_logps, all_indices = vocab_logp.topk(dim=-1, k=beam_width)
+                    all_logps, all_indices = all_logps.cpu().numpy(), all_indices.cpu().numpy()
+                    c_dec_topK_sequences, c_dec_topK_log_probs, c_dec_topK_seq_lens = \
+                        list(dec_topK_sequences), list(dec_topK_log_probs), list(dec_topK_seq_lens)
                     for j in range(bsz):
-                        topK_vocab_logp = vocab_logp[j::bsz]  # (k, vocab)
                         candidate_list = []
                         """ 容易出错的地方, i=1的时候不需要为每个K生成K个候选,否则beam search将完全沦为greedy search """
                         for k in range(beam_width):
@@ -424,8 +516,7 @@ class XLDecoder(torch.nn.Module):
                                     "sort_logits": dec_topK_log_probs[ind] / (dec_topK_seq_lens[ind] ** args["beam_length_penalty"])
                                 })
                             else:
-                                k_logps, k_indices = topK_vocab_logp[k].topk(dim=0, k=beam_width)
-                                k_logps, k_indices = k_logps.cpu().numpy(), k_indices.cpu().numpy()
+                                k_logps, k_indices = all_logps[ind], all_indices[ind]
                                 for l in range(beam_width):
                                     aff = l if i == 1 else k
                                     candidate_list.append({
@@ -437,15 +528,17 @@ class XLDecoder(torch.nn.Module):
                         candidate_list.sort(key=lambda x: x["sort_logits"], reverse=True)
                         candidate_list = candidate_list[:beam_width]
                         """ 序列修正, 更新topK """
-                        c_dec_topK_sequences, c_dec_topK_log_probs, c_dec_topK_seq_lens = \
-                            deepcopy(dec_topK_sequences), deepcopy(dec_topK_log_probs), deepcopy(dec_topK_seq_lens)
                         for k in range(beam_width):
                             ind = bsz * candidate_list[k]["affiliate_k"] + j
                             r_ind = bsz * k + j
+                            parents[r_ind] = ind
                             father_seq, father_logits, father_len = c_dec_topK_sequences[ind], c_dec_topK_log_probs[ind], c_dec_topK_seq_lens[ind]
                             dec_topK_sequences[r_ind] = father_seq + [candidate_list[k]["add_token_id"]]
                             dec_topK_log_probs[r_ind] = father_logits + candidate_list[k]["add_logit"]
                             dec_topK_seq_lens[r_ind] = father_len + candidate_list[k]["add_seq_len"]
+                    self.reorder_decode_state(state, torch.tensor(parents, device=device))
+                    if all(args["end_token_id"] in seq for seq in dec_topK_sequences):
+                        break  # 所有 beam 都已结束
                 return torch.tensor(dec_topK_sequences[:bsz]).long().to(device)
 
 
@@ -465,12 +558,13 @@ class QuestionGeneration(torch.nn.Module):
                                        embedding_matrix=self.roberta_encoder.get_input_embeddings(),
                                        seq_len=args["max_dec_len"])
 
-    def forward(self, input_ids, input_mask, input_seg, decode_input=None, decode_target=None):
+    def forward(self, input_ids, input_mask, input_seg, decode_input=None, decode_target=None,
+                use_beam_search=None, beam_width=None):
         encoder_rep = self.roberta_encoder(input_ids, input_mask, input_seg)[0]
         # print("encoder shape: {}, encoder vector: {}".format(encoder_rep.shape, encoder_rep))
         return self.decoder_layer(input_ids, encoder_rep, input_mask, decode_input, decode_target,
-                                  args["use_beam_search"],
-                                  args["beam_width"])
+                                  args["use_beam_search"] if use_beam_search is None else use_beam_search,
+                                  args["beam_width"] if beam_width is None else beam_width)
 
     @classmethod
     def from_pretrained(cls, pretrained_model_path=None):
@@ -508,60 +602,53 @@ class QuestionGenerationInfer(object):
             self.model = QuestionGeneration.from_pretrained(args["save_path"])
             self.model.to(device=device)
 
-    def test(self):
-        self.model.eval()
+    def test(self, batch_size=32):
         output = self.test_items
-        with torch.no_grad():
-            for i in tqdm(range(len(output))):
-                text = output[i]["text"]
-                annotations = output[i]["annotations"]
-                tmp_enc_ids, tmp_enc_mask, tmp_enc_seg = [], [], []
-                for j in range(len(annotations)):
-                    y = QGUtils.text_encode(self.tokenizer, text, annotations[j]["A"])
-                    tmp_enc_ids.append(y["input_ids"])
-                    tmp_enc_mask.append(y["input_mask"])
-                    tmp_enc_seg.append(y["input_seg"])
-                # 模型预测
-                dec_seq = self.model(
-                    input_ids=torch.cat(tmp_enc_ids, dim=0),
-                    input_mask=torch.cat(tmp_enc_mask, dim=0),
-                    input_seg=torch.cat(tmp_enc_seg, dim=0)
-                )
-                dec_seq = dec_seq.cpu().numpy()
-                for j in range(len(dec_seq)):
-                    y = dec_seq[j]
-                    s = QGUtils.ids_to_string(self.tokenizer, y, text=text, answer=annotations[j]["A"])
-                    annotations[j]["Q"] = s
-                if i % 50 == 0 and i > 0:
-                    print("The program has completed %s predictions" % i)
+        texts, answers = [], []
+        for item in output:
+            for annotation in item["annotations"]:
+                texts.append(item["text"])
+                answers.append(annotation["A"])
+        questions = iter(self.predict_batch(texts, answers, batch_size=batch_size, verbose=True))
+        for item in output:
+            for annotation in item["annotations"]:
+                annotation["Q"] = next(questions)
         # 保存测试结果
         with open("submit_test.json", "w", encoding="UTF-8") as fw:
             json.dump(output, fw, ensure_ascii=False, indent=2)
             print("The program has completed all predictions")
 
+    def predict_batch(self, texts, answers, batch_size=32, use_beam_search=None, beam_width=None, verbose=False):
+        """ 批量生成问题
+        :param texts: 上下文list
+        :param answers: 答案list, 与texts一一对应
+        :param batch_size: 每个batch的(上下文, 答案)对数量, beam search时实际解码 batch_size * beam_width 条序列
+        :param use_beam_search: 默认使用 args["use_beam_search"]
+        :return: 问题list, 与输入顺序一致
+        """
+        self.model.eval()
+        encodings = [QGUtils.text_encode_ids(self.tokenizer, text, answer) for text, answer in zip(texts, answers)]
+        # 按长度分桶: 同一batch内长度相近, 只padding到batch内最大长度
+        order = sorted(range(len(encodings)), key=lambda i: len(encodings[i][0]))
+        questions = [None] * len(encodings)
+        batches = range(0, len(order), batch_size)
+        with torch.no_grad():
+            for start in (tqdm(batches) if verbose else batches):
+                index = order[start:start + batch_size]
+                dec_seq = self.model(**QGUtils.collate([encodings[i] for i in index]),
+                                     use_beam_search=use_beam_search, beam_width=beam_width)
+                for i, y in zip(index, dec_seq.cpu().numpy()):
+                    questions[i] = QGUtils.ids_to_string(self.tokenizer, y, text=texts[i], answer=answers[i])
+
+        return questions
+
     def predict_single(self, text, answer):
         """ 模型预测
         :param text: 上下文
         :param answer: 答案
         :return:
         """
-        self.model.eval()
-        with torch.no_grad():
-            tmp_enc_ids, tmp_enc_mask, tmp_enc_seg = [], [], []
-            y = QGUtils.text_encode(self.tokenizer, text, answer)
-            tmp_enc_ids.append(y["input_ids"])
-            tmp_enc_mask.append(y["input_mask"])
-            tmp_enc_seg.append(y["input_seg"])
-            # 模型预测
-            dec_seq = self.model(
-                input_ids=torch.cat(tmp_enc_ids, dim=0),
-                input_mask=torch.cat(tmp_enc_mask, dim=0),
-                input_seg=torch.cat(tmp_enc_seg, dim=0)
-            )
-            y = dec_seq.cpu().numpy()[0]  # 获取第0个result
-            s = QGUtils.ids_to_string(self.tokenizer, y, text=text, answer=answer)
-
-            return s
+        return self.predict_batch([text], [answer])[0]
 
     def predict(self, text, answers):
         """ inference
@@ -569,28 +656,7 @@ class QuestionGenerationInfer(object):
         :param answers: 答案list
         :return:
         """
-        self.model.eval()
-        with torch.no_grad():
-            tmp_enc_ids, tmp_enc_mask, tmp_enc_seg = [], [], []
-            for answer in answers:
-                y = QGUtils.text_encode(self.tokenizer, text, answer)
-                tmp_enc_ids.append(y["input_ids"])
-                tmp_enc_mask.append(y["input_mask"])
-                tmp_enc_seg.append(y["input_seg"])
-            # 模型预测
-            dec_seq = self.model(
-                input_ids=torch.cat(tmp_enc_ids, dim=0),
-                input_mask=torch.cat(tmp_enc_mask, dim=0),
-                input_seg=torch.cat(tmp_enc_seg, dim=0)
-            )
-            dec_logits = dec_seq.cpu().numpy()
-            questions = []
-            for i in range(len(dec_logits)):
-                y = dec_logits[i]
-                result = QGUtils.ids_to_string(self.tokenizer, y, text=text, answer=answer)
-                questions.append(result)
-
-            return questions
+        return self.predict_batch([text] * len(answers), answers)
 
 
 if __name__ == "__main__":
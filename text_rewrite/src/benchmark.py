@@ -0,0 +1,249 @@
+"""
+# text rewrite + retrieval 端到端延迟基准测试
+    1. 本地生成合成 QA 语料、词向量与多轮对话上下文, 构建 faiss(flat/hnsw_flat) 与 BM25 索引;
+    2. 在多个并发度下分别测试 rewrite、向量检索、BM25 检索与完整 /qa 接口的 p50/p95/p99 延迟和吞吐;
+    3. 结果以 json 输出, 便于不同 commit 之间对比.
+"""
+import os
+import time
+import json
+import random
+import argparse
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import jieba
+import numpy as np
+import tensorflow as tf
+
+from src.models import model_params
+from src.models import transformer
+from src.utils import tokenizer
+from src.utils.utils import save_data_to_json
+from src.inference import ServingModel, inference
+from src.retrieval_module.word2vec.word2vec_model import CustomWord2Vec
+from src.retrieval_module.indexers.BM25_indexer import BM25Indexer, tokenize_spt
+from src.retrieval_module.build_qa_indexes import BuildQAIndexes, INDEXER
+from src.retrieval_module.inference import load_indexer_w2v_qas, get_retrieval_results
+
+logger = logging.getLogger(__name__)
+work_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PARAMS_MAP = {
+    'tiny': model_params.TINY_PARAMS,
+    'base': model_params.BASE_PARAMS,
+    'big': model_params.BIG_PARAMS,
+}
+VECTOR_SIZE = 200
+
+
+def set_parameters():
+    """设置参数"""
+    parse = argparse.ArgumentParser(description="rewrite + retrieval 基准测试")
+    parse.add_argument("--vocab_file", type=str,
+                       default=os.path.join(work_root, "resource/vocab.txt"),
+                       help="tokenizer 词汇表位置.")
+    parse.add_argument("--param_set", type=str, default="tiny",
+                       help="模型结构配置参数.")
+    parse.add_argument("--model_dir", type=str, default=None,
+                       help="已训练模型路径, 不设置时使用随机初始化模型(只测延迟).")
+    parse.add_argument("--serving_model_dir", type=str, default=None,
+                       help="export_model.py 导出的 SavedModel 路径.")
+    parse.add_argument("--work_dir", type=str,
+                       default=os.path.join(work_root, "data/benchmark"),
+                       help="合成语料与索引保存路径.")
+    parse.add_argument("--output_file", type=str,
+                       default=os.path.join(work_root, "data/benchmark/results.json"),
+                       help="基准测试结果 json.")
+    parse.add_argument("--num_docs", type=int, default=20000, help="合成 QA 对数量.")
+    parse.add_argument("--num_words", type=int, default=5000, help="合成词表大小.")
+    parse.add_argument("--num_requests", type=int, default=200, help="每个并发度下的请求数.")
+    parse.add_argument("--concurrency", type=str, default="1,4,16", help="并发度, 逗号分隔.")
+    parse.add_argument("--targets", type=str, default="rewrite,dense_flat,dense_hnsw_flat,bm25,qa",
+                       help="测试对象, 逗号分隔.")
+    parse.add_argument("--top_k", type=int, default=10, help="检索返回数量.")
+    parse.add_argument("--seed", type=int, default=1234, help="随机种子.")
+    args = parse.parse_args()
+
+    params = PARAMS_MAP[args.param_set].copy()
+    params.update(vars(args))
+    params["dtype"] = tf.float32
+    params["concurrency"] = [int(x) for x in args.concurrency.split(",")]
+    params["targets"] = args.targets.split(",")
+
+    return params
+
+
+class SyntheticCorpus(object):
+    """合成语料: 随机汉字组成的词表、词向量、QA 对与对话上下文"""
+    def __init__(self, num_words=5000, num_docs=20000, seed=1234):
+        self.rng = random.Random(seed)
+        chars = [chr(code) for code in range(0x4e00, 0x4e00 + 3000)]
+        words = set(chars[:1000])  # 单字均在词表中, 保证 jieba 切分结果可以向量化
+        while len(words) < num_words:
+            words.add("".join(self.rng.choice(chars) for _ in range(self.rng.randint(2, 3))))
+        self.words = sorted(words)
+        self.multi_words = [word for word in self.words if len(word) > 1]
+
+        features = np.random.RandomState(seed).randn(len(self.words), VECTOR_SIZE).astype("float32")
+        self.w2v = CustomWord2Vec()
+        self.w2v.keys = self.words
+        self.w2v.features = features
+        for idx, key in enumerate(self.words):
+            self.w2v.key_feature_map[key] = features[idx]
+
+        self.qas = [{"Q": self.sentence(), "A": self.sentence(8, 30)} for _ in range(num_docs)]
+
+    def sentence(self, min_words=4, max_words=12):
+        return "".join(self.rng.choice(self.multi_words) for _ in range(self.rng.randint(min_words, max_words)))
+
+    def contexts(self, num):
+        """多轮对话上下文, 最后一句为待改写 query"""
+        return [[self.sentence(), self.sentence(2, 6), self.sentence(3, 8)] for _ in range(num)]
+
+
+def build_indexes(corpus, work_dir):
+    """构建向量索引库(flat / hnsw_flat)与 BM25 索引"""
+    os.makedirs(work_dir, exist_ok=True)
+    words_file = os.path.join(work_dir, "words.words")
+    features_file = os.path.join(work_dir, "words.npy")
+    corpus.w2v.save(words_file, features_file)
+    data_file = os.path.join(work_dir, "synthetic_qas_raw.json")
+    save_data_to_json([{"annotations": corpus.qas}], data_file)
+
+    retrievers = {}
+    for indexer_type in INDEXER:
+        qa_file = os.path.join(work_dir, "synthetic_qas_{}.json".format(indexer_type))
+        indexes_file = os.path.join(work_dir, "synthetic_qas_{}".format(indexer_type))
+        start = time.perf_counter()
+        BuildQAIndexes(corpus.w2v, INDEXER[indexer_type](vector_sz=VECTOR_SIZE)).build_cm_indexes(
+            data_file, cm_qa_file=qa_file, cm_qa_indexes_file=indexes_file)
+        logger.info("Build {} index: {:.2f}s".format(indexer_type, time.perf_counter() - start))
+        retrievers[indexer_type] = load_indexer_w2v_qas(words_file, features_file, qa_file, indexes_file,
+                                                        indexer_type=indexer_type, vector_size=VECTOR_SIZE)
+
+    start = time.perf_counter()
+    bm25 = BM25Indexer(corpus.w2v)
+    bm25.add_docs([tokenize_spt(qa["Q"]) for qa in corpus.qas])
+    bm25.create_index()
+    logger.info("Build bm25 index: {:.2f}s".format(time.perf_counter() - start))
+
+    return retrievers, bm25
+
+
+def load_rewrite_model(params):
+    """加载 rewrite 模型, 未给出模型时使用随机初始化权重"""
+    if params["serving_model_dir"]:
+        model = ServingModel(params["serving_model_dir"])
+        params["is_beam_search"] = model.is_beam_search
+    else:
+        model = transformer.Transformer(params, name="transformer_v2")
+        zeros = tf.zeros((1, 10), dtype=tf.int32)
+        _ = model([zeros, zeros, zeros], training=False)
+        if params["model_dir"]:
+            model.load_weights(tf.train.latest_checkpoint(params["model_dir"]))
+    subtokenizer = tokenizer.Subtokenizer(params["vocab_file"])
+
+    return model, subtokenizer
+
+
+def percentile_stats(latencies, wall_time):
+    latencies = np.asarray(latencies) * 1000
+    return {
+        "requests": int(len(latencies)),
+        "throughput_rps": float(len(latencies) / wall_time),
+        "mean_ms": float(np.mean(latencies)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+def run_load(request_fn, payloads, concurrency):
+    """以 concurrency 个线程闭环发送全部 payloads, 返回延迟统计"""
+    def timed(payload):
+        start = time.perf_counter()
+        request_fn(payload)
+        return time.perf_counter() - start
+
+    request_fn(payloads[0])  # warmup
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(timed, payloads))
+
+    return percentile_stats(latencies, time.perf_counter() - start)
+
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=work_root,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    """主函数"""
+    params = set_parameters()
+    logger.info("Generate synthetic corpus")
+    corpus = SyntheticCorpus(params["num_words"], params["num_docs"], params["seed"])
+    contexts = corpus.contexts(params["num_requests"])
+    queries = [context[-1] for context in contexts]
+    retrievers, bm25 = build_indexes(corpus, params["work_dir"])
+
+    request_fns = {}
+    for indexer_type, (indexer, w2v_model, qas_document) in retrievers.items():
+        request_fns["dense_" + indexer_type] = (
+            lambda query, indexer=indexer, w2v_model=w2v_model, qas_document=qas_document:
+            get_retrieval_results(query, indexer, w2v_model, qas_document, top_k=params["top_k"]), queries)
+    request_fns["bm25"] = (lambda query: bm25.search_knn(tokenize_spt(query), params["top_k"]), queries)
+
+    if "rewrite" in params["targets"] or "qa" in params["targets"]:
+        logger.info("Load rewrite model")
+        model, subtokenizer = load_rewrite_model(params)
+        request_fns["rewrite"] = (lambda context: inference(model, subtokenizer, params, contexts=context),
+                                  contexts)
+
+        from src import retrieval_qa_server as server
+        server.params = params
+        server.model, server.subtokenizer = model, subtokenizer
+        server.indexer, server.w2v_model, server.qas_document = retrievers["flat"]
+
+        def qa_request(context):
+            client = server.sever_app.test_client()
+            response = client.post("/qa", data=json.dumps({"contexts": context, "top_k": params["top_k"]}))
+            assert response.status_code == 200
+
+        request_fns["qa"] = (qa_request, contexts)
+
+    results = []
+    for target in params["targets"]:
+        request_fn, payloads = request_fns[target]
+        for concurrency in params["concurrency"]:
+            stats = run_load(request_fn, payloads, concurrency)
+            stats.update({"target": target, "concurrency": concurrency})
+            logger.info("{target} concurrency={concurrency}: {throughput_rps:.1f} req/s, "
+                        "p50 {p50_ms:.2f} ms, p95 {p95_ms:.2f} ms, p99 {p99_ms:.2f} ms".format(**stats))
+            results.append(stats)
+
+    report = {
+        "git_commit": get_git_commit(),
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "config": {key: params[key] for key in ("param_set", "model_dir", "serving_model_dir", "num_docs",
+                                                "num_words", "num_requests", "concurrency", "top_k", "seed")},
+        "results": results,
+    }
+    save_data_to_json(report, params["output_file"])
+    logger.info("Save benchmark results to {}".format(params["output_file"]))
+
+    return report
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format="[%(asctime)s %(filename)s: %(lineno)s] %(message)s",
+                        datefmt="%Y-%m-%d %H:%M:%S",
+                        level=logging.INFO,
+                        filename=None,
+                        filemode="a")  # set logging
+    jieba.setLogLevel(logging.WARNING)
+    main()
@@ -8,6 +8,7 @@
 
 import sys
 import codecs
+import multiprocessing
 from optparse import OptionParser
 from nltk.translate.bleu_score import sentence_bleu
 from nltk.translate.bleu_score import SmoothingFunction
@@ -22,6 +23,9 @@ def parse_opts():
     '-g', '--gold', dest='gold', type='str', help='path of gold')
   op.add_option(
     '-t', '--test', dest='test', type='str', help='path of predict')
+  op.add_option(
+    '-w', '--workers', dest='workers', type='int', default=1,
+    help='number of processes used to score the pairs')
   argv = [] if not hasattr(sys.modules['__main__'], '__file__') else sys.argv[1:]
   (opts, args) = op.parse_args(argv)
   if not opts.gold or not opts.test:
@@ -43,17 +47,29 @@ def readlines(path):
   return lines
 
 
+def _score_shard(pairs):
+  """Score one shard of (reference, candidate) pairs in a worker process.
+
+  Returns the per-pair bleu/rouge lists and the exact match count, the parent
+  concatenates the shards in order so the averages are identical to the
+  serial Metrics functions.
+  """
+  references = [ref for ref, _ in pairs]
+  candidates = [cand for _, cand in pairs]
+  bleu1_list, bleu2_list, _, bleu4_list = Metrics.bleu_lists(references, candidates)
+  bleus = list(zip(bleu1_list, bleu2_list, bleu4_list))
+  rouges = list(zip(*Metrics.rouge_lists(references, candidates)))
+  match_cnt = sum(ref == cand for ref, cand in pairs)
+  return bleus, rouges, match_cnt
+
+
 class Metrics(object):
   def __init__(self):
       pass
 
   @staticmethod
-  def bleu_score(references, candidates):
-    """Calculate BLEU score.
-    Args:
-      references: list(str), gold labels
-      candidates: list(str), predict labels
-    """
+  def bleu_lists(references, candidates):
+    """Per pair bleu1, bleu2, bleu3 and bleu4 lists."""
     bleu1_list = []
     bleu2_list = []
     bleu3_list = []
@@ -77,6 +93,17 @@ class Metrics(object):
       bleu2_list.append(bleu2)
       bleu3_list.append(bleu3)
       bleu4_list.append(bleu4)
+    return bleu1_list, bleu2_list, bleu3_list, bleu4_list
+
+  @staticmethod
+  def bleu_score(references, candidates):
+    """Calculate BLEU score.
+    Args:
+      references: list(str), gold labels
+      candidates: list(str), predict labels
+    """
+    bleu1_list, bleu2_list, bleu3_list, bleu4_list = Metrics.bleu_lists(
+      references, candidates)
 
     bleu1_average = sum(bleu1_list) / len(bleu1_list)
     bleu2_average = sum(bleu2_list) / len(bleu2_list)
@@ -101,9 +128,8 @@ class Metrics(object):
     return em_score
 
   @staticmethod
-  def rouge_score(references, candidates):
-    """Calculate ROUGE score.
-    """
+  def rouge_lists(references, candidates):
+    """Per pair rouge_1, rouge_2 and rouge_l f-score lists."""
     rouge = Rouge()
 
     rouge1_list = []
@@ -120,6 +146,14 @@ class Metrics(object):
       rouge1_list.append(rouge_1)
       rouge2_list.append(rouge_2)
       rougel_list.append(rouge_l)
+    return rouge1_list, rouge2_list, rougel_list
+
+  @staticmethod
+  def rouge_score(references, candidates):
+    """Calculate ROUGE score.
+    """
+    rouge1_list, rouge2_list, rougel_list = Metrics.rouge_lists(
+      references, candidates)
 
     rouge1_average = sum(rouge1_list) / len(rouge1_list)
     rouge2_average = sum(rouge2_list) / len(rouge2_list)
@@ -129,6 +163,48 @@ class Metrics(object):
           % (rouge1_average, rouge2_average, rougel_average))
     return (rouge1_average, rouge2_average, rougel_average)
 
+  @staticmethod
+  def all_scores(references, candidates, num_workers=1, chunk_size=1000):
+    """Calculate BLEU, ROUGE and EM, optionally over a process pool.
+    Args:
+      references: list(str), gold labels
+      candidates: list(str), predict labels
+      num_workers: int, processes to use; > 1 forks a multiprocessing.Pool,
+        so keep the default 1 inside processes with live TF/CUDA threads
+      chunk_size: int, pairs per shard
+    Returns:
+      dict of bleu1/bleu2/bleu4/rouge_1/rouge_2/rouge_l/em, same values as
+      bleu_score, rouge_score and em_score.
+    """
+    assert len(references) == len(candidates)
+    pairs = list(zip(references, candidates))
+    shards = [pairs[i:i + chunk_size] for i in range(0, len(pairs), chunk_size)]
+    if num_workers > 1 and len(shards) > 1:
+      with multiprocessing.Pool(min(num_workers, len(shards))) as pool:
+        results = pool.map(_score_shard, shards)
+    else:
+      results = [_score_shard(shard) for shard in shards]
+
+    bleus, rouges, match_cnt = [], [], 0
+    for shard_bleus, shard_rouges, shard_match_cnt in results:
+      bleus.extend(shard_bleus)
+      rouges.extend(shard_rouges)
+      match_cnt += shard_match_cnt
+
+    total_cnt = len(pairs)
+    bleu1, bleu2, bleu4 = [sum(col) / total_cnt for col in zip(*bleus)]
+    rouge_1, rouge_2, rouge_l = [sum(col) / total_cnt for col in zip(*rouges)]
+    em = match_cnt / (float)(total_cnt)
+    print("average bleus: bleu1: %.3f, bleu2: %.3f, bleu4: %.3f" % (
+      bleu1, bleu2, bleu4))
+    print("average rouges, rouge_1: %.3f, rouge_2: %.3f, rouge_l: %.3f" \
+          % (rouge_1, rouge_2, rouge_l))
+    print("em_score: %.3f, match_cnt: %d, total_cnt: %d" % (
+      em, match_cnt, total_cnt))
+    return {"bleu1": bleu1, "bleu2": bleu2, "bleu4": bleu4,
+            "rouge_1": rouge_1, "rouge_2": rouge_2, "rouge_l": rouge_l,
+            "em": em}
+
 
 if __name__ == '__main__':
   """python3 evaluate.py -g [生成的预测数据] -t [目标数据]"""
@@ -138,6 +214,9 @@ if __name__ == '__main__':
 
   assert len(candidates) == len(references)
 
-  Metrics.bleu_score(references, candidates)
-  Metrics.rouge_score(references, candidates)
-  Metrics.em_score(references, candidates)
+  if opts.workers > 1:
+    Metrics.all_scores(references, candidates, num_workers=opts.workers)
+  else:
+    Metrics.bleu_score(references, candidates)
+    Metrics.rouge_score(references, candidates)
+    Metrics.em_score(references, candidates)
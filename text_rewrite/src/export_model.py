@@ -0,0 +1,110 @@
+"""
+# 导出 SavedModel 用于 CPU serving
+# encoder + decode 通过 tf.function 以固定 input_signature 追踪一次, 请求时直接执行计算图, 避免逐步 eager 调度开销
+"""
+import os
+import argparse
+import logging
+import tensorflow as tf
+from official.utils.flags import core as flags_core
+
+from src.models import model_params
+from src.inference import SERVING_SIGNATURE, load_model_tokenizer
+
+logger = logging.getLogger(__name__)
+work_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PARAMS_MAP = {
+    'tiny': model_params.TINY_PARAMS,
+    'base': model_params.BASE_PARAMS,
+    'big': model_params.BIG_PARAMS,
+}
+
+
+def set_parameters():
+    """设置参数"""
+    parse = argparse.ArgumentParser(description="设置基本参数")
+    parse.add_argument("--vocab_file", type=str,
+                       default=os.path.join(work_path, "resource/vocab.txt"),
+                       help="tokenizer 词汇表位置.")
+    parse.add_argument("--model_dir", type=str,
+                       default=os.path.join(work_path, "models/tiny_x"),
+                       help="已训练模型保存路径.")
+    parse.add_argument("--export_dir", type=str,
+                       default=os.path.join(work_path, "models/tiny_x_serving"),
+                       help="SavedModel 导出路径, 推理时通过 --serving_model_dir 加载.")
+    parse.add_argument("--dtype", type=str, default="fp32",
+                       help="运算过程中数据类型.")
+    parse.add_argument("--param_set", type=str, default="tiny",
+                       help="模型结构配置参数")
+    parse.add_argument("--decode_mode", type=str, default="greedy", choices=["greedy", "beam"],
+                       help="导出的解码方式, beam 使用 beam_search.sequence_beam_search.")
+    args = parse.parse_args()
+
+    params = PARAMS_MAP[args.param_set].copy()
+
+    params["vocab_file"] = args.vocab_file
+    params["model_dir"] = args.model_dir
+    params["export_dir"] = args.export_dir
+    params["dtype"] = flags_core.get_tf_dtype(args)
+    # 解码方式只由 decode_mode 决定; custom beam search 依赖 .numpy() 逐步判断, 无法追踪为计算图, 不提供导出
+    params["is_custom_beam_search"] = False
+    params["is_beam_search"] = args.decode_mode == "beam"
+
+    return params
+
+
+def check_exportable(params):
+    """只有不依赖 eager 取值的计算可以被 tf.function 追踪"""
+    if params["repetition_penalty"] != 1.0:
+        raise ValueError("repetition_penalty is computed with numpy and can't be exported.")
+
+
+def get_serving_fn(model, params):
+    """encoder + decode 的 serving 函数, batch 与长度两个维度均为动态"""
+    input_signature = [
+        tf.TensorSpec([None, None], dtype=tf.int32, name="inputs"),
+        tf.TensorSpec([None, None], dtype=tf.int32, name="segments"),
+        tf.TensorSpec([None, None], dtype=tf.int32, name="masks"),
+    ]
+
+    @tf.function(input_signature=input_signature)
+    def serving_fn(inputs, segments, masks):
+        results = model([inputs, segments, masks], training=False)
+        if params["is_beam_search"]:
+            return {"outputs": results["outputs"], "scores": results["scores"]}
+        return {"outputs": results}
+
+    return serving_fn
+
+
+def export_serving_model(model, params, export_dir):
+    """将模型与 serving signature 保存为 SavedModel"""
+    check_exportable(params)
+    serving_fn = get_serving_fn(model, params)
+    # trace once, 之后的请求只执行计算图
+    serving_fn.get_concrete_function()
+    # 以 tf.Module 保存, 避免 keras 子类模型保存时再追踪 call
+    module = tf.Module()
+    module.model = model
+    module.serving_fn = serving_fn
+    tf.saved_model.save(module, export_dir, signatures={SERVING_SIGNATURE: serving_fn})
+    logger.info("Export serving model to {}".format(export_dir))
+
+    return export_dir
+
+
+def main():
+    """主函数"""
+    params = set_parameters()
+    logger.info("Load model")
+    model, _ = load_model_tokenizer(params)
+    export_serving_model(model, params, params["export_dir"])
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format="[%(asctime)s %(filename)s: %(lineno)s] %(message)s",
+                        datefmt="%Y-%m-%d %H:%M:%S",
+                        level=logging.INFO,
+                        filename=None,
+                        filemode="a")  # set logging
+    main()
@@ -26,6 +26,8 @@ PARAMS_MAP = {
     'big': model_params.BIG_PARAMS,
 }
 
+SERVING_SIGNATURE = "serving_default"
+
 sever_app = Flask(__name__)  # flask server
 
 
@@ -42,6 +44,8 @@ def set_parameters():
                        help="运算过程中数据类型.")
     parse.add_argument("--param_set", type=str, default="tiny",
                        help="模型结构配置参数")
+    parse.add_argument("--serving_model_dir", type=str, default=None,
+                       help="export_model.py 导出的 SavedModel 路径, 设置后使用计算图推理.")
     args = parse.parse_args()
 
     params = PARAMS_MAP[args.param_set].copy()
@@ -49,6 +53,7 @@ def set_parameters():
     params["vocab_file"] = args.vocab_file
     params["model_dir"] = args.model_dir
     params["dtype"] = flags_core.get_tf_dtype(args)
+    params["serving_model_dir"] = args.serving_model_dir
 
     return params
 
@@ -151,7 +156,33 @@ def inference(model, subtokenizer, params, contexts: list):
     return results
 
 
+class ServingModel(object):
+    """加载导出的 SavedModel, 调用方式与 Transformer 保持一致: model([inputs, segments, masks], training=False)"""
+    def __init__(self, serving_model_dir):
+        self.loaded = tf.saved_model.load(serving_model_dir)
+        self.serving_fn = self.loaded.signatures[SERVING_SIGNATURE]
+        self.is_beam_search = "scores" in self.serving_fn.structured_outputs
+
+    def __call__(self, inputs, training=False):
+        inputs, segments, masks = inputs
+        results = self.serving_fn(inputs=tf.cast(inputs, tf.int32),
+                                  segments=tf.cast(segments, tf.int32),
+                                  masks=tf.cast(masks, tf.int32))
+        if self.is_beam_search:
+            return results["outputs"], results["scores"]
+        return results["outputs"]
+
+
 def load_model_tokenizer(params):
+    if params.get("serving_model_dir"):
+        logger.info("Load serving model {}".format(params["serving_model_dir"]))
+        model = ServingModel(params["serving_model_dir"])
+        # 解码方式以导出时为准
+        params["is_beam_search"] = model.is_beam_search
+        subtokenizer = tokenizer.Subtokenizer(params["vocab_file"])
+
+        return model, subtokenizer
+
     logger.info("Restore Model")
     model = transformer.Transformer(params, name="transformer_v2")
     inputs, segments, masks = tf.zeros((1, 10), dtype=tf.int32), \
@@ -18,17 +18,20 @@ Source:
 https://github.com/tensorflow/tensor2tensor/blob/master/tensor2tensor/utils/bleu_hook.py
 """
 
+import collections
+import math
+import multiprocessing
 import re
 import sys
 import unicodedata
 
 from absl import app
 from absl import flags, logging
+import numpy as np
 import six
 from six.moves import range
 import tensorflow as tf
 
-from official.nlp.transformer.utils import metrics
 from official.nlp.transformer.utils import tokenizer
 from official.utils.flags import core as flags_core
 
@@ -82,17 +85,106 @@ def bleu_tokenize(string):
   return string.split()
 
 
-def bleu_wrapper(ref_filename, hyp_filename, case_sensitive=False):
+class BleuStats(object):
+  """Sufficient statistics of corpus BLEU.
+
+  The counts are additive over sentences, so shards of a corpus can be scored
+  independently and merged; `bleu()` gives the same value as
+  `official.nlp.transformer.utils.metrics.compute_bleu` on the whole corpus.
+  """
+
+  def __init__(self, max_order=4):
+    self.max_order = max_order
+    self.matches_by_order = [0] * max_order
+    self.possible_matches_by_order = [0] * max_order
+    self.reference_length = 0
+    self.translation_length = 0
+
+  def _get_ngrams(self, segment):
+    ngram_counts = collections.Counter()
+    for order in range(1, self.max_order + 1):
+      for i in range(0, len(segment) - order + 1):
+        ngram_counts[tuple(segment[i:i + order])] += 1
+    return ngram_counts
+
+  def update(self, references, translations):
+    """Add one tokenized (reference, translation) pair."""
+    self.reference_length += len(references)
+    self.translation_length += len(translations)
+    ref_ngram_counts = self._get_ngrams(references)
+    translation_ngram_counts = self._get_ngrams(translations)
+
+    for ngram, count in ref_ngram_counts.items():
+      self.matches_by_order[len(ngram) - 1] += min(
+          count, translation_ngram_counts[ngram])
+    for ngram, count in translation_ngram_counts.items():
+      self.possible_matches_by_order[len(ngram) - 1] += count
+    return self
+
+  def merge(self, other):
+    """Accumulate the counts of another BleuStats in place."""
+    for i in range(self.max_order):
+      self.matches_by_order[i] += other.matches_by_order[i]
+      self.possible_matches_by_order[i] += other.possible_matches_by_order[i]
+    self.reference_length += other.reference_length
+    self.translation_length += other.translation_length
+    return self
+
+  def bleu(self, use_bp=True):
+    """BLEU score (0 - 1) of the accumulated counts."""
+    precisions = [0] * self.max_order
+    smooth = 1.0
+    geo_mean = 0
+    for i in range(0, self.max_order):
+      if self.possible_matches_by_order[i] > 0:
+        if self.matches_by_order[i] > 0:
+          precisions[i] = (float(self.matches_by_order[i]) /
+                           self.possible_matches_by_order[i])
+        else:
+          smooth *= 2
+          precisions[i] = 1.0 / (smooth * self.possible_matches_by_order[i])
+      else:
+        precisions[i] = 0.0
+
+    if max(precisions) > 0:
+      p_log_sum = sum(math.log(p) for p in precisions if p)
+      geo_mean = math.exp(p_log_sum / self.max_order)
+
+    bp = 1.0
+    if use_bp and self.reference_length:
+      ratio = self.translation_length / self.reference_length
+      if ratio <= 0.0:
+        bp = 0.0
+      elif ratio < 1.0:
+        bp = math.exp(1 - 1. / ratio)
+    return np.float32(geo_mean * bp)
+
+
+def _bleu_stats_shard(line_pairs):
+  """Tokenize and count one shard of (ref_line, hyp_line) pairs."""
+  stats = BleuStats()
+  for ref_line, hyp_line in line_pairs:
+    stats.update(bleu_tokenize(ref_line), bleu_tokenize(hyp_line))
+  return stats
+
+
+def bleu_wrapper(ref_filename, hyp_filename, case_sensitive=False,
+                 num_workers=1):
   """Compute BLEU for two files (reference and hypothesis translation)."""
   ref_lines = tokenizer.native_to_unicode(
       tf.io.gfile.GFile(ref_filename).read()).strip().splitlines()
   hyp_lines = tokenizer.native_to_unicode(
       tf.io.gfile.GFile(hyp_filename).read()).strip().splitlines()
-  return bleu_on_list(ref_lines, hyp_lines, case_sensitive)
+  return bleu_on_list(ref_lines, hyp_lines, case_sensitive, num_workers)
+
 
+def bleu_on_list(ref_lines, hyp_lines, case_sensitive=False, num_workers=1,
+                 chunk_size=2000):
+  """Compute BLEU for two list of strings (reference and hypothesis).
 
-def bleu_on_list(ref_lines, hyp_lines, case_sensitive=False):
-  """Compute BLEU for two list of strings (reference and hypothesis)."""
+  With num_workers > 1 the lines are sharded over a process pool and the
+  per-shard BleuStats are merged before computing the corpus score.
+  """
   if len(hyp_lines) == 0:
       return 0.
 
@@ -103,18 +195,30 @@ def bleu_on_list(ref_lines, hyp_lines, case_sensitive=False):
   if not case_sensitive:
       ref_lines = [x.lower() for x in ref_lines]
       hyp_lines = [x.lower() for x in hyp_lines]
-  ref_tokens = [bleu_tokenize(x) for x in ref_lines]
-  hyp_tokens = [bleu_tokenize(x) for x in hyp_lines]
-  return metrics.compute_bleu(ref_tokens, hyp_tokens) * 100
+  line_pairs = list(zip(ref_lines, hyp_lines))
+  shards = [line_pairs[i:i + chunk_size]
+            for i in range(0, len(line_pairs), chunk_size)]
+  if num_workers > 1 and len(shards) > 1:
+    with multiprocessing.Pool(min(num_workers, len(shards))) as pool:
+      shard_stats = pool.map(_bleu_stats_shard, shards)
+  else:
+    shard_stats = [_bleu_stats_shard(shard) for shard in shards]
+
+  stats = BleuStats()
+  for shard in shard_stats:
+    stats.merge(shard)
+  return stats.bleu() * 100
 
 
 def main(unused_argv):
   if FLAGS.bleu_variant in ("both", "uncased"):
-    score = bleu_wrapper(FLAGS.reference, FLAGS.translation, False)
+    score = bleu_wrapper(FLAGS.reference, FLAGS.translation, False,
+                         FLAGS.num_workers)
     logging.info("Case-insensitive results: %f" % score)
 
   if FLAGS.bleu_variant in ("both", "cased"):
-    score = bleu_wrapper(FLAGS.reference, FLAGS.translation, True)
+    score = bleu_wrapper(FLAGS.reference, FLAGS.translation, True,
+                         FLAGS.num_workers)
     logging.info("Case-sensitive results: %f" % score)
 
 
@@ -142,6 +246,12 @@ def define_compute_bleu_flags():
           "Specify one or more BLEU variants to calculate. Variants: \"cased\""
           ", \"uncased\", or \"both\"."))
 
+  flags.DEFINE_integer(
+      name="num_workers",
+      default=1,
+      help=flags_core.help_wrap(
+          "Number of processes used to tokenize and count n-grams."))
+
 
 if __name__ == "__main__":
   logging.set_verbosity(logging.INFO)
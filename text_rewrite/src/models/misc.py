@@ -181,6 +181,20 @@ def define_transformer_flags():
       help=flags_core.help_wrap(
           'Whether to do checkpointing during training. When running under '
           'benchmark harness, we will avoid checkpointing.'))
+  flags.DEFINE_integer(
+      name='throughput_log_steps',
+      default=100,
+      help=flags_core.help_wrap(
+          'Number of training steps between two throughput logs (step time, '
+          'input wait vs compute time, tokens/sec and peak memory), written '
+          'to the summary directory when --enable_tensorboard is set.'))
+  flags.DEFINE_string(
+      name='profiler_trace_steps',
+      default=None,
+      help=flags_core.help_wrap(
+          'Comma separated `start,end` global steps of a TF profiler trace '
+          'window, e.g. "100,110". The trace is written to the summary '
+          'directory. Disabled when not set.'))
   flags.DEFINE_bool(
       name='save_weights_only',
       default=True,
@@ -278,8 +278,6 @@ class Transformer(tf.keras.Model):
     """Returns a decoding function that calculates logits of the next tokens."""
     # timing_signal = self.position_embedding_layer(
     #                   inputs=None, length=max_decode_length + 1)
-    timing_signal = model_utils.get_position_encoding(max_decode_length + 1, self.params["hidden_size"])
-    timing_signal = tf.cast(timing_signal, self.params["dtype"])
     decoder_self_attention_bias = model_utils.get_decoder_self_attention_bias(
         max_decode_length, dtype=self.params["dtype"])
 
@@ -304,7 +302,6 @@ class Transformer(tf.keras.Model):
       # Preprocess decoder input by getting embeddings and adding timing signal.
       decoder_input = self.embedding_softmax_layer(decoder_input)
       # decoder_input += timing_signal[i]
-      decoder_input + timing_signal[i:i + 1]
 
       self_attention_bias = decoder_self_attention_bias[:, :, i:i + 1, :i + 1]
 
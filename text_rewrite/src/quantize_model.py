@@ -0,0 +1,210 @@
+"""
+# CPU 推理量化: export_model.py 导出的 SavedModel -> TFLite int8 模型
+# dynamic: 权重 int8, 激活运行时动态量化; calibrated: 额外使用训练集样本校准激活范围, 不支持的算子回退 float
+# 同时输出 fp32 / int8 两个模型的 BLEU(evaluate.py) 与单请求耗时对比报告
+"""
+import os
+import time
+import json
+import codecs
+import argparse
+import logging
+import numpy as np
+import tensorflow as tf
+from official.utils.flags import core as flags_core
+
+from src.models import model_params
+from src.utils import tokenizer
+from src.utils import dataset
+from src.evaluate import Metrics
+from src.inference import SERVING_SIGNATURE, ServingModel, _trim_and_decode
+
+logger = logging.getLogger(__name__)
+work_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PARAMS_MAP = {
+    'tiny': model_params.TINY_PARAMS,
+    'base': model_params.BASE_PARAMS,
+    'big': model_params.BIG_PARAMS,
+}
+
+
+def set_parameters():
+    """设置参数"""
+    parse = argparse.ArgumentParser(description="设置基本参数")
+    parse.add_argument("--vocab_file", type=str,
+                       default=os.path.join(work_path, "resource/vocab.txt"),
+                       help="tokenizer 词汇表位置.")
+    parse.add_argument("--serving_model_dir", type=str,
+                       default=os.path.join(work_path, "models/tiny_x_serving"),
+                       help="export_model.py 导出的 fp32 SavedModel 路径.")
+    parse.add_argument("--tflite_file", type=str,
+                       default=os.path.join(work_path, "models/tiny_x_int8.tflite"),
+                       help="量化模型保存路径.")
+    parse.add_argument("--quant_mode", type=str, default="dynamic", choices=["dynamic", "calibrated"],
+                       help="dynamic: 权重 int8 激活动态量化; calibrated: 使用训练样本校准激活范围.")
+    parse.add_argument("--data_train", type=str,
+                       default=os.path.join(work_path, "data/train.txt"),
+                       help="校准数据.")
+    parse.add_argument("--num_calibration_samples", type=int, default=200,
+                       help="校准使用的训练样本数.")
+    parse.add_argument("--data_dev", type=str,
+                       default=os.path.join(work_path, "data/dev.txt"),
+                       help="对比报告使用的评估数据.")
+    parse.add_argument("--num_eval_samples", type=int, default=500,
+                       help="对比报告使用的评估样本数.")
+    parse.add_argument("--report_file", type=str,
+                       default=os.path.join(work_path, "data/quantization_report.json"),
+                       help="对比报告保存路径.")
+    parse.add_argument("--dtype", type=str, default="fp32",
+                       help="运算过程中数据类型.")
+    parse.add_argument("--param_set", type=str, default="tiny",
+                       help="模型结构配置参数")
+    args = parse.parse_args()
+
+    params = PARAMS_MAP[args.param_set].copy()
+
+    params["vocab_file"] = args.vocab_file
+    params["serving_model_dir"] = args.serving_model_dir
+    params["tflite_file"] = args.tflite_file
+    params["quant_mode"] = args.quant_mode
+    params["data_train"] = args.data_train
+    params["num_calibration_samples"] = args.num_calibration_samples
+    params["data_dev"] = args.data_dev
+    params["num_eval_samples"] = args.num_eval_samples
+    params["report_file"] = args.report_file
+    params["dtype"] = flags_core.get_tf_dtype(args)
+
+    return params
+
+
+def load_samples(data_file, params, num_samples):
+    """按 dataset.init_dataset_from_text_file 编码前 num_samples 条数据, 返回 (inputs, segments, masks) 与目标句"""
+    ds = dataset.init_dataset_from_text_file(data_file, params["vocab_file"],
+                                             max_length_source=params["max_length_source"],
+                                             max_length_target=params["max_length_target"])
+    samples = []
+    for example in ds.take(num_samples):
+        samples.append((example["inputs"].numpy()[None, :],
+                        example["segments"].numpy()[None, :],
+                        example["masks"].numpy()[None, :]))
+
+    with codecs.open(data_file, 'r', encoding='utf-8') as fp:
+        lines = [line.strip() for line in fp if line.strip()]
+    labels = [line.split("\t")[-1] for line in lines[:len(samples)]]
+
+    return samples, labels
+
+
+def convert_to_tflite(params):
+    """SavedModel 转换为 int8 TFLite 模型"""
+    converter = tf.lite.TFLiteConverter.from_saved_model(
+        params["serving_model_dir"], signature_keys=[SERVING_SIGNATURE])
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    # 解码循环中的部分算子没有 TFLite builtin 实现
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS,
+                                           tf.lite.OpsSet.SELECT_TF_OPS]
+
+    if params["quant_mode"] == "calibrated":
+        logger.info("Calibrate on {} samples of {}".format(
+            params["num_calibration_samples"], params["data_train"]))
+        calibration_samples, _ = load_samples(params["data_train"], params,
+                                              params["num_calibration_samples"])
+
+        def representative_dataset():
+            for inputs, segments, masks in calibration_samples:
+                yield {"inputs": inputs, "segments": segments, "masks": masks}
+
+        converter.representative_dataset = representative_dataset
+
+    tflite_model = converter.convert()
+    with open(params["tflite_file"], mode="wb") as fw:
+        fw.write(tflite_model)
+    logger.info("Save quantized model to {}, size: {:.2f}MB".format(
+        params["tflite_file"], len(tflite_model) / 1024 / 1024))
+
+    return params["tflite_file"]
+
+
+class TFLiteModel(object):
+    """TFLite 模型, 调用方式与 ServingModel 保持一致"""
+    def __init__(self, tflite_file, num_threads=None):
+        self.interpreter = tf.lite.Interpreter(model_path=tflite_file, num_threads=num_threads)
+        self.input_details = {}
+        for detail in self.interpreter.get_input_details():
+            for name in ("inputs", "segments", "masks"):
+                if detail["name"].endswith("_" + name) or detail["name"].endswith("_" + name + ":0"):
+                    self.input_details[name] = detail
+        # outputs 为 int32, scores 为 float32
+        self.outputs_detail = [detail for detail in self.interpreter.get_output_details()
+                               if detail["dtype"] == np.int32][0]
+        self.input_shape = None
+
+    def __call__(self, inputs, training=False):
+        inputs = dict(zip(("inputs", "segments", "masks"), inputs))
+        input_shape = np.shape(inputs["inputs"])
+        if input_shape != self.input_shape:
+            for name, detail in self.input_details.items():
+                self.interpreter.resize_tensor_input(detail["index"], input_shape)
+            self.interpreter.allocate_tensors()
+            self.input_shape = input_shape
+        for name, detail in self.input_details.items():
+            self.interpreter.set_tensor(detail["index"], np.asarray(inputs[name], dtype=np.int32))
+        self.interpreter.invoke()
+
+        return self.interpreter.get_tensor(self.outputs_detail["index"])
+
+
+def evaluate_model(model, samples, labels, subtokenizer):
+    """逐条请求推理, 返回评估指标与单请求耗时(ms)"""
+    predicts, latencies = [], []
+    for inputs in samples:
+        start = time.perf_counter()
+        outputs = model(inputs, training=False)
+        if isinstance(outputs, tuple):
+            outputs = outputs[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+        predicts.append(_trim_and_decode(np.asarray(outputs)[0], subtokenizer))
+
+    scores = Metrics.all_scores(predicts, labels, num_workers=1)
+    scores["latency_ms_mean"] = float(np.mean(latencies))
+    scores["latency_ms_p50"] = float(np.percentile(latencies, 50))
+    scores["latency_ms_p95"] = float(np.percentile(latencies, 95))
+
+    return scores
+
+
+def main():
+    """主函数"""
+    params = set_parameters()
+    convert_to_tflite(params)
+
+    subtokenizer = tokenizer.Subtokenizer(params["vocab_file"])
+    samples, labels = load_samples(params["data_dev"], params, params["num_eval_samples"])
+
+    report = {"quant_mode": params["quant_mode"], "num_samples": len(samples)}
+    logger.info("Evaluate fp32 model")
+    report["fp32"] = evaluate_model(ServingModel(params["serving_model_dir"]), samples, labels, subtokenizer)
+    logger.info("Evaluate int8 model")
+    report["int8"] = evaluate_model(TFLiteModel(params["tflite_file"]), samples, labels, subtokenizer)
+    report["speedup"] = report["fp32"]["latency_ms_mean"] / report["int8"]["latency_ms_mean"]
+
+    for name in ("fp32", "int8"):
+        logger.info("{}: bleu4: {:.3f}, rouge_l: {:.3f}, em: {:.3f}, latency mean/p50/p95: "
+                    "{:.2f}/{:.2f}/{:.2f} ms".format(name, report[name]["bleu4"], report[name]["rouge_l"],
+                                                     report[name]["em"], report[name]["latency_ms_mean"],
+                                                     report[name]["latency_ms_p50"],
+                                                     report[name]["latency_ms_p95"]))
+    logger.info("speedup: {:.2f}x".format(report["speedup"]))
+    with open(params["report_file"], mode="w", encoding="utf-8") as fw:
+        json.dump(report, fw, ensure_ascii=False, indent=2)
+
+    return report
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format="[%(asctime)s %(filename)s: %(lineno)s] %(message)s",
+                        datefmt="%Y-%m-%d %H:%M:%S",
+                        level=logging.INFO,
+                        filename=None,
+                        filemode="a")  # set logging
+    main()
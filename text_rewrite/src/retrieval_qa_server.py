@@ -38,6 +38,8 @@ def set_parameters():
                        help="运算过程中数据类型.")
     parse.add_argument("--param_set", type=str, default="tiny",
                        help="模型结构配置参数.")
+    parse.add_argument("--serving_model_dir", type=str, default=None,
+                       help="export_model.py 导出的 SavedModel 路径, 设置后使用计算图推理.")
     parse.add_argument("--words_file", type=str,
                        default=os.path.join(work_root, "models/tencent_words/1000000-small.words"),
                        help="词汇表.")
@@ -57,6 +59,7 @@ def set_parameters():
     params["vocab_file"] = args.vocab_file
     params["model_dir"] = args.model_dir
     params["dtype"] = flags_core.get_tf_dtype(args)
+    params["serving_model_dir"] = args.serving_model_dir
     params["words_file"] = args.words_file
     params["features_file"] = args.features_file
     params["docs_file"] = args.docs_file
@@ -3,6 +3,8 @@
 """
 import os
 os.environ["CUDA_VISIBLE_DEVICES"] = "2"
+import time
+import resource
 import tempfile
 import numpy as np
 
@@ -177,9 +179,9 @@ def translate_and_compute_bleu(model,
 
     # Compute evaluate metrics
     logging.info("Compute evaluate metrics")
-    Metrics.bleu_score(predicts, labels)
-    Metrics.rouge_score(predicts, labels)
-    em_score = Metrics.em_score(predicts, labels)
+    # no process pool: forking the running TF training process may deadlock
+    scores = Metrics.all_scores(predicts, labels, num_workers=1)
+    em_score = scores["em"]
 
     return em_score
 
@@ -210,6 +212,99 @@ def evaluate_and_log_bleu(model,
     return em_score
 
 
+def _peak_memory_mb():
+    """Peak device memory of GPU:0 if available, else peak RSS of the process."""
+    if tf.config.list_physical_devices("GPU"):
+        try:
+            return tf.config.experimental.get_memory_info("GPU:0")["peak"] / 1024 / 1024
+        except (AttributeError, ValueError):
+            pass
+    # ru_maxrss is in KB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class TrainInstrumentation(object):
+    """Per-step timing, input-wait vs compute split, tokens/sec and profiler trace window.
+
+    Input wait is the wall time between the end of the previous train step and
+    the start of the current one (i.e. waiting on `dataset.py`), compute is the
+    train step itself, synchronized by fetching the loss.
+    """
+    def __init__(self, log_steps=100, trace_steps=None, logdir=None, enable_tensorboard=False):
+        self.log_steps = max(log_steps, 1)
+        self.logdir = logdir
+        self.enable_tensorboard = enable_tensorboard
+        self.trace_start, self.trace_end = None, None
+        if trace_steps:
+            self.trace_start, self.trace_end = [int(x) for x in trace_steps.split(",")]
+        self.is_tracing = False
+        self._reset_window()
+        self.last_step_end = time.perf_counter()
+        self.step_begin_time = self.last_step_end
+
+    def _reset_window(self):
+        self.window_steps = 0
+        self.window_input_wait = 0.
+        self.window_compute = 0.
+        self.window_tokens = 0
+        self.window_examples = 0
+
+    def start_epoch(self):
+        """Don't count the evaluation/checkpointing between epochs as input wait."""
+        self.last_step_end = time.perf_counter()
+
+    def step_begin(self, step):
+        if self.trace_start is not None and step == self.trace_start and self.logdir:
+            logging.info("Start profiler trace at step {}".format(step))
+            tf.profiler.experimental.start(self.logdir)
+            self.is_tracing = True
+        self.step_begin_time = time.perf_counter()
+        self.window_input_wait += self.step_begin_time - self.last_step_end
+
+    def step_end(self, step, inputs, loss):
+        _ = loss.numpy()  # wait for the step to finish
+        self.last_step_end = time.perf_counter()
+        self.window_compute += self.last_step_end - self.step_begin_time
+
+        inputs, _, _, targets = inputs[0]
+        self.window_tokens += int(tf.math.count_nonzero(inputs)) + int(tf.math.count_nonzero(targets))
+        self.window_examples += int(tf.shape(inputs)[0])
+        self.window_steps += 1
+
+        if self.is_tracing and step >= self.trace_end:
+            tf.profiler.experimental.stop()
+            self.is_tracing = False
+            logging.info("Stop profiler trace at step {}, saved to {}".format(step, self.logdir))
+
+        if (step + 1) % self.log_steps == 0:
+            self.log(step)
+            # don't count the logging itself as input wait
+            self.last_step_end = time.perf_counter()
+
+    def log(self, step):
+        total = self.window_input_wait + self.window_compute
+        stats = {
+            "step_time_ms": total / self.window_steps * 1000,
+            "input_wait_ms": self.window_input_wait / self.window_steps * 1000,
+            "compute_ms": self.window_compute / self.window_steps * 1000,
+            "input_wait_ratio": self.window_input_wait / total if total else 0.,
+            "tokens_per_sec": self.window_tokens / total if total else 0.,
+            "examples_per_sec": self.window_examples / total if total else 0.,
+            "peak_memory_mb": _peak_memory_mb(),
+        }
+        logging.info("step {}: {}".format(step, ", ".join(
+            "{}: {:.2f}".format(name, value) for name, value in stats.items())))
+        if self.enable_tensorboard:
+            for name, value in stats.items():
+                tf.summary.scalar("perf/{}".format(name), value, step)
+        self._reset_window()
+
+    def close(self):
+        if self.is_tracing:
+            tf.profiler.experimental.stop()
+            self.is_tracing = False
+
+
 class TextRewriteTask(object):
     """Main entry of Transformer model."""
 
@@ -249,6 +344,8 @@ class TextRewriteTask(object):
         params["save_weights_only"] = flags_obj.save_weights_only
         params["bleu_source"] = flags_obj.bleu_source
         params["bleu_ref"] = flags_obj.bleu_ref
+        params["throughput_log_steps"] = flags_obj.throughput_log_steps
+        params["profiler_trace_steps"] = flags_obj.profiler_trace_steps
 
         # crate model and optimizer
         if params["use_keras_model"]:
@@ -336,16 +433,24 @@ class TextRewriteTask(object):
         # logging.info("data size: {}".format(len(train_ds)))
 
         train_loss_metric = tf.keras.metrics.Mean("training_loss", dtype=tf.float32)
+        summary_dir = os.path.join(params["model_dir"], "summary")
         if params["enable_tensorboard"]:
-            summary_writer = tf.summary.create_file_writer(os.path.join(params["model_dir"], "summary"))
+            summary_writer = tf.summary.create_file_writer(summary_dir)
+        instrumentation = TrainInstrumentation(log_steps=params["throughput_log_steps"],
+                                               trace_steps=params["profiler_trace_steps"],
+                                               logdir=summary_dir,
+                                               enable_tensorboard=params["enable_tensorboard"])
 
         with summary_writer.as_default():
             steps = 0
             for epoch in tf.range(1, params["epochs"]+1):
                 logging.info("Train epoch: {}".format(epoch))
+                instrumentation.start_epoch()
                 for batch_id, inputs in enumerate(tqdm(train_ds)):
                     train_loss_metric.reset_states()
+                    instrumentation.step_begin(steps)
                     loss = self.train_step(inputs, params)
+                    instrumentation.step_end(steps, inputs, loss)
                     # logging.info("loss: {}".format(loss))
 
                     train_loss_metric.update_state(loss)
@@ -369,6 +474,7 @@ class TextRewriteTask(object):
                 tf.summary.scalar("evaluate-loss", eval_loss, epoch.numpy())
                 summary_writer.flush()
 
+        instrumentation.close()
         summary_writer.close()
 
     def train_step(self, inputs, params):